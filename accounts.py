@@ -0,0 +1,72 @@
+import contextvars
+import os
+import re
+
+# Per-account data shards. Every Gmail account gets a directory
+# accounts/<name>/ holding its OAuth token, email store, attachment cache
+# and vector indexes; the OAuth client (credentials.json) and the embedding
+# model are shared. The "default" account is the single-account layout in
+# the working directory, so existing installs keep their data.
+
+ACCOUNTS_DIR = os.getenv("ACCOUNTS_DIR", "accounts")
+DEFAULT_ACCOUNT = 'default'
+
+# Account used by app.py helpers that are not given one explicitly. A
+# context variable, so every Streamlit session thread and worker job can
+# select its own account without passing it through every call.
+_active_account = contextvars.ContextVar('active_account', default=None)
+
+
+class Account:
+    def __init__(self, name):
+        if not re.fullmatch(r'[\w.@+-]+', name):
+            raise ValueError(f"Invalid account name {name!r}")
+        self.name = name
+        self.root = '.' if name == DEFAULT_ACCOUNT else os.path.join(ACCOUNTS_DIR, name)
+
+    def __repr__(self):
+        return f"Account({self.name!r})"
+
+    def path(self, filename):
+        return os.path.join(self.root, filename)
+
+    @property
+    def token_path(self):
+        return self.path('token.json')
+
+    @property
+    def store_path(self):
+        if self.name == DEFAULT_ACCOUNT:
+            return os.getenv("EMAIL_STORE", "email_store.db")
+        return self.path('email_store.db')
+
+    @property
+    def attachment_cache_path(self):
+        if self.name == DEFAULT_ACCOUNT:
+            return os.getenv("ATTACHMENT_CACHE", "attachment_cache")
+        return self.path('attachment_cache')
+
+    def create(self):
+        os.makedirs(self.root, exist_ok=True)
+        return self
+
+
+def list_accounts():
+    # Account directories, plus "default" when its store exists or when
+    # there is no other account yet
+    names = []
+    if os.path.isdir(ACCOUNTS_DIR):
+        names = sorted(name for name in os.listdir(ACCOUNTS_DIR)
+                       if os.path.isdir(os.path.join(ACCOUNTS_DIR, name)))
+    if not names or os.path.exists(Account(DEFAULT_ACCOUNT).store_path):
+        names.insert(0, DEFAULT_ACCOUNT)
+    return names
+
+
+def use_account(name):
+    _active_account.set(name)
+
+
+def get_account(name=None):
+    # Explicit name, else the active account, else MAIL_ACCOUNT, else default
+    return Account(name or _active_account.get() or os.getenv("MAIL_ACCOUNT") or DEFAULT_ACCOUNT)
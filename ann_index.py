@@ -0,0 +1,115 @@
+import os
+
+import numpy as np
+
+
+def nearest_centroids(vectors, centroids, chunk=8192):
+    # Index of the highest-cosine centroid for every (normalized) vector
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk):
+        labels[start:start + chunk] = np.argmax(vectors[start:start + chunk] @ centroids.T, axis=1)
+    return labels
+
+
+def train_centroids(vectors, nlist, iterations=10, sample_size=None, seed=0):
+    # Spherical k-means on a random sample of the vectors
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), sample_size or nlist * 32)
+    sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))])
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        labels = nearest_centroids(sample, centroids)
+        # Per-centroid sums via one sort + reduceat (np.add.at is far slower)
+        order = np.argsort(labels, kind='stable')
+        counts = np.bincount(labels, minlength=nlist)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        empty = counts == 0
+        sums = np.zeros_like(centroids)
+        sums[~empty] = np.add.reduceat(sample[order], starts[~empty], axis=0)
+        # Re-seed empty lists so every centroid keeps pulling its weight
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-10)
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate index over the rows of a VectorIndex.
+
+    Rows are bucketed by their nearest of nlist k-means centroids; a query
+    scores the centroids and only scans the rows of the nprobe closest
+    buckets. The index stores one centroid id per row and mirrors the row
+    moves VectorIndex makes on removal, so it can be appended to and
+    shrunk without retraining.
+    """
+
+    def __init__(self, centroids, assign, nprobe=32, trained_size=None):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.assign = np.asarray(assign, dtype=np.int32)
+        self.nprobe = nprobe
+        self.trained_size = trained_size or len(self.assign)
+        self._order = None
+        self._offsets = None
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, vectors, nlist=None, nprobe=32, iterations=10, seed=0):
+        nlist = nlist or max(16, int(4 * np.sqrt(len(vectors))))
+        nlist = min(nlist, len(vectors))
+        centroids = train_centroids(vectors, nlist, iterations=iterations, seed=seed)
+        return cls(centroids, nearest_centroids(vectors, centroids), nprobe=nprobe,
+                   trained_size=len(vectors))
+
+    # --- Row bookkeeping, called by VectorIndex ---
+
+    def set_rows(self, rows, vectors):
+        rows = np.asarray(rows, dtype=np.int64)
+        size = int(rows.max()) + 1 if len(rows) else 0
+        if size > len(self.assign):
+            self.assign = np.concatenate([self.assign, np.zeros(size - len(self.assign), dtype=np.int32)])
+        self.assign[rows] = nearest_centroids(vectors, self.centroids)
+        self._order = None
+
+    def move(self, src, dst):
+        self.assign[dst] = self.assign[src]
+        self._order = None
+
+    def truncate(self, size):
+        self.assign = self.assign[:size]
+        self._order = None
+
+    # --- Search ---
+
+    def _build_lists(self):
+        if self._order is None:
+            self._order = np.argsort(self.assign, kind='stable')
+            self._offsets = np.searchsorted(self.assign[self._order], np.arange(self.nlist + 1))
+
+    def candidate_rows(self, query_vec, nprobe=None):
+        self._build_lists()
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        centroid_scores = self.centroids @ query_vec
+        probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        return np.concatenate([self._order[self._offsets[c]:self._offsets[c + 1]] for c in probe])
+
+    # --- Persistence ---
+
+    def save(self, path):
+        np.savez(path + '.tmp.npz', centroids=self.centroids, assign=self.assign,
+                 trained_size=self.trained_size)
+        os.replace(path + '.tmp.npz', path + '.npz')
+
+    @classmethod
+    def load(cls, path, nprobe=32):
+        if not os.path.exists(path + '.npz'):
+            return None
+        try:
+            data = np.load(path + '.npz')
+            return cls(data['centroids'], data['assign'], nprobe=nprobe,
+                       trained_size=int(data['trained_size']))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error loading ANN index {path}: {e}")
+            return None
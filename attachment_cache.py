@@ -0,0 +1,204 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_blobs_last_used ON blobs(last_used);
+
+CREATE TABLE IF NOT EXISTS attachments (
+    message_id TEXT NOT NULL,
+    attachment_id TEXT NOT NULL,
+    digest TEXT NOT NULL REFERENCES blobs(name) ON DELETE CASCADE,
+    PRIMARY KEY (message_id, attachment_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_attachments_digest ON attachments(digest);
+
+CREATE TABLE IF NOT EXISTS previews (
+    digest TEXT PRIMARY KEY,
+    pages INTEGER NOT NULL
+);
+"""
+
+
+class AttachmentCache:
+    """
+    On-disk cache of downloaded attachments and their rendered previews.
+
+    Attachment bytes are stored once per content hash under <root>/blobs,
+    so the same file sent in many threads takes the space of one copy;
+    (message id, attachment id) pairs map onto those blobs. PNG page
+    previews are blobs too, keyed by the content hash and page number, so
+    they survive reruns and sessions. A SQLite manifest tracks blob sizes
+    and last use, and the least recently used blobs are evicted once the
+    total passes max_bytes.
+    """
+
+    def __init__(self, root='attachment_cache', max_bytes=256 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.RLock()
+        self.stats = {'hits': 0, 'misses': 0, 'preview_hits': 0, 'preview_misses': 0, 'evictions': 0}
+        os.makedirs(os.path.join(root, 'blobs'), exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(root, 'manifest.db'), check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA foreign_keys=ON')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    @staticmethod
+    def digest(data):
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def preview_name(digest, page):
+        return f"{digest}-p{page}.png"
+
+    def _blob_path(self, name):
+        return os.path.join(self.root, 'blobs', name[:2], name)
+
+    # --- Blobs ---
+
+    def _read_blob(self, name):
+        # Caller holds self.lock. A blob missing from disk drops out of the
+        # manifest and counts as a miss.
+        row = self.conn.execute('SELECT 1 FROM blobs WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return None
+        try:
+            with open(self._blob_path(name), 'rb') as f:
+                data = f.read()
+        except OSError:
+            with self.conn:
+                self.conn.execute('DELETE FROM blobs WHERE name = ?', (name,))
+            return None
+        with self.conn:
+            self.conn.execute('UPDATE blobs SET last_used = ? WHERE name = ?', (time.time(), name))
+        return data
+
+    def _write_blob(self, name, data):
+        # Caller holds self.lock. Returns False for blobs larger than the
+        # whole budget, which are not cached.
+        if len(data) > self.max_bytes:
+            return False
+        path = self._blob_path(name)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+        # An upsert, not INSERT OR REPLACE: replacing the row would delete
+        # it first and cascade to every attachment already mapped onto it
+        with self.conn:
+            self.conn.execute(
+                """INSERT INTO blobs (name, size, last_used) VALUES (?, ?, ?)
+                   ON CONFLICT(name) DO UPDATE SET last_used = excluded.last_used, size = excluded.size""",
+                (name, len(data), time.time())
+            )
+        self._evict(keep=name)
+        return True
+
+    def _evict(self, keep=None):
+        total = self.size()
+        if total <= self.max_bytes:
+            return
+        for row in self.conn.execute('SELECT name, size FROM blobs ORDER BY last_used').fetchall():
+            if total <= self.max_bytes:
+                break
+            name, size = row
+            if name == keep:
+                continue
+            with self.conn:
+                self.conn.execute('DELETE FROM blobs WHERE name = ?', (name,))
+            try:
+                os.remove(self._blob_path(name))
+            except OSError:
+                pass
+            total -= size
+            self.stats['evictions'] += 1
+
+    def size(self):
+        with self.lock:
+            return self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+
+    # --- Attachments ---
+
+    def get(self, message_id, attachment_id):
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT digest FROM attachments WHERE message_id = ? AND attachment_id = ?',
+                (message_id, attachment_id)
+            ).fetchone()
+            data = self._read_blob(row[0]) if row else None
+            self.stats['hits' if data is not None else 'misses'] += 1
+            metrics.count('cache.lookup', cache='attachment', result='hit' if data is not None else 'miss')
+            return data
+
+    @metrics.timed('cache.write', cache='attachment')
+    def put(self, message_id, attachment_id, data):
+        digest = self.digest(data)
+        with self.lock:
+            if self._write_blob(digest, data):
+                with self.conn:
+                    self.conn.execute(
+                        """INSERT OR REPLACE INTO attachments (message_id, attachment_id, digest)
+                           VALUES (?, ?, ?)""",
+                        (message_id, attachment_id, digest)
+                    )
+        return digest
+
+    def get_or_fetch(self, message_id, attachment_id, fetch):
+        """
+        Cached attachment bytes, calling fetch() and caching the result on
+        a miss. A None from fetch is returned as is and not cached.
+        """
+        data = self.get(message_id, attachment_id)
+        if data is None:
+            data = fetch()
+            if data is not None:
+                self.put(message_id, attachment_id, data)
+        return data
+
+    # --- Previews ---
+
+    def get_previews(self, data):
+        # Cached PNG pages for the file data, or None unless all are present
+        digest = self.digest(data)
+        with self.lock:
+            row = self.conn.execute('SELECT pages FROM previews WHERE digest = ?', (digest,)).fetchone()
+            pages = None
+            if row is not None:
+                pages = [self._read_blob(self.preview_name(digest, n)) for n in range(row[0])]
+                if any(page is None for page in pages):
+                    pages = None
+            self.stats['preview_hits' if pages is not None else 'preview_misses'] += 1
+            metrics.count('cache.lookup', cache='preview', result='hit' if pages is not None else 'miss')
+            return pages
+
+    @metrics.timed('cache.write', cache='preview')
+    def put_previews(self, data, pages):
+        digest = self.digest(data)
+        with self.lock:
+            for n, png in enumerate(pages):
+                self._write_blob(self.preview_name(digest, n), png)
+            with self.conn:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO previews (digest, pages) VALUES (?, ?)', (digest, len(pages))
+                )
+
+    def get_stats(self):
+        with self.lock:
+            count = self.conn.execute('SELECT COUNT(*) FROM blobs').fetchone()[0]
+            return dict(self.stats, blobs=count, bytes=self.size(), max_bytes=self.max_bytes)
@@ -0,0 +1,161 @@
+import argparse
+import hashlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import fitz  # PyMuPDF
+
+# Attachment types whose text is extracted: PyMuPDF document formats by
+# the filetype fitz expects, and plain text decoded as one page
+FITZ_TYPES = {
+    'application/pdf': 'pdf',
+    'application/epub+zip': 'epub',
+    'application/vnd.ms-xpsdocument': 'xps',
+    'application/oxps': 'xps',
+}
+TEXT_TYPES = {'text/plain', 'text/csv', 'text/markdown'}
+EXTRACTABLE_TYPES = sorted(set(FITZ_TYPES) | TEXT_TYPES)
+
+# Pages extracted per document; later pages are rarely what mail is about
+MAX_PAGES = 50
+
+# Seconds between index saves. A save rewrites the whole attachment index,
+# so saving per batch would make a long run quadratic in its output.
+SAVE_EVERY = 30.0
+
+
+def extract_text(data, mime_type, max_pages=MAX_PAGES):
+    """
+    Page texts of an attachment. Runs in a worker process, so it only
+    takes and returns plain picklable values.
+    """
+    if mime_type in TEXT_TYPES:
+        return [data.decode('utf-8', errors='replace')]
+    with fitz.open(stream=data, filetype=FITZ_TYPES[mime_type]) as doc:
+        if doc.is_encrypted:
+            raise ValueError("document is encrypted")
+        return [doc.load_page(n).get_text() for n in range(min(max_pages, len(doc)))]
+
+
+def ingest_attachments(store, engine, download, workers=None, batch_size=16, limit=None, on_progress=None,
+                       save_every=SAVE_EVERY):
+    """
+    Download, extract and embed every attachment not ingested yet.
+
+    Extraction runs on a process pool (PyMuPDF parsing is CPU bound and
+    holds the GIL) while this thread downloads the next files. Results are
+    embedded batch_size attachments at a time; every save_every seconds,
+    and at the end, the indexes are saved and only then the attachments
+    recorded in the store, so an interrupted run resumes with the first
+    unrecorded attachment. Files whose content was already extracted
+    (the same PDF in many threads) reuse the stored page texts.
+
+    download(message_id, attachment_id) returns the file bytes or None;
+    failed downloads are retried on the next run, failed extractions are
+    recorded as errors and skipped. Returns {'done': n, 'error': n} for
+    this run.
+    """
+    pending = store.pending_attachments(EXTRACTABLE_TYPES, limit=limit)
+    counts = {'done': 0, 'error': 0}
+    if not pending:
+        return counts
+    workers = max(1, workers or os.cpu_count() or 1)
+    batch = []
+    # Embedded, but not recorded until the next index save
+    unsaved = []
+    last_save = time.monotonic()
+
+    def record(item, digest, pages, error=None):
+        batch.append((item, digest, pages, error))
+        if len(batch) >= batch_size:
+            flush()
+
+    def flush():
+        engine.index_attachments([
+            (item['message_id'], item['attachment_id'], item['filename'], pages)
+            for item, _, pages, error in batch if error is None
+        ], save=False)
+        for item, digest, pages, error in batch:
+            counts['error' if error else 'done'] += 1
+            if on_progress:
+                on_progress(counts['done'] + counts['error'], len(pending))
+        unsaved.extend(batch)
+        batch.clear()
+        if time.monotonic() - last_save >= save_every:
+            checkpoint()
+
+    def checkpoint():
+        nonlocal last_save
+        engine.save()
+        for item, digest, pages, error in unsaved:
+            store.save_attachment_text(item['message_id'], item['attachment_id'], digest, pages,
+                                       status='error' if error else 'done', error=error)
+        unsaved.clear()
+        last_save = time.monotonic()
+
+    def collect(future):
+        item, digest = futures.pop(future)
+        try:
+            record(item, digest, future.result())
+        except Exception as e:
+            print(f"Error extracting {item['filename']} from {item['message_id']}: {e}")
+            record(item, digest, [], error=str(e))
+
+    futures = {}
+    # Spawned, not forked: the caller (Streamlit, the worker) holds
+    # threads, an open SQLite connection and the embedding model, none of
+    # which a forked child may safely inherit. Children only import this
+    # module, which is cheap.
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        for item in pending:
+            data = download(item['message_id'], item['attachment_id'])
+            if data is None:
+                # Not recorded, so the next run tries the download again
+                counts['error'] += 1
+                continue
+            digest = hashlib.sha256(data).hexdigest()
+            pages = store.pages_for_digest(digest)
+            if pages is not None:
+                record(item, digest, pages)
+                continue
+            futures[pool.submit(extract_text, data, item['mime_type'])] = (item, digest)
+            # Bound the bytes held in flight to about 2x the pool size
+            while len(futures) >= 2 * workers:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future)
+        for future in list(futures):
+            collect(future)
+    if batch:
+        flush()
+    if unsaved:
+        checkpoint()
+    return counts
+
+
+def main():
+    # Offline run over the local store:  python -m attachment_ingest
+    parser = argparse.ArgumentParser(description="Extract and index the text of stored email attachments")
+    parser.add_argument('--workers', type=int, default=None, help="extraction processes (default: CPU count)")
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--limit', type=int, default=None, help="stop after this many attachments")
+    args = parser.parse_args()
+
+    from mail_backend import download_attachment, get_email_store, get_gmail_service
+    from mail_mentor import create_semantic_engine
+
+    # Works on the MAIL_ACCOUNT account (see accounts.py)
+    service = get_gmail_service()
+    counts = ingest_attachments(
+        get_email_store(), create_semantic_engine(),
+        lambda msg_id, att_id: download_attachment(service, msg_id, att_id),
+        workers=args.workers, batch_size=args.batch_size, limit=args.limit,
+        on_progress=lambda done, total: print(f"\r{done}/{total} attachments", end='', flush=True),
+    )
+    print(f"\nIndexed {counts['done']} attachments, {counts['error']} failed")
+
+
+if __name__ == '__main__':
+    main()
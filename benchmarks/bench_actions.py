@@ -0,0 +1,54 @@
+import argparse
+import asyncio
+import time
+
+from gmail_async import AsyncGmailClient
+from mock_gmail_server import MockGmail, start_mock_server
+
+# Bulk label-change throughput against the local mock Gmail server:
+#   python -m benchmarks.bench_actions --count 500 --latency 0.05 --concurrency 16
+
+
+async def run(args):
+    mock = MockGmail(count=args.count, latency=args.latency, error_rate=args.error_rate)
+    runner, base_url = await start_mock_server(mock)
+    msg_ids = list(mock.labels)
+    try:
+        async with AsyncGmailClient(lambda: 'mock-token', base_url=base_url, concurrency=args.concurrency,
+                                    base_delay=0.01, max_delay=0.5) as client:
+            scenarios = [
+                ('sequential modify', lambda: sequential(client, msg_ids)),
+                (f"async modify x{args.concurrency}", lambda: asyncio.gather(
+                    *(client.modify(msg_id, add_labels=['IMPORTANT']) for msg_id in msg_ids))),
+                ('batchModify', lambda: client.batch_modify(msg_ids, add_labels=['IMPORTANT'])),
+            ]
+            if args.skip_sequential:
+                scenarios = scenarios[1:]
+            for name, scenario in scenarios:
+                mock.requests = mock.throttled = 0
+                start = time.perf_counter()
+                await scenario()
+                elapsed = time.perf_counter() - start
+                print(f"{name:<22} {len(msg_ids) / elapsed:9.1f} msg/s  ({elapsed:.2f}s, "
+                      f"{mock.requests} requests, {mock.throttled} throttled)")
+    finally:
+        await runner.cleanup()
+
+
+async def sequential(client, msg_ids):
+    for msg_id in msg_ids:
+        await client.modify(msg_id, add_labels=['IMPORTANT'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Gmail label changes against a mock server")
+    parser.add_argument('--count', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds per mock request")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--skip-sequential', action='store_true')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import argparse
+import time
+
+import numpy as np
+
+from ann_index import IVFIndex
+
+# Recall/latency benchmark of the IVF index against exact search on
+# synthetic clustered vectors:
+#   python -m benchmarks.bench_ann --count 200000 --nprobe 4 8 16 32
+
+
+def synthetic_vectors(count, dim, topics, seed=0):
+    # Mail embeddings cluster by topic, so draw vectors around random centres
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((topics, dim)).astype(np.float32)
+    vectors = centres[rng.integers(0, topics, count)] + 0.6 * rng.standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def top_k(scores, k):
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def percentiles(latencies):
+    return np.percentile(latencies, 50) * 1000, np.percentile(latencies, 99) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark IVF recall@k and latency against exact search")
+    parser.add_argument('--count', type=int, default=200_000)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--topics', type=int, default=500)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--nlist', type=int, default=None)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[4, 8, 16, 32])
+    args = parser.parse_args()
+
+    vectors = synthetic_vectors(args.count, args.dim, args.topics)
+    queries = synthetic_vectors(args.queries, args.dim, args.topics, seed=1)
+
+    latencies, truth = [], []
+    for query in queries:
+        start = time.perf_counter()
+        truth.append(top_k(vectors @ query, args.k))
+        latencies.append(time.perf_counter() - start)
+    p50, p99 = percentiles(latencies)
+    print(f"exact            recall@{args.k} 1.000  p50 {p50:7.2f} ms  p99 {p99:7.2f} ms")
+
+    start = time.perf_counter()
+    ann = IVFIndex.build(vectors, nlist=args.nlist)
+    print(f"built IVF with {ann.nlist} lists over {args.count} vectors in {time.perf_counter() - start:.1f}s")
+
+    for nprobe in args.nprobe:
+        latencies, hits = [], 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            rows = ann.candidate_rows(query, nprobe=nprobe)
+            found = rows[top_k(vectors[rows] @ query, min(args.k, len(rows)))]
+            latencies.append(time.perf_counter() - start)
+            hits += len(np.intersect1d(found, expected))
+        p50, p99 = percentiles(latencies)
+        recall = hits / (args.k * len(queries))
+        print(f"ivf nprobe={nprobe:<4} recall@{args.k} {recall:.3f}  p50 {p50:7.2f} ms  p99 {p99:7.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import argparse
+import time
+
+from email_parser import parse_message
+from fake_gmail import FakeGmailService
+from gmail_fetch import GmailFetcher
+
+# Offline throughput benchmark for the fetch pipeline:
+#   python -m benchmarks.bench_fetch --count 500 --latency 0.05 --concurrency 1 4 8 16
+
+
+def run_sequential(service, msg_ids):
+    start = time.perf_counter()
+    for msg_id in msg_ids:
+        parse_message(service.users().messages().get(userId='me', id=msg_id, format='full').execute())
+    return time.perf_counter() - start
+
+
+def run_pool(service, msg_ids, concurrency, rate_limit):
+    fetcher = GmailFetcher(lambda: service, concurrency=concurrency, rate_limit=rate_limit,
+                           base_delay=0.05, max_delay=1.0)
+    start = time.perf_counter()
+    fetched = sum(1 for _ in fetcher.fetch(msg_ids))
+    return time.perf_counter() - start, fetched
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Gmail fetch throughput against a fake service")
+    parser.add_argument('--count', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds per fake API call")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of calls answered with 429")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--rate-limit', type=float, default=0, help="requests/second, 0 = unlimited")
+    parser.add_argument('--skip-sequential', action='store_true')
+    args = parser.parse_args()
+
+    service = FakeGmailService(count=args.count, latency=args.latency, error_rate=args.error_rate)
+    msg_ids = service.list_ids()
+
+    if not args.skip_sequential:
+        service.error_rate = 0.0
+        elapsed = run_sequential(service, msg_ids)
+        print(f"sequential      {args.count / elapsed:8.1f} msg/s  ({elapsed:.2f}s)")
+        service.error_rate = args.error_rate
+
+    for concurrency in args.concurrency:
+        service.calls = service.errors = 0
+        elapsed, fetched = run_pool(service, msg_ids, concurrency, args.rate_limit)
+        print(f"pool x{concurrency:<3}       {fetched / elapsed:8.1f} msg/s  ({elapsed:.2f}s, "
+              f"{fetched}/{args.count} fetched, {service.errors} throttled)")
+
+
+if __name__ == '__main__':
+    main()
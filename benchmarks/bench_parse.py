@@ -0,0 +1,128 @@
+import argparse
+import base64
+import glob
+import json
+import os
+import random
+import time
+
+from email_parser import parse_message
+from fake_gmail import WORDS, make_message
+
+# Parse throughput over a corpus of raw users.messages.get(format='full')
+# JSON payloads, one message (or a list of messages) per *.json file:
+#   python -m benchmarks.bench_parse --generate 2000 --corpus parse_corpus
+#   python -m benchmarks.bench_parse --corpus parse_corpus --repeat 5
+
+
+def legacy_parse_message(msg):
+    # The recursive += parser email_parser replaced, kept as the baseline
+    payload = msg['payload']
+    headers = payload.get('headers', [])
+
+    def get_header(name):
+        return next((h['value'] for h in headers if h['name'].lower() == name.lower()), '')
+
+    body = ''
+    attachments = []
+
+    def extract_parts(parts):
+        nonlocal body
+        for part in parts:
+            if part.get('mimeType') == 'text/plain':
+                data = part['body'].get('data')
+                if data:
+                    body += base64.urlsafe_b64decode(data.encode()).decode(errors='ignore')
+            elif part.get('filename'):
+                attachment_id = part['body'].get('attachmentId')
+                if attachment_id:
+                    attachments.append({'filename': part['filename'], 'attachment_id': attachment_id,
+                                        'mimeType': part['mimeType']})
+            if part.get('parts'):
+                extract_parts(part['parts'])
+
+    extract_parts(payload.get('parts', []))
+    return {'id': msg['id'], 'subject': get_header('Subject'), 'sender': get_header('From'),
+            'to': get_header('To'), 'date': get_header('Date'), 'body': body.strip()}
+
+
+def _b64(text):
+    return base64.urlsafe_b64encode(text.encode()).decode()
+
+
+def generate_corpus(path, count, seed=0):
+    # Mix of plain, multipart/alternative, HTML-only and very long mail
+    rng = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    for index in range(count):
+        msg = make_message(index, seed)
+        headers = msg['payload']['headers']
+        # Real mail carries a dozen or more headers before the ones we read
+        msg['payload']['headers'] = [
+            {'name': f"X-Header-{n}", 'value': 'x' * 40} for n in range(rng.randint(10, 30))
+        ] + headers
+        text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(50, 400)))
+        html = '<html><head><style>p {}</style></head><body>' + ''.join(
+            f"<p>{' '.join(text.split()[i:i + 20])}</p>" for i in range(0, len(text.split()), 20)
+        ) + '</body></html>'
+        kind = rng.random()
+        if kind < 0.4:
+            msg['payload']['parts'][0] = {'mimeType': 'multipart/alternative', 'filename': '', 'body': {}, 'parts': [
+                {'mimeType': 'text/plain', 'filename': '', 'body': {'data': _b64(text)}},
+                {'mimeType': 'text/html', 'filename': '', 'body': {'data': _b64(html)}},
+            ]}
+        elif kind < 0.6:
+            msg['payload']['parts'][0] = {'mimeType': 'text/html', 'filename': '', 'body': {'data': _b64(html)}}
+        elif kind < 0.65:
+            long_text = ' '.join(rng.choice(WORDS) for _ in range(200_000))
+            msg['payload']['parts'][0] = {'mimeType': 'text/plain', 'filename': '',
+                                          'body': {'data': _b64(long_text)}}
+        with open(os.path.join(path, f"{msg['id']}.json"), 'w') as f:
+            json.dump(msg, f)
+
+
+def load_corpus(path):
+    messages = []
+    for name in sorted(glob.glob(os.path.join(path, '*.json'))):
+        with open(name) as f:
+            data = json.load(f)
+        messages.extend(data if isinstance(data, list) else [data])
+    return messages
+
+
+def run(parse, messages, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for msg in messages:
+            parse(msg)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Gmail payload parsing throughput")
+    parser.add_argument('--corpus', default='parse_corpus', help="directory of raw message JSON files")
+    parser.add_argument('--generate', type=int, default=0, help="first write this many synthetic messages")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.generate:
+        generate_corpus(args.corpus, args.generate)
+    messages = load_corpus(args.corpus)
+    if not messages:
+        parser.error(f"no *.json payloads in {args.corpus}; use --generate N")
+    size_mb = sum(len(json.dumps(msg)) for msg in messages) / 2**20
+    empty = sum(1 for msg in messages if not legacy_parse_message(msg)['body'])
+    print(f"{len(messages)} messages, {size_mb:.1f} MB, {empty} with no text/plain body")
+
+    for name, parse in (('legacy', legacy_parse_message), ('email_parser', parse_message)):
+        elapsed = run(parse, messages, args.repeat)
+        print(f"{name:<14} {len(messages) / elapsed:9.1f} msg/s  {size_mb / elapsed:7.1f} MB/s  "
+              f"({elapsed:.3f}s best of {args.repeat})")
+    empty = sum(1 for msg in messages if not parse_message(msg)['body'])
+    print(f"email_parser leaves {empty} messages with an empty body")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.bench_ann import percentiles, synthetic_vectors
+from vector_index import VectorIndex
+
+# Memory, recall@k and latency of quantized / binary-prefiltered indexes
+# against the exact float32 scan SemanticSearchEngine.search uses today:
+#   python -m benchmarks.bench_quant --count 200000 --prefilter 300 2000
+
+
+def build(directory, name, ids, vectors, quantization, prefilter):
+    # ann_threshold above count keeps every search on the exact scan path
+    index = VectorIndex(f"{directory}/{name}", dim=vectors.shape[1], ann_threshold=len(ids) + 1,
+                        quantization=quantization, binary_prefilter=prefilter)
+    index.add(ids, vectors)
+    return index
+
+
+def run_queries(index, queries, k):
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append([msg_id for msg_id, _ in index.search(query, top_k=k, min_score=-1.0)])
+        latencies.append(time.perf_counter() - start)
+    return results, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark quantized embeddings against exact float32 search")
+    parser.add_argument('--count', type=int, default=200_000)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--topics', type=int, default=500)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--prefilter', type=int, nargs='+', default=[300, 2000],
+                        help="binary first-pass candidates per requested result")
+    args = parser.parse_args()
+
+    vectors = synthetic_vectors(args.count, args.dim, args.topics)
+    queries = synthetic_vectors(args.queries, args.dim, args.topics, seed=1)
+    ids = [str(i) for i in range(args.count)]
+
+    configs = [('float32', 0), ('float16', 0), ('int8', 0)]
+    configs += [(quantization, prefilter) for prefilter in args.prefilter for quantization in ('float32', 'int8')]
+    truth = None
+    with tempfile.TemporaryDirectory() as directory:
+        for quantization, prefilter in configs:
+            name = quantization + (f"+binary x{prefilter}" if prefilter else "")
+            index = build(directory, f"{quantization}_{prefilter}", ids, vectors, quantization, prefilter)
+            results, latencies = run_queries(index, queries, args.k)
+            if truth is None:
+                truth = results
+            hits = sum(len(set(found) & set(expected)) for found, expected in zip(results, truth))
+            recall = hits / (args.k * len(queries))
+            p50, p99 = percentiles(latencies)
+            print(f"{name:<20} {index.memory_bytes() / 2**20:8.1f} MB  recall@{args.k} {recall:.3f}  "
+                  f"p50 {p50:7.2f} ms  p99 {p99:7.2f} ms")
+            del index
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,351 @@
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import tempfile
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from benchmarks.mailbox import SIZES, ensure_mailbox, make_queries, read_mailbox
+from email_parser import parse_message
+from email_store import EmailStore
+from semantic_search import EMBEDDING_DIM, MODEL_NAME, SemanticSearchEngine
+
+# Scaling benchmark of the ingest and search hot paths on synthetic
+# mailboxes (see benchmarks/mailbox.py), with a stub embedding model so it
+# runs offline:
+#   python -m benchmarks.bench_suite --sizes 1000 10000 --out bench_results.json
+#   python -m benchmarks.bench_suite --sizes 1000 10000 --compare bench_results.json
+#   python -m benchmarks.bench_suite --sizes 1000 --model real
+#   python -m benchmarks.bench_suite --sizes 1000000 --repeat 1 --skip-load-all
+#
+# Stages, per mailbox size:
+#   parse         parse_message per payload (what parse_email does after the API call)
+#   save          EmailStore.upsert_many per batch (save_emails_to_local_storage)
+#   load_all      EmailStore.all (load_emails_from_local_storage)
+#   load_page     EmailStore.page at random offsets (the list view)
+#   embed         compute_and_save_embeddings per batch, indexes saved by the last
+#   search        SemanticSearchEngine.search over the whole index, caches cold
+#   smart_search  SemanticSearchEngine.smart_search with the store, caches cold
+#   smart_search_cached  each query again right away, as on a Streamlit rerun
+# Each stage reports items/s, p50/p99 latency per call and the peak RSS
+# sampled while it ran. Every size is run --repeat times on a fresh store;
+# the reported figures are the medians over the repeats and the per-repeat
+# values are kept under 'runs' for --compare.
+
+# A stage is reported as a regression when its median throughput drops, or
+# its median p99 grows, by more than these fractions against the --compare
+# run, and every repeat of this run is worse than every repeat of the
+# baseline. With five repeats on each side that rank test alone has a
+# 1 in 252 false alarm rate per stage and figure (one-sided Mann-Whitney U
+# of 0), where single runs on a shared host vary by 30% between repeats.
+# p99 comes from ~100 calls per repeat, so it gets more room. With fewer
+# repeats the rank test means nothing (one against one is a coin flip), so
+# --compare refuses to run unless both sides have at least REPEATS; runs
+# such as the --repeat 1 example above are for reading, not for gating.
+REGRESSION_THRESHOLD = 0.10
+P99_REGRESSION_THRESHOLD = 0.25
+REPEATS = 5
+RSS_SAMPLE_SECONDS = 0.01
+
+
+class StubModel:
+    """
+    Offline stand-in for the SentenceTransformer: a feature-hashed bag of
+    words, so texts sharing words get similar vectors and encode costs time
+    proportional to the text, without torch or a model download.
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def _vector(self, text):
+        columns = [zlib.crc32(word.encode()) % self.dim for word in re.findall(r'\w+', text.lower())]
+        return np.bincount(columns, minlength=self.dim).astype(np.float32) if columns else np.zeros(self.dim, np.float32)
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        if isinstance(texts, str):
+            return self._vector(texts)
+        vectors = np.stack([self._vector(text) for text in texts]) if texts else np.zeros((0, self.dim), np.float32)
+        return vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-10)
+
+
+def load_benchmark_model(name):
+    # 'stub', 'real' (MODEL_NAME from the local model cache) or the path of
+    # a SentenceTransformer directory
+    if name == 'stub':
+        return StubModel()
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(MODEL_NAME if name == 'real' else name)
+
+
+def rss_bytes():
+    # Current resident set size; where /proc is missing this falls back to
+    # the process peak, which still bounds every stage from above
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if platform.system() == 'Darwin' else peak * 1024
+
+
+class StageRecorder:
+    """
+    Latencies, item counts and peak RSS per stage. Stages may be entered
+    many times (parse and save alternate per batch); a sampler thread
+    charges the RSS it sees to whichever stage is running.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.current = None
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+
+    def _stage(self, name):
+        return self.stages.setdefault(name, {'latencies': [], 'items': 0, 'peak_rss': 0})
+
+    def _sample(self):
+        while not self._stop.wait(RSS_SAMPLE_SECONDS):
+            current = self.current
+            if current is not None:
+                stage = self._stage(current)
+                stage['peak_rss'] = max(stage['peak_rss'], rss_bytes())
+
+    def time(self, name, func, *args, items=1, **kwargs):
+        stage = self._stage(name)
+        self.current = name
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stage['latencies'].append(time.perf_counter() - start)
+            stage['items'] += items
+            stage['peak_rss'] = max(stage['peak_rss'], rss_bytes())
+            self.current = None
+
+    def close(self):
+        self._stop.set()
+        self._sampler.join()
+
+    def results(self):
+        results = {}
+        for name, stage in self.stages.items():
+            latencies = np.array(stage['latencies'])
+            seconds = float(latencies.sum())
+            results[name] = {
+                'calls': len(latencies),
+                'items': stage['items'],
+                'seconds': seconds,
+                'items_per_second': stage['items'] / seconds if seconds else 0.0,
+                'p50_ms': float(np.percentile(latencies, 50) * 1000),
+                'p99_ms': float(np.percentile(latencies, 99) * 1000),
+                'peak_rss_mb': stage['peak_rss'] / 2**20,
+            }
+        return results
+
+
+def run_size(args, size, model):
+    path = ensure_mailbox(args.data_dir, size, args.seed)
+    recorder = StageRecorder()
+    with tempfile.TemporaryDirectory(prefix='bench_suite_') as directory:
+        store = EmailStore(os.path.join(directory, 'email_store.db'))
+        engine = SemanticSearchEngine(
+            index_path=os.path.join(directory, 'email_embeddings'),
+            cache_path=os.path.join(directory, 'embedding_cache'),
+            chunk_index_path=os.path.join(directory, 'email_chunks'),
+            attachment_index_path=os.path.join(directory, 'attachment_chunks'),
+            dim=model.get_sentence_embedding_dimension(),
+        )
+        engine._model = model
+        try:
+            for batch in read_mailbox(path, args.batch):
+                emails = [recorder.time('parse', parse_message, msg) for msg in batch]
+                recorder.time('save', store.upsert_many, emails, items=len(emails))
+
+            if not args.skip_load_all:
+                emails = recorder.time('load_all', store.all, items=size)
+                del emails
+            rng = np.random.default_rng(args.seed)
+            for offset in rng.integers(0, max(1, size - 50), args.queries):
+                recorder.time('load_page', store.page, offset=int(offset), limit=50, items=1)
+
+            ids = store.ids()
+            for start in range(0, len(ids), args.embed_batch):
+                emails = store.get_many(ids[start:start + args.embed_batch])
+                # One save for the whole mailbox, as embed_missing does
+                last = start + args.embed_batch >= len(ids)
+                recorder.time('embed', engine.compute_and_save_embeddings, emails, save=last, items=len(emails))
+            del emails
+
+            queries = make_queries(args.queries, args.seed)
+            for name, search in (('search', lambda q: engine.search(q, None, min_score=args.min_score, store=store)),
+                                 ('smart_search', lambda q: engine.smart_search(q, None, min_score=args.min_score,
+                                                                                store=store))):
+                for query in queries:
+                    # Cold: no query vector or result from an earlier query
+                    engine._query_vectors.clear()
+                    engine._results.clear()
+                    recorder.time(name, search, query)
+                    if name == 'smart_search':
+                        recorder.time('smart_search_cached', search, query)
+            store.close()
+        finally:
+            recorder.close()
+    return recorder.results()
+
+
+def merge_runs(runs):
+    # Median of each figure over the repeats (peak RSS: the largest), with
+    # the per-repeat throughput and p99 kept for compare
+    merged = {}
+    for name in runs[0]:
+        stages = [run[name] for run in runs]
+        merged[name] = {key: float(np.median([stage[key] for stage in stages]))
+                        for key in ('seconds', 'items_per_second', 'p50_ms', 'p99_ms')}
+        merged[name].update(
+            calls=stages[0]['calls'],
+            items=stages[0]['items'],
+            peak_rss_mb=max(stage['peak_rss_mb'] for stage in stages),
+            runs={key: [stage[key] for stage in stages] for key in ('items_per_second', 'p99_ms')},
+        )
+    return merged
+
+
+def environment(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'model': args.model,
+        'seed': args.seed,
+        'batch': args.batch,
+        'embed_batch': args.embed_batch,
+        'queries': args.queries,
+        'repeat': args.repeat,
+    }
+
+
+def print_results(size, results):
+    print(f"\n{size} messages")
+    print(f"  {'stage':<20} {'items/s':>11} {'p50 ms':>9} {'p99 ms':>9} {'peak RSS MB':>12}")
+    for name, stage in results.items():
+        print(f"  {name:<20} {stage['items_per_second']:11.1f} {stage['p50_ms']:9.2f} "
+              f"{stage['p99_ms']:9.2f} {stage['peak_rss_mb']:12.1f}")
+
+
+def _runs(stage, key):
+    # Per-repeat values; results from before --repeat only have the one
+    return stage.get('runs', {}).get(key) or [stage[key]]
+
+
+def compare(baseline, current, threshold=REGRESSION_THRESHOLD, p99_threshold=P99_REGRESSION_THRESHOLD):
+    """
+    Print per-stage median changes against baseline; returns the
+    regressions. A change past its threshold only counts when the repeats
+    do not overlap (this run's best is worse than the baseline's worst),
+    so one noisy repeat cannot fail the comparison.
+    """
+    regressions = []
+    for size, stages in current['sizes'].items():
+        before = baseline.get('sizes', {}).get(size)
+        if not before:
+            continue
+        print(f"\n{size} messages vs {baseline['environment'].get('commit') or 'baseline'}")
+        for name, stage in stages.items():
+            old = before.get(name)
+            if not old or not old['items_per_second'] or not old['p99_ms']:
+                continue
+            throughput = stage['items_per_second'] / old['items_per_second'] - 1
+            p99 = stage['p99_ms'] / old['p99_ms'] - 1
+            slower = throughput < -threshold and (
+                max(_runs(stage, 'items_per_second')) < min(_runs(old, 'items_per_second')))
+            tail = p99 > p99_threshold and min(_runs(stage, 'p99_ms')) > max(_runs(old, 'p99_ms'))
+            flag = ''
+            if slower or tail:
+                flag = '  REGRESSION'
+                regressions.append((size, name))
+            print(f"  {name:<20} throughput {throughput:+7.1%}  p99 {p99:+7.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parse/store/embed/search scaling on synthetic mailboxes")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES[:2]),
+                        help=f"mailbox sizes (standard: {' '.join(map(str, SIZES))})")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default='bench_data', help="where generated mailboxes are kept")
+    parser.add_argument('--model', default='stub', help="'stub', 'real' or a local SentenceTransformer path")
+    parser.add_argument('--batch', type=int, default=1000, help="payloads per upsert_many call")
+    parser.add_argument('--embed-batch', type=int, default=10_000, help="emails per compute_and_save_embeddings call")
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--min-score', type=float, default=0.3)
+    parser.add_argument('--skip-load-all', action='store_true', help="skip EmailStore.all (slow past 1M messages)")
+    parser.add_argument('--repeat', type=int, default=REPEATS, help="runs per size; medians are reported")
+    parser.add_argument('--out', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help="relative median throughput drop reported as a regression")
+    parser.add_argument('--p99-threshold', type=float, default=P99_REGRESSION_THRESHOLD,
+                        help="relative median p99 growth reported as a regression")
+    args = parser.parse_args()
+    baseline = None
+    if args.compare:
+        # Checked before the run, which can take hours at large sizes
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        # Results from before --repeat are single runs
+        baseline_repeat = baseline.get('environment', {}).get('repeat', 1)
+        if min(args.repeat, baseline_repeat) < REPEATS:
+            parser.error(f"--compare needs at least {REPEATS} repeats on both sides "
+                         f"(this run: {args.repeat}, baseline: {baseline_repeat})")
+
+    model = load_benchmark_model(args.model)
+    current = {'environment': environment(args), 'sizes': {}}
+    # Repeats go round the sizes rather than back to back, so a slow spell
+    # of the machine lands in one repeat of several sizes, not in every
+    # repeat of one
+    runs = {size: [] for size in args.sizes}
+    for _ in range(max(1, args.repeat)):
+        for size in args.sizes:
+            runs[size].append(run_size(args, size, model))
+    for size in args.sizes:
+        results = current['sizes'][str(size)] = merge_runs(runs[size])
+        print_results(size, results)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(current, f, indent=2)
+        print(f"\nResults written to {args.out}")
+    if baseline is not None:
+        regressions = compare(baseline, current, args.threshold, args.p99_threshold)
+        if regressions:
+            raise SystemExit(f"{len(regressions)} stage(s) regressed by more than {args.threshold:.0%} "
+                             f"(throughput) or {args.p99_threshold:.0%} (p99)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+import argparse
+import base64
+import gzip
+import json
+import os
+import random
+import time
+
+from fake_gmail import LABELS, WORDS
+
+# Deterministic synthetic mailboxes of Gmail users.messages.get(format='full')
+# payloads, one JSON object per line (gzip-compressed when the name ends in
+# .gz). The same count and seed always give the same file, so runs of
+# bench_suite on different commits see identical mail:
+#   python -m benchmarks.mailbox --count 100000 --out bench_data/mailbox-100000-0.jsonl.gz
+
+# Standard sizes of bench_suite
+SIZES = (1_000, 10_000, 100_000, 1_000_000)
+
+DOMAINS = [f"{word}{n}.example.{tld}" for n, (word, tld) in enumerate(
+    (word, tld) for word in WORDS for tld in ('com', 'org', 'net'))]
+NAMES = "alice bob carol dave erin frank grace heidi ivan judy mallory oscar peggy trent".split()
+# Notification templates; copies differ only in numbers and names, like the
+# newsletter and alert floods dedup.py collapses
+TEMPLATES = [
+    "Your order {n} has shipped and will arrive on {day}. Track your delivery in your account.",
+    "Security alert: a new sign-in to your account from {name} device {n}. Review your security settings.",
+    "Weekly summary for {name}: {n} new updates, {m} comments and {day} reminders in your team project.",
+    "Payment receipt {n}: we received {m} for invoice {n}. Thank you for your payment.",
+]
+
+
+def _b64(text):
+    return base64.urlsafe_b64encode(text.encode()).decode()
+
+
+def _words(rng, low, high):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+
+def _html(text):
+    words = text.split()
+    return '<html><head><style>p {margin: 0}</style></head><body>' + ''.join(
+        f"<p>{' '.join(words[i:i + 20])}</p>" for i in range(0, len(words), 20)
+    ) + '</body></html>'
+
+
+def sender(n):
+    return f"{NAMES[n % len(NAMES)]}{n}@{DOMAINS[n % len(DOMAINS)]}"
+
+
+def make_mailbox_message(index, seed=0):
+    """
+    Payload number index of the mailbox seed: threads of up to four
+    messages, a few thousand senders across DOMAINS, a mix of plain,
+    multipart/alternative, HTML-only and templated notification mail,
+    and an attachment on one message in ten.
+    """
+    rng = random.Random(seed * 1000003 + index)
+    msg_id = f"{seed:04x}{index:012x}"
+    kind = rng.random()
+    if kind < 0.25:
+        template = rng.randrange(len(TEMPLATES))
+        body = TEMPLATES[template].format(n=rng.randint(1000, 99999), m=rng.randint(1, 500),
+                                          name=rng.choice(NAMES), day=rng.randint(1, 28))
+        subject = body.split(':')[0].split('.')[0][:60]
+        from_addr = f"noreply@{DOMAINS[template]}"
+    else:
+        body = _words(rng, 20, 400)
+        subject = _words(rng, 2, 7).capitalize()
+        # A few busy senders and a long tail
+        from_addr = sender(int(rng.paretovariate(1.2) * 10) % 5000)
+
+    if kind < 0.25 or kind >= 0.8:
+        content = {'mimeType': 'text/plain', 'filename': '', 'body': {'data': _b64(body)}}
+    elif kind < 0.65:
+        content = {'mimeType': 'multipart/alternative', 'filename': '', 'body': {}, 'parts': [
+            {'mimeType': 'text/plain', 'filename': '', 'body': {'data': _b64(body)}},
+            {'mimeType': 'text/html', 'filename': '', 'body': {'data': _b64(_html(body))}},
+        ]}
+    else:
+        content = {'mimeType': 'text/html', 'filename': '', 'body': {'data': _b64(_html(body))}}
+    parts = [content]
+    if rng.random() < 0.1:
+        parts.append({
+            'mimeType': 'application/pdf',
+            'filename': f"{rng.choice(WORDS)}.pdf",
+            'body': {'attachmentId': f"att-{msg_id}", 'size': rng.randint(10_000, 500_000)},
+        })
+
+    headers = [{'name': f"X-Header-{n}", 'value': 'x' * 40} for n in range(rng.randint(8, 20))]
+    headers += [
+        {'name': 'From', 'value': from_addr},
+        {'name': 'To', 'value': 'me@example.com'},
+        {'name': 'Subject', 'value': subject},
+        {'name': 'Date', 'value': time.strftime(
+            '%a, %d %b %Y %H:%M:%S +0000', time.gmtime(1600000000 + index * 300))},
+    ]
+    return {
+        'id': msg_id,
+        'threadId': f"{seed:04x}{index // 4:012x}" if rng.random() < 0.5 else msg_id,
+        'historyId': str(index + 1),
+        'labelIds': rng.sample(LABELS, rng.randint(1, 2)),
+        'snippet': body[:100],
+        'sizeEstimate': len(body) + 2000,
+        'payload': {'mimeType': 'multipart/mixed', 'headers': headers, 'parts': parts},
+    }
+
+
+def make_queries(count, seed=0):
+    # Search box input: topic words, sender/domain filters and "latest from"
+    rng = random.Random(seed + 7919)
+    queries = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.7:
+            queries.append(_words(rng, 1, 4))
+        elif kind < 0.9:
+            queries.append(f"{rng.choice(WORDS)} from {rng.choice(DOMAINS)}")
+        else:
+            queries.append(f"latest from {sender(rng.randrange(50))}")
+    return queries
+
+
+def mailbox_path(directory, count, seed=0):
+    return os.path.join(directory, f"mailbox-{count}-{seed}.jsonl.gz")
+
+
+def _open(path, mode, compressed):
+    if compressed:
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def write_mailbox(path, count, seed=0):
+    # Written to a temporary file first, so an interrupted run leaves no
+    # truncated mailbox behind
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with _open(tmp_path, 'w', compressed=path.endswith('.gz')) as f:
+        for index in range(count):
+            f.write(json.dumps(make_mailbox_message(index, seed), separators=(',', ':')))
+            f.write('\n')
+    os.replace(tmp_path, path)
+    return path
+
+
+def ensure_mailbox(directory, count, seed=0):
+    path = mailbox_path(directory, count, seed)
+    if not os.path.exists(path):
+        start = time.perf_counter()
+        write_mailbox(path, count, seed)
+        print(f"Generated {count} messages into {path} in {time.perf_counter() - start:.1f}s")
+    return path
+
+
+def read_mailbox(path, batch_size=1000):
+    # Lists of up to batch_size payloads, so a 1M mailbox never sits in memory
+    batch = []
+    with _open(path, 'r', path.endswith('.gz')) as f:
+        for line in f:
+            batch.append(json.loads(line))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a deterministic synthetic Gmail mailbox")
+    parser.add_argument('--count', type=int, default=10_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help="output .jsonl or .jsonl.gz file (default bench_data/mailbox-COUNT-SEED.jsonl.gz)")
+    args = parser.parse_args()
+
+    path = args.out or mailbox_path('bench_data', args.count, args.seed)
+    start = time.perf_counter()
+    write_mailbox(path, args.count, args.seed)
+    print(f"Wrote {args.count} messages ({os.path.getsize(path) / 2**20:.1f} MB) to {path} "
+          f"in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+import datetime
+import os
+import pickle
+import re
+import time
+from collections import Counter
+
+# Topic clusters over the email embeddings and a per-day digest of new
+# mail grouped by topic:
+#   python -m clustering            # update clusters with new mail
+#   python -m clustering --refit    # start over
+#   python -m clustering --digest 2024-05-01
+
+# Number of topics; a mailbox needs at least this many embedded emails
+N_CLUSTERS = int(os.getenv("TOPIC_CLUSTERS", 32))
+# Vectors per partial_fit / assignment step; bounds memory at any mailbox size
+BATCH_SIZE = 4096
+# A topic is named after the most common subject words of its closest members
+LABEL_SAMPLE = 50
+LABEL_WORDS = 3
+STOPWORDS = {
+    'the', 'and', 'for', 'you', 'your', 'with', 'from', 'this', 'that', 'are', 'our', 'has',
+    'have', 'was', 'will', 'new', 'now', 'not', 'all', 'get', 'out', 're', 'fw', 'fwd', 'to',
+}
+# Labels that keep mail out of the digest
+DIGEST_EXCLUDED_LABELS = ('SENT', 'DRAFT', 'TRASH', 'SPAM')
+
+
+def topic_label(subjects):
+    # Words found in the most subjects, e.g. "invoice, payment, due"
+    counts = Counter()
+    for subject in subjects:
+        counts.update({word for word in re.findall(r"[a-z][a-z']{2,}", (subject or '').lower())
+                       if word not in STOPWORDS})
+    return ', '.join(word for word, _ in counts.most_common(LABEL_WORDS))
+
+
+class TopicClusterer:
+    """
+    Incremental topic clustering of a VectorIndex with MiniBatchKMeans.
+
+    Each update feeds only the vectors of mail that has no topic yet to
+    partial_fit, batch_size at a time, then assigns them with the updated
+    centroids, so new mail costs time proportional to its own size and
+    memory stays at one batch. Earlier assignments are kept; refit=True
+    starts over when the topics have drifted. Assignments and distances
+    live in the store's topics table, names in its 'topic_labels' meta key
+    and the fitted model in <path>.pkl.
+    """
+
+    def __init__(self, path='email_topics', n_clusters=N_CLUSTERS, batch_size=BATCH_SIZE, seed=0):
+        self.path = path
+        self.n_clusters = n_clusters
+        # The first partial_fit call initializes all centroids from one batch
+        self.batch_size = max(batch_size, n_clusters)
+        self.seed = seed
+        self.model = None
+        self.last_update_stats = {}
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path + '.pkl'):
+            return
+        try:
+            with open(self.path + '.pkl', 'rb') as f:
+                model = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, AttributeError, EOFError) as e:
+            print(f"Error loading topic model {self.path}: {e}")
+            return
+        if model.n_clusters == self.n_clusters:
+            self.model = model
+
+    def save(self):
+        with open(self.path + '.tmp.pkl', 'wb') as f:
+            pickle.dump(self.model, f)
+        os.replace(self.path + '.tmp.pkl', self.path + '.pkl')
+
+    def update(self, index, store, refit=False):
+        """
+        Cluster the emails of index that have no topic yet. Returns the
+        update's stats, or None while there are fewer emails than topics.
+        """
+        from sklearn.cluster import MiniBatchKMeans
+
+        start = time.perf_counter()
+        if refit or self.model is None:
+            if len(index) < self.n_clusters:
+                return None
+            self.model = MiniBatchKMeans(n_clusters=self.n_clusters, batch_size=self.batch_size,
+                                         random_state=self.seed, n_init=3)
+            # Old assignments refer to another model's clusters
+            store.clear_topics()
+        assigned = store.topic_ids()
+        new_ids = [msg_id for msg_id in list(index.ids) if msg_id not in assigned]
+        if not new_ids:
+            return None
+        batches = [new_ids[i:i + self.batch_size] for i in range(0, len(new_ids), self.batch_size)]
+
+        for batch in batches:
+            self.model.partial_fit(index.vectors(batch))
+        fitted = time.perf_counter()
+        touched = set()
+        for batch in batches:
+            distances = self.model.transform(index.vectors(batch))
+            clusters = distances.argmin(axis=1)
+            store.set_topics(zip(batch, clusters.tolist(), distances.min(axis=1).tolist()))
+            touched.update(clusters.tolist())
+        assigned_at = time.perf_counter()
+
+        labels = store.get_meta('topic_labels') or {}
+        if refit:
+            labels = {}
+        for cluster in touched:
+            labels[str(cluster)] = topic_label(store.topic_subjects(cluster, LABEL_SAMPLE))
+        store.set_meta('topic_labels', labels)
+        self.save()
+
+        elapsed = time.perf_counter() - start
+        self.last_update_stats = {
+            'emails': len(new_ids),
+            'batches': len(batches),
+            'fit_seconds': fitted - start,
+            'assign_seconds': assigned_at - fitted,
+            'seconds': elapsed,
+            'emails_per_second': len(new_ids) / elapsed if elapsed else 0.0,
+        }
+        store.set_meta('topic_stats', self.last_update_stats)
+        print(f"Clustered {len(new_ids)} emails into {self.n_clusters} topics in {elapsed:.2f}s "
+              f"(fit {fitted - start:.2f}s, assign {assigned_at - fitted:.2f}s)")
+        return self.last_update_stats
+
+
+def daily_digest(store, day=None, per_topic=3):
+    """
+    Mail received on day (a date, default today) grouped by topic, largest
+    group first. Each group has 'cluster', 'label', 'count' and the
+    per_topic 'messages' closest to its centre; mail not clustered yet is
+    grouped under cluster None.
+    """
+    day = day or datetime.date.today()
+    start = datetime.datetime.combine(day, datetime.time())
+    end = start + datetime.timedelta(days=1)
+    labels = store.get_meta('topic_labels') or {}
+    groups = {}
+    for message in store.topic_digest(int(start.timestamp()), int(end.timestamp()), DIGEST_EXCLUDED_LABELS):
+        groups.setdefault(message['cluster'], []).append(message)
+    digest = [{
+        'cluster': cluster,
+        'label': labels.get(str(cluster)) or ("Not clustered yet" if cluster is None else f"Topic {cluster}"),
+        'count': len(messages),
+        'messages': messages[:per_topic],
+    } for cluster, messages in groups.items()]
+    digest.sort(key=lambda group: (group['cluster'] is None, -group['count']))
+    return digest
+
+
+def main():
+    import argparse
+
+    from mail_backend import get_email_store
+    from mail_mentor import create_semantic_engine, create_topic_clusterer
+
+    parser = argparse.ArgumentParser(description="Cluster stored emails into topics")
+    parser.add_argument('--refit', action='store_true', help="discard the model and cluster everything again")
+    parser.add_argument('--digest', metavar='YYYY-MM-DD', help="print the digest of one day instead")
+    args = parser.parse_args()
+
+    store = get_email_store()
+    if args.digest:
+        for group in daily_digest(store, datetime.date.fromisoformat(args.digest)):
+            print(f"{group['label']} ({group['count']})")
+            for message in group['messages']:
+                print(f"  {message['sender']}: {message['subject']}")
+        return
+    stats = create_topic_clusterer().update(create_semantic_engine().index, store, refit=args.refit)
+    if stats is None:
+        print("Nothing to cluster")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+import hashlib
+import re
+import time
+import zlib
+
+import numpy as np
+
+# Near-duplicate detection over email bodies with MinHash signatures and
+# LSH banding. Newsletters and notification floods differ only in names,
+# numbers and links; each body gets a NUM_PERM-value signature of its word
+# shingles, messages sharing any band of it become candidates, and
+# candidates whose signatures agree on at least THRESHOLD of their values
+# (the estimated Jaccard similarity) with a group's first message join
+# that group. Only the first message is embedded, and search results show
+# one message per group (and per Gmail thread).
+
+NUM_PERM = 128
+# 16 bands of 8 rows: pairs above ~0.7 similarity almost always share a band
+BANDS = 16
+SHINGLE_WORDS = 3
+THRESHOLD = 0.8
+
+# MinHash signature format; stored signatures of another version are
+# discarded and recomputed by find_duplicates
+SIGNATURE_VERSION = 2
+# One independent 64-bit hash function per signature value: the shingle's
+# 64-bit hash xor a random seed, through the splitmix64 finalizer (a
+# bijection whose every output bit depends on every input bit)
+_SEEDS = np.random.default_rng(20240501).integers(0, 2**63, NUM_PERM, dtype=np.uint64)
+_MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX2 = np.uint64(0x94D049BB133111EB)
+
+
+def shingles(text):
+    # Word trigrams with digits folded, so "Order 1234 shipped" and
+    # "Order 5678 shipped" look alike
+    words = re.findall(r'\w+', re.sub(r'\d+', '0', (text or '').lower()))
+    if len(words) < SHINGLE_WORDS:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def _mix(z):
+    # uint64 arithmetic wraps, which is what splitmix64 relies on
+    z = (z ^ (z >> np.uint64(30))) * _MIX1
+    z = (z ^ (z >> np.uint64(27))) * _MIX2
+    return z ^ (z >> np.uint64(31))
+
+
+def minhash(text):
+    # uint32 signature of text (the top bits of each minimum), or None when
+    # it has no words
+    found = shingles(text)
+    if not found:
+        return None
+    hashes = np.fromiter((int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'little')
+                          for s in found), dtype=np.uint64, count=len(found))
+    return (_mix(_SEEDS[:, None] ^ hashes[None, :]).min(axis=1) >> np.uint64(32)).astype(np.uint32)
+
+
+def band_keys(signature):
+    return [(band, zlib.crc32(rows.tobytes())) for band, rows in enumerate(signature.reshape(BANDS, -1))]
+
+
+def find_duplicates(store, threshold=THRESHOLD, batch_size=1000):
+    """
+    Sign every stored message that has no signature yet and assign it to a
+    near-duplicate group; incremental, so each sync only signs new mail.
+    Returns {'messages', 'duplicates', 'seconds'}.
+    """
+    start = time.perf_counter()
+    if store.get_meta('minhash_version') != SIGNATURE_VERSION:
+        # Signatures of another format cannot be compared with new ones
+        store.clear_signatures()
+        store.set_meta('minhash_version', SIGNATURE_VERSION)
+    processed = duplicates = 0
+    while True:
+        batch = store.unsigned_messages(batch_size)
+        if not batch:
+            break
+        # Messages of this batch, so duplicates within it are found too
+        local = {}
+        rows, buckets = [], []
+        for msg_id, text in batch:
+            signature = minhash(text)
+            if signature is None:
+                rows.append((msg_id, msg_id, None))
+                continue
+            keys = band_keys(signature)
+            candidates = {other_id: (representative, np.frombuffer(other, dtype=np.uint32))
+                          for other_id, representative, other in store.lsh_candidates(keys)}
+            candidates.update(match for key in keys for match in local.get(key, []))
+            best = msg_id
+            if candidates:
+                representatives, others = zip(*candidates.values())
+                scores = (np.stack(others) == signature).mean(axis=1)
+                if scores.max() >= threshold:
+                    best = representatives[int(scores.argmax())]
+            rows.append((msg_id, best, signature.tobytes()))
+            if best != msg_id:
+                duplicates += 1
+                continue
+            # Only group representatives are bucketed, so a flood of copies
+            # does not grow the buckets every later message is compared with
+            buckets += [(band, bucket, msg_id) for band, bucket in keys]
+            for key in keys:
+                local.setdefault(key, []).append((msg_id, (best, signature)))
+        store.save_signatures(rows, buckets)
+        processed += len(batch)
+    elapsed = time.perf_counter() - start
+    if processed:
+        print(f"Signed {processed} emails, {duplicates} near-duplicates, in {elapsed:.2f}s")
+    return {'messages': processed, 'duplicates': duplicates, 'seconds': elapsed}
+
+
+def collapse_results(results, store):
+    """
+    Keep the best-ranked result of every near-duplicate group and Gmail
+    thread; the kept copies count the others in 'collapsed'.
+    """
+    representatives = store.representatives([email['id'] for email in results])
+    seen = {}
+    collapsed = []
+    for email in results:
+        keys = [('group', representatives.get(email['id'], email['id']))]
+        if email.get('thread_id'):
+            keys.append(('thread', email['thread_id']))
+        kept = next((seen[key] for key in keys if key in seen), None)
+        if kept is not None:
+            kept['collapsed'] = kept.get('collapsed', 0) + 1
+            continue
+        kept = dict(email)
+        for key in keys:
+            seen[key] = kept
+        collapsed.append(kept)
+    return collapsed
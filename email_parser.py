@@ -0,0 +1,140 @@
+import base64
+import binascii
+import re
+from html.parser import HTMLParser
+
+# Body text kept per email. Longer mail is cut here: the embedding model
+# only sees the first few hundred words and the store stays small.
+MAX_BODY_CHARS = 100_000
+
+# The only headers parse_message reads, lower-cased
+WANTED_HEADERS = ('subject', 'from', 'to', 'date')
+
+CHARSET_RE = re.compile(r'charset="?([\w.:-]+)', re.IGNORECASE)
+
+
+class _HTMLText(HTMLParser):
+    # Visible text of an HTML body, one line per block element
+    SKIP = {'script', 'style', 'head', 'title'}
+    BLOCKS = {'br', 'p', 'div', 'tr', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+              'table', 'ul', 'ol', 'blockquote', 'hr'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.pieces = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self.skipping += 1
+        elif tag in self.BLOCKS:
+            self.pieces.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self.skipping = max(0, self.skipping - 1)
+        elif tag in self.BLOCKS:
+            self.pieces.append('\n')
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.pieces.append(data)
+
+
+def html_to_text(html):
+    parser = _HTMLText()
+    parser.feed(html)
+    parser.close()
+    # Collapse the runs of blank lines and indentation HTML mail is full of
+    lines = (' '.join(line.split()) for line in ''.join(parser.pieces).splitlines())
+    return '\n'.join(line for line in lines if line)
+
+
+def decode_data(data, charset='utf-8', max_chars=None):
+    """
+    Decode a base64url part body. With max_chars only the prefix that can
+    hold that many characters is decoded (UTF-8 needs at most 4 bytes per
+    character), so huge parts are never decoded in full.
+    """
+    if max_chars is not None:
+        data = data[:(max_chars * 4 + 2) // 3 * 4]
+    try:
+        raw = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+    except (binascii.Error, ValueError):
+        return ''
+    try:
+        text = raw.decode(charset, errors='ignore')
+    except LookupError:
+        text = raw.decode('utf-8', errors='ignore')
+    return text if max_chars is None else text[:max_chars]
+
+
+def part_charset(part):
+    for header in part.get('headers', ()):
+        if header['name'].lower() == 'content-type':
+            match = CHARSET_RE.search(header['value'])
+            return match.group(1) if match else 'utf-8'
+    return 'utf-8'
+
+
+def parse_message(msg, max_body=MAX_BODY_CHARS):
+    """
+    Turn a Gmail users.messages.get(format='full') response into an email
+    dict. Headers are read in one pass into a dict, the MIME tree is walked
+    without recursion, and text parts are decoded only up to max_body
+    characters and joined once. HTML is converted to text when the message
+    has no text/plain part.
+    """
+    payload = msg['payload']
+    headers = {}
+    for header in payload.get('headers', ()):
+        name = header['name'].lower()
+        if name in WANTED_HEADERS and name not in headers:
+            headers[name] = header['value']
+
+    plain, html, attachments = [], [], []
+    plain_chars = 0
+    # Depth-first in document order; the payload itself may be the only part
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        mime_type = part.get('mimeType', '')
+        body = part.get('body') or {}
+        if part.get('filename'):
+            if body.get('attachmentId'):
+                attachments.append({
+                    'filename': part['filename'],
+                    'attachment_id': body['attachmentId'],
+                    'mimeType': mime_type,
+                })
+        elif body.get('data'):
+            if mime_type == 'text/plain' and plain_chars < max_body:
+                text = decode_data(body['data'], part_charset(part), max_body - plain_chars)
+                plain.append(text)
+                plain_chars += len(text)
+            elif mime_type == 'text/html' and not plain:
+                html.append((body['data'], part_charset(part)))
+        if part.get('parts'):
+            stack.extend(reversed(part['parts']))
+
+    if plain:
+        body = ''.join(plain)
+    elif html:
+        # Markup takes several times the space of its text, so decode more
+        body = html_to_text(''.join(decode_data(data, charset, 4 * max_body) for data, charset in html))
+        body = body[:max_body]
+    else:
+        body = ''
+
+    return {
+        'id': msg['id'],
+        'thread_id': msg.get('threadId'),
+        'subject': headers.get('subject', ''),
+        'sender': headers.get('from', ''),
+        'to': headers.get('to', ''),
+        'date': headers.get('date', ''),
+        'snippet': msg.get('snippet'),
+        'body': body.strip(),
+        'attachments': attachments,
+        'labels': msg.get('labelIds', [])  # Gmail API returns labelIds
+    }
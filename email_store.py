@@ -0,0 +1,860 @@
+import datetime
+import json
+import os
+import re
+import sqlite3
+import threading
+from email.utils import parsedate_to_datetime
+
+import metrics
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    thread_id TEXT,
+    subject TEXT,
+    sender TEXT,
+    recipients TEXT,
+    date TEXT,
+    date_ts INTEGER,
+    snippet TEXT,
+    body TEXT,
+    stored_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_messages_sender ON messages(sender);
+
+-- date_ts is copied from the message, so a label's newest-first pages
+-- are a walk of one index (see PAGE_INDEXES)
+CREATE TABLE IF NOT EXISTS labels (
+    message_id TEXT NOT NULL REFERENCES messages(id) ON DELETE CASCADE,
+    label TEXT NOT NULL COLLATE NOCASE,
+    date_ts INTEGER,
+    PRIMARY KEY (message_id, label)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS attachments (
+    message_id TEXT NOT NULL REFERENCES messages(id) ON DELETE CASCADE,
+    attachment_id TEXT NOT NULL,
+    position INTEGER,
+    filename TEXT,
+    mime_type TEXT,
+    PRIMARY KEY (message_id, attachment_id)
+) WITHOUT ROWID;
+
+-- Attachment text extraction (attachment_ingest.py): one row per processed
+-- attachment, written together with its page texts so ingestion resumes
+-- exactly where it stopped
+CREATE TABLE IF NOT EXISTS attachment_ingest (
+    message_id TEXT NOT NULL REFERENCES messages(id) ON DELETE CASCADE,
+    attachment_id TEXT NOT NULL,
+    digest TEXT,
+    pages INTEGER,
+    status TEXT NOT NULL,
+    error TEXT,
+    processed_at TEXT,
+    PRIMARY KEY (message_id, attachment_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_attachment_ingest_digest ON attachment_ingest(digest);
+
+CREATE TABLE IF NOT EXISTS attachment_pages (
+    message_id TEXT NOT NULL REFERENCES messages(id) ON DELETE CASCADE,
+    attachment_id TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    text TEXT,
+    PRIMARY KEY (message_id, attachment_id, page)
+) WITHOUT ROWID;
+
+-- Work queue of the headless worker (mail_mentor.py)
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at TEXT,
+    started_at TEXT,
+    finished_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id);
+
+-- Write-behind log of local changes not yet applied in Gmail
+-- (write_behind.py). One row per message: op is the strongest pending
+-- change (delete > trash > labels) and snapshot the email's labels and
+-- metadata (not its body) as they were before the first of them, so the
+-- label delta is always "snapshot -> current" and a change Gmail rejects
+-- can be rolled back. revision counts the
+-- changes, so a flush only clears a row nothing was queued on meanwhile.
+CREATE TABLE IF NOT EXISTS pending_ops (
+    message_id TEXT PRIMARY KEY,
+    op TEXT NOT NULL,
+    snapshot TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    queued_at TEXT,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    revision INTEGER NOT NULL DEFAULT 0
+);
+
+-- Topic of every clustered email (clustering.py) and its distance to
+-- the topic centre, so digests can lead with the most typical mail
+CREATE TABLE IF NOT EXISTS topics (
+    message_id TEXT PRIMARY KEY REFERENCES messages(id) ON DELETE CASCADE,
+    cluster INTEGER NOT NULL,
+    distance REAL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_topics_cluster ON topics(cluster, distance);
+
+-- Near-duplicate groups (dedup.py): every signed message, the first
+-- message of its group (itself if it has no duplicate) and its MinHash
+-- signature, plus the LSH band buckets candidates are looked up in
+CREATE TABLE IF NOT EXISTS near_duplicates (
+    message_id TEXT PRIMARY KEY REFERENCES messages(id) ON DELETE CASCADE,
+    representative TEXT NOT NULL,
+    signature BLOB
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS lsh_buckets (
+    band INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    message_id TEXT NOT NULL REFERENCES messages(id) ON DELETE CASCADE,
+    PRIMARY KEY (band, bucket, message_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_lsh_buckets_message ON lsh_buckets(message_id);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Newest-first list order, (date_ts, id) descending, so page() can seek to
+# the row after the previous page instead of counting past OFFSET rows.
+# Created after the labels.date_ts migration in EmailStore.__init__.
+PAGE_INDEXES = """
+DROP INDEX IF EXISTS idx_messages_date;
+DROP INDEX IF EXISTS idx_labels_label;
+CREATE INDEX IF NOT EXISTS idx_messages_date_id ON messages(date_ts DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_labels_label_date ON labels(label, date_ts DESC, message_id DESC);
+"""
+
+# Full-text (BM25) index over subject, sender and body. It is an FTS5
+# external-content table kept in step with messages by triggers, so every
+# upsert and delete updates the inverted index incrementally.
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    subject, sender, body, content='messages', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, subject, sender, body)
+    VALUES (new.rowid, new.subject, new.sender, new.body);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, subject, sender, body)
+    VALUES ('delete', old.rowid, old.subject, old.sender, old.body);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF subject, sender, body ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, subject, sender, body)
+    VALUES ('delete', old.rowid, old.subject, old.sender, old.body);
+    INSERT INTO messages_fts(rowid, subject, sender, body)
+    VALUES (new.rowid, new.subject, new.sender, new.body);
+END;
+"""
+
+# Column weights for bm25(): a hit in the subject counts most
+BM25_WEIGHTS = (3.0, 2.0, 1.0)
+
+MESSAGE_COLUMNS = 'm.id, m.thread_id, m.subject, m.sender, m.recipients, m.date, m.snippet, m.body, m.stored_at'
+
+
+def fts_phrases(text):
+    # Each whitespace-separated term becomes a quoted FTS5 phrase, so ids
+    # like "INV-2024-0042" match as a unit and user input cannot inject
+    # FTS query syntax
+    phrases = []
+    for term in text.split():
+        tokens = re.findall(r'\w+', term.lower())
+        if tokens:
+            phrases.append('"' + ' '.join(tokens) + '"')
+    return phrases
+
+
+def date_to_timestamp(date):
+    # RFC 2822 header dates sort wrong as strings; index them as epoch seconds
+    try:
+        return int(parsedate_to_datetime(date).timestamp())
+    except (TypeError, ValueError, IndexError):
+        try:
+            return int(datetime.datetime.fromisoformat(date).timestamp())
+        except (TypeError, ValueError):
+            return 0
+
+
+class EmailStore:
+    """
+    SQLite (WAL mode) email storage with one row per message plus label and
+    attachment tables. Emails go in and come out as the same dicts that
+    parse_email produces, so it can sit behind the load/save helpers in
+    app.py; single-email label changes and deletes touch only their rows.
+    """
+
+    def __init__(self, path='email_store.db'):
+        self.path = path
+        self.lock = threading.RLock()
+        # Streamlit serves sessions from several threads, so one shared
+        # connection is guarded by self.lock instead of being thread-bound
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA foreign_keys=ON')
+        self.conn.executescript(SCHEMA)
+        if 'date_ts' not in {row['name'] for row in self.conn.execute('PRAGMA table_info(labels)')}:
+            # Stores from before labels carried the message date
+            with self.conn:
+                self.conn.execute('ALTER TABLE labels ADD COLUMN date_ts INTEGER')
+                self.conn.execute(
+                    'UPDATE labels SET date_ts = (SELECT date_ts FROM messages WHERE id = labels.message_id)'
+                )
+        self.conn.executescript(PAGE_INDEXES)
+        has_fts = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'"
+        ).fetchone()
+        self.conn.executescript(FTS_SCHEMA)
+        if not has_fts:
+            # Index mail stored before the full-text index existed
+            with self.conn:
+                self.conn.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    # --- Writes ---
+
+    @metrics.timed('store.write', op='upsert')
+    def upsert_many(self, emails):
+        now = datetime.datetime.now().isoformat()
+        with self.lock, self.conn:
+            for email in emails:
+                email.setdefault('stored_at', now)
+                self.conn.execute(
+                    """INSERT INTO messages (id, thread_id, subject, sender, recipients, date,
+                                             date_ts, snippet, body, stored_at)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                       ON CONFLICT(id) DO UPDATE SET
+                           thread_id=excluded.thread_id, subject=excluded.subject,
+                           sender=excluded.sender, recipients=excluded.recipients,
+                           date=excluded.date, date_ts=excluded.date_ts,
+                           snippet=excluded.snippet, body=excluded.body""",
+                    (email['id'], email.get('thread_id'), email.get('subject', ''),
+                     email.get('sender', ''), email.get('to', ''), email.get('date', ''),
+                     date_to_timestamp(email.get('date', '')), email.get('snippet'),
+                     email.get('body', ''), email['stored_at'])
+                )
+                self._write_labels(email['id'], email.get('labels', []))
+                self.conn.execute('DELETE FROM attachments WHERE message_id = ?', (email['id'],))
+                self.conn.executemany(
+                    """INSERT OR REPLACE INTO attachments
+                       (message_id, attachment_id, position, filename, mime_type)
+                       VALUES (?, ?, ?, ?, ?)""",
+                    [(email['id'], att['attachment_id'], i, att.get('filename'), att.get('mimeType'))
+                     for i, att in enumerate(email.get('attachments', []))]
+                )
+            self._bump_content_version()
+
+    def _bump_content_version(self):
+        # Called inside every transaction that changes messages, labels or
+        # duplicate groups, i.e. what search results are built from. Other
+        # writes (jobs, meta, attachment text) leave it alone, so they do
+        # not invalidate cached results.
+        self.conn.execute(
+            """INSERT INTO meta (key, value) VALUES ('content_version', 1)
+               ON CONFLICT(key) DO UPDATE SET value = value + 1"""
+        )
+
+    def _write_labels(self, msg_id, labels):
+        self.conn.execute('DELETE FROM labels WHERE message_id = ?', (msg_id,))
+        self._add_labels(msg_id, labels)
+
+    def _add_labels(self, msg_id, labels):
+        # Each label row carries the message's date_ts for page()
+        self.conn.executemany(
+            """INSERT OR IGNORE INTO labels (message_id, label, date_ts)
+               SELECT ?, ?, date_ts FROM messages WHERE id = ?""",
+            [(msg_id, label, msg_id) for label in labels or []]
+        )
+
+    def set_labels(self, msg_id, labels):
+        with self.lock, self.conn:
+            self._write_labels(msg_id, labels)
+            self._bump_content_version()
+
+    def update_labels(self, msg_id, add_labels=None, remove_labels=None):
+        with self.lock, self.conn:
+            self._add_labels(msg_id, add_labels)
+            self.conn.executemany(
+                'DELETE FROM labels WHERE message_id = ? AND label = ?',
+                [(msg_id, label) for label in remove_labels or []]
+            )
+            self._bump_content_version()
+
+    def delete(self, msg_ids):
+        with self.lock, self.conn:
+            self.conn.executemany('DELETE FROM messages WHERE id = ?', [(i,) for i in msg_ids])
+            self._bump_content_version()
+
+    def save_attachment_text(self, message_id, attachment_id, digest, pages, status='done', error=None):
+        # Page texts and the ingest record commit together
+        with self.lock, self.conn:
+            self.conn.execute(
+                'DELETE FROM attachment_pages WHERE message_id = ? AND attachment_id = ?',
+                (message_id, attachment_id)
+            )
+            self.conn.executemany(
+                """INSERT INTO attachment_pages (message_id, attachment_id, page, text)
+                   VALUES (?, ?, ?, ?)""",
+                [(message_id, attachment_id, page, text) for page, text in enumerate(pages)]
+            )
+            self.conn.execute(
+                """INSERT OR REPLACE INTO attachment_ingest
+                   (message_id, attachment_id, digest, pages, status, error, processed_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (message_id, attachment_id, digest, len(pages), status, error,
+                 datetime.datetime.now().isoformat())
+            )
+
+    def enqueue_job(self, kind):
+        # A kind that is already queued is not queued twice; returns its id
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT id FROM jobs WHERE kind = ? AND status = 'queued'", (kind,)
+            ).fetchone()
+            if row:
+                return row['id']
+            return self.conn.execute(
+                "INSERT INTO jobs (kind, status, created_at) VALUES (?, 'queued', ?)",
+                (kind, datetime.datetime.now().isoformat())
+            ).lastrowid
+
+    def claim_job(self):
+        # Oldest queued job, marked running; BEGIN IMMEDIATE takes the write
+        # lock first so two workers on one store never claim the same job
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.conn.execute(
+                    "SELECT id, kind, attempts FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1"
+                ).fetchone()
+                if row:
+                    self.conn.execute(
+                        """UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?
+                           WHERE id = ?""",
+                        (datetime.datetime.now().isoformat(), row['id'])
+                    )
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+        return dict(row) if row else None
+
+    def finish_job(self, job_id, status, error=None):
+        # status is 'done', 'failed', or 'queued' to hand an interrupted
+        # job to the next worker run
+        with self.lock, self.conn:
+            self.conn.execute(
+                'UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?',
+                (status, error, datetime.datetime.now().isoformat() if status != 'queued' else None, job_id)
+            )
+
+    def requeue_running_jobs(self):
+        # Jobs left 'running' by a worker that died; called at worker start
+        with self.lock, self.conn:
+            return self.conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'").rowcount
+
+    def queue_ops(self, msg_ids, op, add_labels=None, remove_labels=None):
+        """
+        Apply a change to msg_ids locally and log it for Gmail, in one
+        transaction. op is 'labels', 'trash' (labels are changed too) or
+        'delete' (the message leaves the store). Returns the ids changed.
+        """
+        rank = {'labels': 0, 'trash': 1, 'delete': 2}
+        now = datetime.datetime.now().isoformat()
+        with self.lock, self.conn:
+            emails = self.get_many(msg_ids)
+            queued = {row['message_id']: row['op'] for row in self.conn.execute(
+                f"SELECT message_id, op FROM pending_ops WHERE message_id IN ({','.join('?' * len(emails))})",
+                [email['id'] for email in emails]
+            )} if emails else {}
+            for email in emails:
+                msg_id = email['id']
+                if msg_id not in queued:
+                    # Bodies stay out of the log; a rolled-back delete
+                    # re-reads the message from Gmail
+                    snapshot = {key: value for key, value in email.items() if key != 'body'}
+                    self.conn.execute(
+                        """INSERT INTO pending_ops (message_id, op, snapshot, queued_at)
+                           VALUES (?, ?, ?, ?)""",
+                        (msg_id, op, json.dumps(snapshot), now)
+                    )
+                else:
+                    self.conn.execute(
+                        """UPDATE pending_ops SET op = ?, attempts = 0, next_attempt = 0,
+                           revision = revision + 1 WHERE message_id = ?""",
+                        (op if rank[op] > rank[queued[msg_id]] else queued[msg_id], msg_id)
+                    )
+                if op == 'delete':
+                    self.conn.execute('DELETE FROM messages WHERE id = ?', (msg_id,))
+                    continue
+                self._add_labels(msg_id, add_labels)
+                self.conn.executemany(
+                    'DELETE FROM labels WHERE message_id = ? AND label = ?',
+                    [(msg_id, label) for label in remove_labels or []]
+                )
+            self._bump_content_version()
+        return [email['id'] for email in emails]
+
+    def due_ops(self, now, limit=5000):
+        # Pending ops ready for a (re)try, with 'snapshot' decoded and
+        # 'labels' the current local labels (None for deleted mail)
+        with self.lock:
+            rows = self.conn.execute(
+                """SELECT message_id, op, snapshot, attempts, revision FROM pending_ops
+                   WHERE next_attempt <= ? ORDER BY queued_at LIMIT ?""",
+                (now, limit)
+            ).fetchall()
+            ops = [dict(row, snapshot=json.loads(row['snapshot'])) for row in rows]
+            labels = {}
+            for op in ops:
+                labels[op['message_id']] = None if op['op'] == 'delete' else []
+            for start in range(0, len(ops), 500):
+                chunk = [op['message_id'] for op in ops[start:start + 500]]
+                for row in self.conn.execute(
+                    f"SELECT message_id, label FROM labels WHERE message_id IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ):
+                    if labels[row['message_id']] is not None:
+                        labels[row['message_id']].append(row['label'])
+        for op in ops:
+            op['labels'] = labels[op['message_id']]
+        return ops
+
+    # The methods below take ops as returned by due_ops and leave alone any
+    # message that had another change queued since
+
+    def complete_ops(self, ops):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                'DELETE FROM pending_ops WHERE message_id = ? AND revision = ?',
+                [(op['message_id'], op['revision']) for op in ops]
+            )
+
+    def retry_ops(self, ops, error, next_attempt):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                """UPDATE pending_ops SET attempts = attempts + 1, error = ?, next_attempt = ?
+                   WHERE message_id = ? AND revision = ?""",
+                [(error, next_attempt, op['message_id'], op['revision']) for op in ops]
+            )
+
+    def rollback_ops(self, ops, fetched=None):
+        """
+        Gmail rejected these changes for good: make the local store match
+        the mailbox again. Messages still stored get their snapshot labels
+        back; a deleted one is re-inserted from fetched (id -> email as
+        re-read from Gmail) or, failing that, from its snapshot without a
+        body. Returns the ids of rolled-back deletes and trashes, which
+        belong in the search index again.
+        """
+        fetched = fetched or {}
+        with self.lock:
+            current = [op for op in ops if self.conn.execute(
+                'SELECT 1 FROM pending_ops WHERE message_id = ? AND revision = ?',
+                (op['message_id'], op['revision'])
+            ).fetchone()]
+            self.upsert_many([fetched.get(op['message_id']) or {'body': '', **op['snapshot']}
+                              for op in current if op['op'] == 'delete'])
+            with self.conn:
+                for op in current:
+                    if op['op'] != 'delete':
+                        self._write_labels(op['message_id'], op['snapshot'].get('labels', []))
+                self._bump_content_version()
+            self.complete_ops(current)
+        return [op['message_id'] for op in current if op['op'] in ('delete', 'trash')]
+
+    def pending_op_ids(self):
+        # Messages with local changes Gmail has not seen yet
+        with self.lock:
+            return {row[0] for row in self.conn.execute('SELECT message_id FROM pending_ops')}
+
+    def pending_op_count(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM pending_ops').fetchone()[0]
+
+    def set_topics(self, rows):
+        # rows of (message_id, cluster, distance); mail no longer stored is skipped
+        with self.lock, self.conn:
+            self.conn.executemany(
+                """INSERT OR REPLACE INTO topics (message_id, cluster, distance)
+                   SELECT ?1, ?2, ?3 WHERE EXISTS (SELECT 1 FROM messages WHERE id = ?1)""",
+                rows
+            )
+
+    def clear_topics(self):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM topics')
+
+    def clear_signatures(self):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM near_duplicates')
+            self.conn.execute('DELETE FROM lsh_buckets')
+            self._bump_content_version()
+
+    def save_signatures(self, rows, buckets):
+        # rows of (message_id, representative, signature bytes or None),
+        # buckets of (band, bucket, message_id)
+        with self.lock, self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO near_duplicates (message_id, representative, signature) VALUES (?, ?, ?)',
+                rows
+            )
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO lsh_buckets (band, bucket, message_id) VALUES (?, ?, ?)',
+                buckets
+            )
+            self._bump_content_version()
+
+    def set_meta(self, key, value):
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, json.dumps(value))
+            )
+
+    # --- Reads ---
+
+    def content_version(self):
+        # Counter of committed changes to messages, labels and duplicate
+        # groups by any process (the worker included); one primary-key
+        # read, cheap enough to check on every search
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'content_version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return json.loads(row['value']) if row else default
+
+    def count(self, label=None):
+        with self.lock:
+            if label:
+                row = self.conn.execute(
+                    'SELECT COUNT(*) FROM labels WHERE label = ?', (label,)
+                ).fetchone()
+            else:
+                row = self.conn.execute('SELECT COUNT(*) FROM messages').fetchone()
+        return row[0]
+
+    def labels_of(self, msg_ids):
+        # {id: [labels]} for the stored messages among msg_ids
+        msg_ids = list(msg_ids)
+        labels = {}
+        with self.lock:
+            for start in range(0, len(msg_ids), 500):
+                chunk = msg_ids[start:start + 500]
+                marks = ','.join('?' * len(chunk))
+                for row in self.conn.execute(f'SELECT id FROM messages WHERE id IN ({marks})', chunk):
+                    labels[row[0]] = []
+                for row in self.conn.execute(
+                        f'SELECT message_id, label FROM labels WHERE message_id IN ({marks})', chunk):
+                    labels[row[0]].append(row[1])
+        return labels
+
+    def existing(self, msg_ids):
+        # The subset of msg_ids that is stored
+        msg_ids = list(msg_ids)
+        found = set()
+        with self.lock:
+            for start in range(0, len(msg_ids), 500):
+                chunk = msg_ids[start:start + 500]
+                found.update(row[0] for row in self.conn.execute(
+                    f"SELECT id FROM messages WHERE id IN ({','.join('?' * len(chunk))})", chunk))
+        return found
+
+    def ids(self, excluded_labels=()):
+        # Every stored id, or those carrying none of excluded_labels
+        with self.lock:
+            if not excluded_labels:
+                return [row[0] for row in self.conn.execute('SELECT id FROM messages')]
+            return [row[0] for row in self.conn.execute(
+                f"""SELECT m.id FROM messages m
+                    WHERE NOT EXISTS (SELECT 1 FROM labels l WHERE l.message_id = m.id
+                                      AND l.label IN ({','.join('?' * len(excluded_labels))}))""",
+                list(excluded_labels)
+            )]
+
+    def _rows_to_emails(self, rows):
+        emails = [{
+            'id': row['id'],
+            'thread_id': row['thread_id'],
+            'subject': row['subject'],
+            'sender': row['sender'],
+            'to': row['recipients'],
+            'date': row['date'],
+            'snippet': row['snippet'],
+            'body': row['body'],
+            'attachments': [],
+            'labels': [],
+            'stored_at': row['stored_at'],
+        } for row in rows]
+        if not emails:
+            return emails
+        by_id = {email['id']: email for email in emails}
+        # Look labels/attachments up per message id only for small pages;
+        # full loads are cheaper as one scan of each table
+        if len(by_id) <= 500:
+            marks = ','.join('?' * len(by_id))
+            label_rows = self.conn.execute(
+                f'SELECT message_id, label FROM labels WHERE message_id IN ({marks})', list(by_id))
+            att_rows = self.conn.execute(
+                f"""SELECT message_id, attachment_id, filename, mime_type FROM attachments
+                    WHERE message_id IN ({marks}) ORDER BY message_id, position""", list(by_id))
+        else:
+            label_rows = self.conn.execute('SELECT message_id, label FROM labels')
+            att_rows = self.conn.execute(
+                """SELECT message_id, attachment_id, filename, mime_type FROM attachments
+                   ORDER BY message_id, position""")
+        for row in label_rows:
+            if row['message_id'] in by_id:
+                by_id[row['message_id']]['labels'].append(row['label'])
+        for row in att_rows:
+            if row['message_id'] in by_id:
+                by_id[row['message_id']]['attachments'].append({
+                    'filename': row['filename'],
+                    'attachment_id': row['attachment_id'],
+                    'mimeType': row['mime_type'],
+                })
+        return emails
+
+    def get(self, msg_id):
+        emails = self.get_many([msg_id])
+        return emails[0] if emails else None
+
+    def get_many(self, msg_ids):
+        # Returned in the order of msg_ids; unknown ids are skipped
+        msg_ids = list(msg_ids)
+        found = {}
+        with self.lock:
+            for start in range(0, len(msg_ids), 500):
+                chunk = msg_ids[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT {MESSAGE_COLUMNS} FROM messages m WHERE m.id IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                for email in self._rows_to_emails(rows):
+                    found[email['id']] = email
+        return [found[i] for i in msg_ids if i in found]
+
+    @metrics.timed('store.read', op='all')
+    def all(self):
+        with self.lock:
+            rows = self.conn.execute(f'SELECT {MESSAGE_COLUMNS} FROM messages m ORDER BY m.rowid').fetchall()
+            return self._rows_to_emails(rows)
+
+    @metrics.timed('store.read', op='page')
+    def page(self, label=None, offset=0, limit=50, with_body=True, after=None):
+        """
+        Newest first, ordered by (date_ts, id) descending. after is the
+        cursor() of the last email of the previous page: the page then
+        starts with a seek in idx_labels_label_date (or idx_messages_date_id
+        without a label) and costs the same at any depth. Without it the
+        first offset rows are stepped over, which grows with the offset.
+        with_body=False leaves 'body' empty for list views.
+        """
+        columns = MESSAGE_COLUMNS if with_body else MESSAGE_COLUMNS.replace('m.body', "'' AS body")
+        key = 'l.date_ts, l.message_id' if label else 'm.date_ts, m.id'
+        where, params = [], []
+        if label:
+            where.append('l.label = ?')
+            params.append(label)
+        if after is not None:
+            where.append(f'({key}) < (?, ?)')
+            params.extend(after)
+            offset = 0
+        source = 'labels l JOIN messages m ON m.id = l.message_id' if label else 'messages m'
+        with self.lock:
+            rows = self.conn.execute(
+                f"""SELECT {columns} FROM {source}
+                    {'WHERE ' + ' AND '.join(where) if where else ''}
+                    ORDER BY {key.replace(',', ' DESC,')} DESC LIMIT ? OFFSET ?""",
+                (*params, limit, offset)
+            ).fetchall()
+            return self._rows_to_emails(rows)
+
+    def cursor(self, msg_id):
+        # page() position of a message: (date_ts, id), None if it is gone
+        with self.lock:
+            row = self.conn.execute('SELECT date_ts, id FROM messages WHERE id = ?', (msg_id,)).fetchone()
+        return tuple(row) if row else None
+
+    def search_text(self, query, limit=50):
+        # [(id, score)] best BM25 match first; any query term may match
+        phrases = fts_phrases(query)
+        if not phrases:
+            return []
+        with self.lock:
+            rows = self.conn.execute(
+                f"""SELECT m.id, bm25(messages_fts, {', '.join(map(str, BM25_WEIGHTS))}) AS rank
+                    FROM messages_fts JOIN messages m ON m.rowid = messages_fts.rowid
+                    WHERE messages_fts MATCH ?
+                    ORDER BY rank LIMIT ?""",
+                (' OR '.join(phrases), limit)
+            ).fetchall()
+        # SQLite's bm25() is lower-is-better; flip it so higher is better
+        return [(row['id'], -row['rank']) for row in rows]
+
+    def sender_ids(self, keywords, latest=False):
+        # Ids of mail whose sender contains any keyword (name or domain),
+        # newest first; latest=True returns only the newest one
+        # Each keyword is one phrase: "amazon.com" -> "amazon com"
+        phrases = ['"' + ' '.join(tokens) + '"'
+                   for tokens in (re.findall(r'\w+', kw.lower()) for kw in keywords) if tokens]
+        if not phrases:
+            return []
+        with self.lock:
+            rows = self.conn.execute(
+                f"""SELECT m.id FROM messages_fts JOIN messages m ON m.rowid = messages_fts.rowid
+                    WHERE messages_fts MATCH ?
+                    ORDER BY m.date_ts DESC {'LIMIT 1' if latest else ''}""",
+                (' OR '.join(f'sender : {p}' for p in phrases),)
+            ).fetchall()
+        return [row['id'] for row in rows]
+
+    def pending_attachments(self, mime_types, limit=None):
+        # Attachments of the given types that have not been ingested yet
+        marks = ','.join('?' * len(mime_types))
+        with self.lock:
+            rows = self.conn.execute(
+                f"""SELECT a.message_id, a.attachment_id, a.filename, a.mime_type
+                    FROM attachments a
+                    LEFT JOIN attachment_ingest i
+                        ON i.message_id = a.message_id AND i.attachment_id = a.attachment_id
+                    WHERE i.message_id IS NULL AND a.mime_type IN ({marks})
+                    ORDER BY a.message_id, a.position
+                    {'LIMIT ?' if limit else ''}""",
+                list(mime_types) + ([limit] if limit else [])
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def attachment_pages(self, message_id, attachment_id):
+        with self.lock:
+            rows = self.conn.execute(
+                """SELECT text FROM attachment_pages WHERE message_id = ? AND attachment_id = ?
+                   ORDER BY page""",
+                (message_id, attachment_id)
+            ).fetchall()
+        return [row['text'] for row in rows]
+
+    def pages_for_digest(self, digest):
+        # Page texts of an already ingested attachment with the same
+        # content, or None; the same file sent twice is extracted once
+        with self.lock:
+            row = self.conn.execute(
+                """SELECT message_id, attachment_id FROM attachment_ingest
+                   WHERE digest = ? AND status = 'done' LIMIT 1""",
+                (digest,)
+            ).fetchone()
+        return self.attachment_pages(row['message_id'], row['attachment_id']) if row else None
+
+    def unsigned_messages(self, limit=1000):
+        # (id, body or snippet) of messages without a near-duplicate signature
+        with self.lock:
+            return [tuple(row) for row in self.conn.execute(
+                """SELECT m.id, COALESCE(NULLIF(m.body, ''), m.snippet) FROM messages m
+                   WHERE NOT EXISTS (SELECT 1 FROM near_duplicates d WHERE d.message_id = m.id)
+                   LIMIT ?""",
+                (limit,)
+            )]
+
+    def lsh_candidates(self, keys):
+        # (message_id, representative, signature bytes) of messages sharing
+        # any (band, bucket) in keys
+        with self.lock:
+            # One primary-key probe per band; a row-value IN list is scanned
+            probes = ' UNION ALL '.join(['SELECT message_id FROM lsh_buckets WHERE band = ? AND bucket = ?'] * len(keys))
+            rows = self.conn.execute(
+                f"""SELECT message_id, representative, signature FROM near_duplicates
+                    WHERE message_id IN ({probes})""",
+                [value for key in keys for value in key]
+            ).fetchall() if keys else []
+        return [tuple(row) for row in rows]
+
+    def representatives(self, msg_ids=None):
+        # {id: representative} for near-duplicates among msg_ids (all if None)
+        with self.lock:
+            if msg_ids is None:
+                rows = self.conn.execute(
+                    'SELECT message_id, representative FROM near_duplicates WHERE representative != message_id')
+                return {row[0]: row[1] for row in rows}
+            found = {}
+            msg_ids = list(msg_ids)
+            for start in range(0, len(msg_ids), 500):
+                chunk = msg_ids[start:start + 500]
+                found.update((row[0], row[1]) for row in self.conn.execute(
+                    f"""SELECT message_id, representative FROM near_duplicates
+                        WHERE representative != message_id AND message_id IN ({','.join('?' * len(chunk))})""",
+                    chunk
+                ))
+            return found
+
+    def topic_ids(self):
+        with self.lock:
+            return {row[0] for row in self.conn.execute('SELECT message_id FROM topics')}
+
+    def topic_subjects(self, cluster, limit=50):
+        # Subjects of the mail closest to a topic's centre
+        with self.lock:
+            return [row[0] for row in self.conn.execute(
+                """SELECT m.subject FROM topics t JOIN messages m ON m.id = t.message_id
+                   WHERE t.cluster = ? ORDER BY t.distance LIMIT ?""",
+                (cluster, limit)
+            )]
+
+    def topic_digest(self, start_ts, end_ts, excluded_labels=()):
+        # Mail dated in [start_ts, end_ts) with its topic (None if not
+        # clustered yet), by topic and closest to the centre first
+        with self.lock:
+            rows = self.conn.execute(
+                f"""SELECT m.id, m.subject, m.sender, m.date, m.snippet, t.cluster, t.distance
+                    FROM messages m LEFT JOIN topics t ON t.message_id = m.id
+                    WHERE m.date_ts >= ? AND m.date_ts < ?
+                      AND NOT EXISTS (SELECT 1 FROM labels l WHERE l.message_id = m.id
+                                      AND l.label IN ({','.join('?' * len(excluded_labels)) or "''"}))
+                    ORDER BY t.cluster, t.distance, m.date_ts DESC""",
+                (start_ts, end_ts, *excluded_labels)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def jobs(self, limit=20):
+        with self.lock:
+            rows = self.conn.execute('SELECT * FROM jobs ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def ingest_counts(self):
+        # {status: count} over processed attachments
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT status, COUNT(*) AS n FROM attachment_ingest GROUP BY status'
+            ).fetchall()
+        return {row['status']: row['n'] for row in rows}
+
+    def import_json_cache(self, cache_path):
+        # One-time migration from the old email_cache.json
+        if not os.path.exists(cache_path) or self.count():
+            return 0
+        try:
+            with open(cache_path, 'r') as f:
+                emails = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error importing {cache_path}: {e}")
+            return 0
+        self.upsert_many(emails)
+        return len(emails)
@@ -0,0 +1,211 @@
+import base64
+import random
+import threading
+import time
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+# Local stand-in for the parts of the Gmail API client the app uses, so the
+# fetch pipeline can be exercised and benchmarked without network access.
+
+WORDS = (
+    "invoice order meeting report project update shipping payment account "
+    "schedule review team offer delivery receipt newsletter security alert "
+    "travel booking reminder weekly summary password welcome confirm"
+).split()
+SENDERS = [
+    "billing@shop.example.com", "alerts@bank.example.com", "news@weekly.example.org",
+    "alice@example.com", "bob@corp.example.com", "noreply@travel.example.net",
+]
+LABELS = ['INBOX', 'IMPORTANT', 'SENT', 'CATEGORY_UPDATES', 'CATEGORY_PROMOTIONS']
+
+
+def _b64(text):
+    return base64.urlsafe_b64encode(text.encode()).decode()
+
+
+def make_message(index, seed=0):
+    # Deterministic Gmail-shaped users.messages.get(format='full') payload
+    rng = random.Random(seed * 1000003 + index)
+    msg_id = f"{index:016x}"
+    subject = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 7))).capitalize()
+    body = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 400)))
+    parts = [{'mimeType': 'text/plain', 'filename': '', 'body': {'data': _b64(body)}}]
+    if rng.random() < 0.1:
+        parts.append({
+            'mimeType': 'application/pdf',
+            'filename': f"{rng.choice(WORDS)}.pdf",
+            'body': {'attachmentId': f"att-{msg_id}", 'size': rng.randint(10_000, 500_000)},
+        })
+    return {
+        'id': msg_id,
+        'threadId': f"{index // 3:016x}",
+        'historyId': str(index + 1),
+        'labelIds': rng.sample(LABELS, rng.randint(1, 2)),
+        'snippet': body[:100],
+        'payload': {
+            'mimeType': 'multipart/mixed',
+            'headers': [
+                {'name': 'From', 'value': rng.choice(SENDERS)},
+                {'name': 'To', 'value': 'me@example.com'},
+                {'name': 'Subject', 'value': subject},
+                {'name': 'Date', 'value': time.strftime(
+                    '%a, %d %b %Y %H:%M:%S +0000', time.gmtime(1700000000 + index * 600))},
+            ],
+            'parts': parts,
+        },
+    }
+
+
+class _Request:
+    def __init__(self, service, handler):
+        self.service = service
+        self.handler = handler
+
+    def execute(self):
+        return self.service.call(self.handler)
+
+
+class _Messages:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, userId='me', maxResults=100, pageToken=None, labelIds=None, **kwargs):
+        def handler():
+            ids = self.service.list_ids(labelIds)
+            start = int(pageToken or 0)
+            end = start + maxResults
+            response = {'messages': [{'id': i, 'threadId': self.service.messages[i]['threadId']}
+                                     for i in ids[start:end]]}
+            if end < len(ids):
+                response['nextPageToken'] = str(end)
+            return response
+        return _Request(self.service, handler)
+
+    def get(self, userId='me', id=None, format='full', **kwargs):
+        def handler():
+            if id not in self.service.messages:
+                raise self.service.http_error(404, 'Not Found')
+            return self.service.messages[id]
+        return _Request(self.service, handler)
+
+
+class _History:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, userId='me', startHistoryId=None, pageToken=None, maxResults=100, **kwargs):
+        def handler():
+            start = int(startHistoryId)
+            if start < self.service.history_floor:
+                raise self.service.http_error(404, 'Requested entity was not found.')
+            records = [r for r in self.service.history if int(r['id']) > start]
+            offset = int(pageToken or 0)
+            response = {
+                'history': records[offset:offset + maxResults],
+                'historyId': str(self.service.history_id),
+            }
+            if offset + maxResults < len(records):
+                response['nextPageToken'] = str(offset + maxResults)
+            return response
+        return _Request(self.service, handler)
+
+
+class _Users:
+    def __init__(self, service):
+        self.service = service
+
+    def messages(self):
+        return _Messages(self.service)
+
+    def history(self):
+        return _History(self.service)
+
+    def getProfile(self, userId='me'):
+        return _Request(self.service, lambda: {
+            'emailAddress': 'me@example.com',
+            'messagesTotal': len(self.service.messages),
+            'historyId': str(self.service.history_id),
+        })
+
+
+class FakeGmailService:
+    """
+    In-memory Gmail service with per-call latency and injected errors.
+
+    latency is seconds slept per call, error_rate the fraction of calls
+    answered with a 429. One instance is safe to share across threads.
+    """
+
+    def __init__(self, count=1000, latency=0.05, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.seed = seed
+        self.messages = {}
+        for index in range(count):
+            msg = make_message(index, seed)
+            self.messages[msg['id']] = msg
+        # Mailbox changes are recorded like users.history.list returns them;
+        # history older than history_floor is treated as expired (404)
+        self.next_index = count
+        self.history_id = count
+        self.history_floor = 0
+        self.history = []
+
+    def users(self):
+        return _Users(self)
+
+    def list_ids(self, label_ids=None):
+        # Gmail lists newest first
+        ids = [i for i, msg in self.messages.items()
+               if not label_ids or set(label_ids) <= set(msg['labelIds'])]
+        return ids[::-1]
+
+    def _record(self, kind, msg, label_ids=None):
+        self.history_id += 1
+        item = {'message': {'id': msg['id'], 'threadId': msg['threadId'], 'labelIds': list(msg['labelIds'])}}
+        if label_ids is not None:
+            item['labelIds'] = label_ids
+        self.history.append({'id': str(self.history_id), kind: [item]})
+
+    def add_message(self):
+        msg = make_message(self.next_index, self.seed)
+        self.next_index += 1
+        self.messages[msg['id']] = msg
+        self._record('messagesAdded', msg)
+        return msg
+
+    def delete_message(self, msg_id):
+        self._record('messagesDeleted', self.messages.pop(msg_id))
+
+    def change_labels(self, msg_id, add=(), remove=()):
+        msg = self.messages[msg_id]
+        msg['labelIds'] = [l for l in msg['labelIds'] if l not in remove] + \
+            [l for l in add if l not in msg['labelIds']]
+        if add:
+            self._record('labelsAdded', msg, list(add))
+        if remove:
+            self._record('labelsRemoved', msg, list(remove))
+
+    def expire_history(self):
+        self.history_floor = self.history_id
+
+    def http_error(self, status, reason):
+        return HttpError(httplib2.Response({'status': status, 'reason': reason}), reason.encode())
+
+    def call(self, handler):
+        with self.lock:
+            self.calls += 1
+            fail = self.rng.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise self.http_error(429, 'Rate Limit Exceeded')
+        return handler()
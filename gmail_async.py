@@ -0,0 +1,237 @@
+import asyncio
+import base64
+import random
+import threading
+from email import encoders
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import aiohttp
+
+import metrics
+from gmail_fetch import RETRY_STATUSES
+
+GMAIL_API = 'https://gmail.googleapis.com/gmail/v1/users/me'
+# messages.batchModify / batchDelete accept at most this many ids per call
+BATCH_LIMIT = 1000
+# Paths under /messages/ that are endpoints, not message ids
+MESSAGE_ENDPOINTS = {'send', 'batchModify', 'batchDelete'}
+
+
+def endpoint(path):
+    # path with the message id replaced, e.g. /messages/{id}/modify, so
+    # metrics are per endpoint rather than per message
+    parts = path.split('/')
+    if len(parts) > 2 and parts[1] == 'messages' and parts[2] not in MESSAGE_ENDPOINTS:
+        parts[2] = '{id}'
+    return '/'.join(parts)
+
+
+class GmailAPIError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"Gmail API error {status}: {message}")
+        self.status = status
+
+
+def build_raw_message(sender, to, subject, body, attachment=None):
+    # base64url RFC 2822 message for messages.send / drafts.create;
+    # attachment is a file-like object with .read() and .name
+    if attachment:
+        message = MIMEMultipart()
+        message.attach(MIMEText(body, 'plain'))
+        part = MIMEBase('application', 'octet-stream')
+        part.set_payload(attachment.read())
+        encoders.encode_base64(part)
+        part.add_header('Content-Disposition', f'attachment; filename="{attachment.name}"')
+        message.attach(part)
+    else:
+        message = MIMEText(body)
+    message['to'] = to
+    message['subject'] = subject
+    message['from'] = sender
+    return base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
+
+
+class AsyncGmailClient:
+    """
+    asyncio Gmail REST client for the write side of the app (send, drafts,
+    labels, trash, delete, and re-reading a message whose change is rolled
+    back). One aiohttp session keeps a pool of at most
+    concurrency keep-alive connections; 429/5xx responses and connection
+    errors are retried with full-jitter exponential backoff (honouring
+    Retry-After). The profile is fetched once and cached, and the batch
+    endpoints change up to BATCH_LIMIT messages per request.
+
+    token_provider is a callable returning a valid OAuth access token; see
+    from_credentials. base_url can point at mock_gmail_server.py.
+    """
+
+    def __init__(self, token_provider, base_url=GMAIL_API, concurrency=16,
+                 max_retries=5, base_delay=0.5, max_delay=32.0):
+        self.token_provider = token_provider
+        self.base_url = base_url.rstrip('/')
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._session = None
+        self._semaphore = None
+        self._profile = None
+        self._profile_lock = None
+
+    @classmethod
+    def from_credentials(cls, creds, **kwargs):
+        # google.oauth2 Credentials, refreshed (a blocking call) when expired
+        from google.auth.transport.requests import Request
+
+        def token():
+            if not creds.valid:
+                creds.refresh(Request())
+            return creds.token
+        return cls(token, **kwargs)
+
+    async def _ensure_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=60),
+            )
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._profile_lock = asyncio.Lock()
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        await self._ensure_session()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                return min(self.max_delay, float(retry_after))
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def request(self, method, path, json=None):
+        session = await self._ensure_session()
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            # Token refresh may block on the network, so keep it off the loop
+            token = await loop.run_in_executor(None, self.token_provider)
+            retry_after = None
+            try:
+                async with self._semaphore:
+                    with metrics.span('gmail.request', method=method, endpoint=endpoint(path)):
+                        async with session.request(method, self.base_url + path, json=json,
+                                                   headers={'Authorization': f'Bearer {token}'}) as response:
+                            if response.status < 400:
+                                if response.status == 204 or response.content_length == 0:
+                                    return {}
+                                return await response.json(content_type=None) or {}
+                            if response.status not in RETRY_STATUSES:
+                                raise GmailAPIError(response.status, await response.text())
+                            error = GmailAPIError(response.status, await response.text())
+                            retry_after = response.headers.get('Retry-After')
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error = e
+            if attempt >= self.max_retries:
+                raise error
+            metrics.count('gmail.retry', call=endpoint(path),
+                          reason=getattr(error, 'status', None) or type(error).__name__)
+            await asyncio.sleep(self._backoff(attempt, retry_after))
+            attempt += 1
+
+    # --- Profile ---
+
+    async def profile(self):
+        await self._ensure_session()
+        async with self._profile_lock:
+            if self._profile is None:
+                self._profile = await self.request('GET', '/profile')
+        return self._profile
+
+    async def email_address(self):
+        return (await self.profile())['emailAddress']
+
+    # --- Single-message operations ---
+
+    async def send(self, to, subject, body, attachment=None):
+        raw = build_raw_message(await self.email_address(), to, subject, body, attachment)
+        return await self.request('POST', '/messages/send', json={'raw': raw})
+
+    async def create_draft(self, to, subject, body):
+        raw = build_raw_message(await self.email_address(), to, subject, body)
+        return await self.request('POST', '/drafts', json={'message': {'raw': raw}})
+
+    async def get_message(self, msg_id):
+        # users.messages.get(format='full') payload, for parse_message
+        return await self.request('GET', f'/messages/{msg_id}?format=full')
+
+    async def modify(self, msg_id, add_labels=None, remove_labels=None):
+        return await self.request('POST', f'/messages/{msg_id}/modify', json={
+            'addLabelIds': add_labels or [], 'removeLabelIds': remove_labels or []})
+
+    async def trash(self, msg_id):
+        return await self.request('POST', f'/messages/{msg_id}/trash')
+
+    async def delete(self, msg_id):
+        return await self.request('DELETE', f'/messages/{msg_id}')
+
+    # --- Bulk operations ---
+
+    async def batch_modify(self, msg_ids, add_labels=None, remove_labels=None):
+        # Returns the ids sent; any failed request raises
+        msg_ids = list(msg_ids)
+        await asyncio.gather(*(
+            self.request('POST', '/messages/batchModify', json={
+                'ids': msg_ids[start:start + BATCH_LIMIT],
+                'addLabelIds': add_labels or [], 'removeLabelIds': remove_labels or []})
+            for start in range(0, len(msg_ids), BATCH_LIMIT)
+        ))
+        return msg_ids
+
+    async def batch_delete(self, msg_ids):
+        # Returns the ids sent; any failed request raises
+        msg_ids = list(msg_ids)
+        await asyncio.gather(*(
+            self.request('POST', '/messages/batchDelete', json={'ids': msg_ids[start:start + BATCH_LIMIT]})
+            for start in range(0, len(msg_ids), BATCH_LIMIT)
+        ))
+        return msg_ids
+
+    async def trash_many(self, msg_ids):
+        # Gmail has no batch trash endpoint; trash calls run concurrently
+        # over the connection pool. Returns {id: exception} for failures.
+        msg_ids = list(msg_ids)
+        results = await asyncio.gather(*(self.trash(msg_id) for msg_id in msg_ids), return_exceptions=True)
+        return {msg_id: result for msg_id, result in zip(msg_ids, results) if isinstance(result, Exception)}
+
+
+class BackgroundLoop:
+    """
+    Event loop on a daemon thread, so synchronous code (Streamlit, the
+    worker) can run coroutines while sessions and pooled connections
+    persist between calls.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def submit(self, coro):
+        # Schedule without waiting; returns a concurrent.futures.Future
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        return self.submit(coro).result(timeout)
@@ -0,0 +1,127 @@
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from socket import error as SocketError
+from ssl import SSLError
+
+import metrics
+from email_parser import parse_message
+
+# Gmail answers quota and transient backend errors with these statuses
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def http_status(error):
+    # HttpError keeps the response on .resp; anything else has no status
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    try:
+        return int(status)
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """Token bucket shared by all fetch threads of one mailbox."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_for = (1 - self.tokens) / self.rate
+            time.sleep(wait_for)
+
+
+class GmailFetcher:
+    """
+    Fetch and parse messages on a bounded thread pool.
+
+    googleapiclient service objects are not thread-safe, so every worker
+    thread builds its own via service_factory. Requests share one
+    RateLimiter (Gmail's per-user quota allows roughly 50 messages.get
+    calls per second) and 429/5xx responses are retried with jittered
+    exponential backoff.
+    """
+
+    def __init__(self, service_factory, concurrency=8, rate_limit=40,
+                 max_retries=5, base_delay=1.0, max_delay=32.0):
+        self.service_factory = service_factory
+        self.concurrency = max(1, concurrency)
+        self.limiter = RateLimiter(rate_limit)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._local = threading.local()
+
+    def _service(self):
+        if not hasattr(self._local, 'service'):
+            self._local.service = self.service_factory()
+        return self._local.service
+
+    def get_message(self, msg_id):
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                with metrics.span('gmail.call', method='messages.get'):
+                    return self._service().users().messages().get(
+                        userId='me', id=msg_id, format='full'
+                    ).execute()
+            except (SSLError, SocketError) as e:
+                error = e
+            except Exception as e:
+                if http_status(e) not in RETRY_STATUSES:
+                    raise
+                error = e
+            attempt += 1
+            if attempt > self.max_retries:
+                raise error
+            metrics.count('gmail.retry', call='messages.get', reason=http_status(error) or type(error).__name__)
+            delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+            time.sleep(delay * random.uniform(0.5, 1.0))
+
+    def _fetch_one(self, msg_id):
+        msg = self.get_message(msg_id)
+        with metrics.span('parse'):
+            return parse_message(msg)
+
+    def fetch(self, msg_ids):
+        """
+        Yield parsed emails as they arrive (completion order, not input
+        order). Messages that still fail after retries are reported and
+        skipped.
+        """
+        msg_ids = iter(msg_ids)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            pending = {}
+            # Keep at most 2x concurrency requests in flight so huge id
+            # lists do not turn into huge future sets
+            for msg_id in msg_ids:
+                pending[pool.submit(self._fetch_one, msg_id)] = msg_id
+                if len(pending) >= 2 * self.concurrency:
+                    break
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    msg_id = pending.pop(future)
+                    try:
+                        yield future.result()
+                    except Exception as e:
+                        metrics.record_error('fetch', e)
+                        print(f"Error fetching message {msg_id}: {e}")
+                    next_id = next(msg_ids, None)
+                    if next_id is not None:
+                        pending[pool.submit(self._fetch_one, next_id)] = next_id
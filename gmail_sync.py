@@ -0,0 +1,151 @@
+import os
+
+import metrics
+from mail_backend import delete_stored_emails, fetch_emails, get_email_store
+from gmail_fetch import http_status
+
+# Incremental mailbox sync through users.history.list. The last seen
+# historyId is kept in the email store's meta table; every refresh applies
+# the adds, deletes and label changes since then instead of relisting
+# message ids. Only the rows a change touches are read from the store.
+
+HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+# Most recent messages fetched by a full resync
+FULL_SYNC_LIMIT = int(os.getenv("FULL_SYNC_LIMIT", 1000))
+
+
+class HistoryExpired(Exception):
+    pass
+
+
+def load_history_id():
+    return get_email_store().get_meta('history_id')
+
+
+def save_history_id(history_id):
+    get_email_store().set_meta('history_id', str(history_id))
+
+
+def list_history(service, start_history_id):
+    """
+    Collapse the history since start_history_id into one delta:
+    {'added': [ids], 'deleted': {ids}, 'labels': {id: [(op, label_ids)]},
+    'history_id': newest id}. Raises HistoryExpired when Gmail no longer
+    keeps history that far back.
+    """
+    added, deleted, labels = {}, set(), {}
+    history_id = start_history_id
+    page_token = None
+    while True:
+        try:
+            with metrics.span('gmail.call', method='history.list'):
+                response = service.users().history().list(
+                    userId='me',
+                    startHistoryId=start_history_id,
+                    historyTypes=HISTORY_TYPES,
+                    pageToken=page_token
+                ).execute()
+        except Exception as e:
+            if http_status(e) == 404:
+                raise HistoryExpired(f"History {start_history_id} is no longer available") from e
+            raise
+        for record in response.get('history', []):
+            for item in record.get('messagesAdded', []):
+                msg_id = item['message']['id']
+                deleted.discard(msg_id)
+                added[msg_id] = True
+            for item in record.get('messagesDeleted', []):
+                msg_id = item['message']['id']
+                added.pop(msg_id, None)
+                labels.pop(msg_id, None)
+                deleted.add(msg_id)
+            for key, op in (('labelsAdded', 'add'), ('labelsRemoved', 'remove')):
+                for item in record.get(key, []):
+                    msg_id = item['message']['id']
+                    if msg_id not in deleted:
+                        labels.setdefault(msg_id, []).append((op, item.get('labelIds', [])))
+        history_id = response.get('historyId', history_id)
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            break
+    return {'added': list(added), 'deleted': deleted, 'labels': labels, 'history_id': history_id}
+
+
+def apply_history(delta):
+    # Apply deletes and label changes to the store; returns the ids that
+    # must leave the search index (deleted or now in TRASH)
+    store = get_email_store()
+    removed_ids = set(delta['deleted'])
+    for msg_id, current in store.labels_of(delta['labels']).items():
+        for op, label_ids in delta['labels'][msg_id]:
+            if op == 'add':
+                current = current + [l for l in label_ids if l not in current]
+            else:
+                current = [l for l in current if l not in label_ids]
+        store.set_labels(msg_id, current)
+        if 'TRASH' in current:
+            removed_ids.add(msg_id)
+    if delta['deleted']:
+        delete_stored_emails(delta['deleted'])
+    return removed_ids
+
+
+def list_all_message_ids(service):
+    msg_ids = []
+    page_token = None
+    while True:
+        with metrics.span('gmail.call', method='messages.list'):
+            response = service.users().messages().list(
+                userId='me',
+                maxResults=500,
+                pageToken=page_token
+            ).execute()
+        msg_ids.extend(msg['id'] for msg in response.get('messages', []))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return msg_ids
+
+
+def full_resync(service, on_progress=None):
+    # Read the historyId first so changes made while listing are replayed
+    # by the next incremental sync
+    history_id = service.users().getProfile(userId='me').execute()['historyId']
+    remote_ids = list_all_message_ids(service)
+    remote = set(remote_ids)
+    store = get_email_store()
+    stored_ids = set(store.ids())
+    # Locally composed mail ('local-...') has no Gmail id to compare against
+    removed_ids = {msg_id for msg_id in stored_ids
+                   if msg_id not in remote and not msg_id.startswith('local-')}
+    delete_stored_emails(removed_ids)
+    # Mail with a queued delete is gone locally but still listed until the
+    # write-behind flush reaches Gmail; it must not be fetched back
+    skip_ids = stored_ids | store.pending_op_ids()
+    new_ids = [msg_id for msg_id in remote_ids if msg_id not in skip_ids][:FULL_SYNC_LIMIT]
+    fetch_emails(new_ids, on_progress=on_progress)
+    save_history_id(history_id)
+    return removed_ids
+
+
+def sync_mailbox(service, on_progress=None):
+    """
+    Bring the active account's store up to date with Gmail, incrementally
+    when a historyId is known. Returns the ids that were deleted or trashed
+    so the caller can drop them from the search index; new messages are
+    written to the store and still need embedding (embed_missing).
+    """
+    history_id = load_history_id()
+    if history_id:
+        try:
+            delta = list_history(service, history_id)
+        except HistoryExpired as e:
+            print(f"{e}, falling back to a full resync")
+        else:
+            removed_ids = apply_history(delta)
+            store = get_email_store()
+            skip_ids = store.existing(delta['added']) | store.pending_op_ids()
+            new_ids = [msg_id for msg_id in delta['added'] if msg_id not in skip_ids]
+            fetch_emails(new_ids, on_progress=on_progress)
+            save_history_id(delta['history_id'])
+            return removed_ids
+    return full_resync(service, on_progress=on_progress)
@@ -0,0 +1,281 @@
+import asyncio
+import base64
+import os
+import threading
+import time
+from functools import partial, wraps
+from socket import error as SocketError
+from ssl import SSLError
+
+from dotenv import load_dotenv
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+
+import metrics
+from accounts import DEFAULT_ACCOUNT, get_account
+from attachment_cache import AttachmentCache
+from email_parser import parse_message
+from email_store import EmailStore
+from gmail_async import AsyncGmailClient, BackgroundLoop
+from gmail_fetch import GmailFetcher
+from write_behind import flush_ops
+
+# Store, Gmail and write-behind helpers shared by the Streamlit UI (app.py,
+# ui.py) and the headless worker (mail_mentor.py). Nothing here imports
+# Streamlit or the PDF/image libraries; errors meant for the user go to
+# the reporter set with set_error_reporter (print unless the UI sets one).
+
+load_dotenv()
+
+SCOPES = ['https://mail.google.com/']
+# Concurrent fetch settings: worker threads and Gmail requests per second
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", 8))
+FETCH_RATE_LIMIT = float(os.getenv("FETCH_RATE_LIMIT", 40))
+# Downloaded attachments and PDF previews, LRU-evicted past the byte budget
+# (per account, see accounts.py)
+ATTACHMENT_CACHE_BYTES = int(os.getenv("ATTACHMENT_CACHE_MB", 256)) * 1024 * 1024
+
+_error_reporter = print
+
+def set_error_reporter(report):
+    # report(message) shows an error to the user, e.g. st.error
+    global _error_reporter
+    _error_reporter = report
+
+def retry_on_ssl_error(max_retries=3, delay=1):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            retries = 0
+            while retries < max_retries:
+                try:
+                    return func(*args, **kwargs)
+                except (SSLError, SocketError) as e:
+                    retries += 1
+                    metrics.count('gmail.retry', call=func.__name__, reason=type(e).__name__)
+                    if retries == max_retries:
+                        metrics.record_error(func.__name__, e)
+                        _error_reporter(f"⚠️ Network error: {str(e)}. Please try again later.")
+                        return None
+                    time.sleep(delay)
+            return None
+        return wrapper
+    return decorator
+
+
+_email_stores = {}
+_attachment_caches = {}
+_shard_lock = threading.Lock()
+
+def get_email_store(account=None):
+    # SQLite store of the given (default: active) account; an existing
+    # email_cache.json is imported into the default account on first use
+    account = get_account(account)
+    with _shard_lock:
+        store = _email_stores.get(account.name)
+        if store is None:
+            account.create()
+            store = _email_stores[account.name] = EmailStore(account.store_path)
+            if account.name == DEFAULT_ACCOUNT:
+                store.import_json_cache('email_cache.json')
+    return store
+
+def get_attachment_cache(account=None):
+    account = get_account(account)
+    with _shard_lock:
+        cache = _attachment_caches.get(account.name)
+        if cache is None:
+            cache = _attachment_caches[account.name] = AttachmentCache(
+                account.attachment_cache_path, max_bytes=ATTACHMENT_CACHE_BYTES
+            )
+    return cache
+
+def save_emails_to_local_storage(emails):
+    # Upserts the given emails; anything not passed in is left untouched.
+    # Embeddings live in the binary store (email_embeddings.npy), not here.
+    get_email_store().upsert_many(emails)
+
+def load_emails_from_local_storage():
+    return get_email_store().all()
+
+def load_emails_page(label=None, offset=0, limit=50, with_body=True, after=None):
+    # Newest-first page of one label without loading the whole mailbox;
+    # after is the email_cursor of the previous page's last email
+    return get_email_store().page(label, offset=offset, limit=limit, with_body=with_body, after=after)
+
+def email_cursor(msg_id):
+    return get_email_store().cursor(msg_id)
+
+def load_email(msg_id):
+    return get_email_store().get(msg_id)
+
+def count_stored_emails(label=None):
+    return get_email_store().count(label)
+
+def update_stored_labels(msg_id, add_labels=None, remove_labels=None):
+    get_email_store().update_labels(msg_id, add_labels=add_labels, remove_labels=remove_labels)
+
+def delete_stored_emails(msg_ids):
+    get_email_store().delete(msg_ids)
+
+def get_gmail_service(token_path=None):
+    # token_path defaults to the active account's token; the OAuth client
+    # (credentials.json) is shared by all accounts
+    token_path = token_path or get_account().token_path
+    creds = None
+    ssl_context = ssl.create_default_context()
+    ssl_context.check_hostname = False
+    ssl_context.verify_mode = ssl.CERT_NONE
+
+    if os.path.exists(token_path):
+        creds = Credentials.from_authorized_user_file(token_path, SCOPES)
+
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            creds.refresh(Request())
+        else:
+            # Interactive first login only; the worker needs an existing token
+            from google_auth_oauthlib.flow import InstalledAppFlow
+            flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
+            creds = flow.run_local_server(port=0)
+        with open(token_path, 'w') as token_file:
+            token_file.write(creds.to_json())
+
+    # http = AuthorizedHttp(creds, ssl_context=ssl_context)
+    return build("gmail", "v1", credentials=creds)
+
+def download_attachment(service, message_id, attachment_id):
+    # Served from the attachment cache; Gmail is only asked on a miss
+    return get_attachment_cache().get_or_fetch(
+        message_id, attachment_id,
+        lambda: fetch_attachment(service, message_id, attachment_id),
+    )
+
+@retry_on_ssl_error(max_retries=3, delay=1)
+def fetch_attachment(service, message_id, attachment_id):
+    try:
+        with metrics.span('gmail.call', method='attachments.get'):
+            attachment = service.users().messages().attachments().get(
+                userId='me', messageId=message_id, id=attachment_id
+            ).execute()
+        data = attachment.get('data')
+        if data:
+            return base64.urlsafe_b64decode(data.encode())
+        return None
+    except Exception as e:
+        metrics.record_error('fetch_attachment', e)
+        _error_reporter(f"⚠️ Error downloading attachment: {str(e)}")
+        return None
+
+def parse_email(service, msg_id):
+    with metrics.span('gmail.call', method='messages.get'):
+        msg = service.users().messages().get(userId='me', id=msg_id, format='full').execute()
+    with metrics.span('parse'):
+        return parse_message(msg)
+
+def fetch_emails(msg_ids, stored_emails=None, on_progress=None, checkpoint_every=100):
+    """
+    Fetch and parse msg_ids concurrently (see gmail_fetch.py). Parsed emails
+    are appended to stored_emails as they arrive and written to the store
+    every checkpoint_every emails, so an interrupted sync keeps what it fetched.
+    """
+    stored_emails = [] if stored_emails is None else stored_emails
+    # Fetch threads do not see the active account, so bind its token here
+    fetcher = GmailFetcher(partial(get_gmail_service, get_account().token_path),
+                           concurrency=FETCH_CONCURRENCY, rate_limit=FETCH_RATE_LIMIT)
+    fetched = []
+    for email in fetcher.fetch(msg_ids):
+        fetched.append(email)
+        stored_emails.append(email)
+        if on_progress:
+            on_progress(len(fetched), len(msg_ids))
+        if len(fetched) % checkpoint_every == 0:
+            save_emails_to_local_storage(fetched[-checkpoint_every:])
+    if len(fetched) % checkpoint_every:
+        save_emails_to_local_storage(fetched[-(len(fetched) % checkpoint_every):])
+    return fetched
+
+# --- Gmail write side: one AsyncGmailClient per account (gmail_async.py),
+# all running on one background loop ---
+
+_gmail_clients = {}
+_gmail_loop = None
+
+def gmail_loop():
+    # The background event loop all AsyncGmailClients run on
+    global _gmail_loop
+    with _shard_lock:
+        if _gmail_loop is None:
+            _gmail_loop = BackgroundLoop()
+    return _gmail_loop
+
+def get_gmail_client(account=None):
+    account = get_account(account)
+    gmail_loop()
+    with _shard_lock:
+        client = _gmail_clients.get(account.name)
+        if client is None:
+            creds = Credentials.from_authorized_user_file(account.token_path, SCOPES)
+            client = _gmail_clients[account.name] = AsyncGmailClient.from_credentials(
+                creds, concurrency=FETCH_CONCURRENCY
+            )
+    return client
+
+# --- Bulk actions: optimistic local change + write-behind to Gmail ---
+# The store is updated in one transaction and the change logged in its
+# pending_ops table; flush_pending_ops pushes the log through the batch
+# endpoints in the background (write_behind.py). Streamlit callbacks run
+# outside the script's account context, so they pass account explicitly.
+
+def queue_label_change(msg_ids, add_labels=None, remove_labels=None, account=None):
+    changed = get_email_store(account).queue_ops(msg_ids, 'labels', add_labels, remove_labels)
+    flush_pending_ops(account=account)
+    return changed
+
+def queue_archive(msg_ids, account=None):
+    return queue_label_change(msg_ids, add_labels=['ARCHIVE'], remove_labels=['INBOX'], account=account)
+
+def queue_trash(msg_ids, account=None, engine=None):
+    changed = get_email_store(account).queue_ops(msg_ids, 'trash', ['TRASH'], ['INBOX'])
+    flush_pending_ops(account=account, engine=engine)
+    return changed
+
+def queue_delete(msg_ids, account=None, engine=None):
+    changed = get_email_store(account).queue_ops(msg_ids, 'delete')
+    flush_pending_ops(account=account, engine=engine)
+    return changed
+
+def flush_pending_ops(wait=False, account=None, engine=None):
+    # Schedules a flush of the account's (default: active) log on the
+    # background loop. wait=True blocks and returns the counts from
+    # write_behind.flush_ops. Rolled-back deletes and trashes are
+    # re-embedded into engine's index when one is given; otherwise they
+    # return to search with the next embed_missing pass.
+    store = get_email_store(account)
+    try:
+        client = get_gmail_client(account)
+    except Exception as e:
+        # No usable token yet; the log keeps the changes for a later flush
+        metrics.record_error('flush_pending_ops', e)
+        print(f"Could not flush pending Gmail changes: {e}")
+        return None
+    future = gmail_loop().submit(_flush_and_reindex(store, client, engine))
+    if wait:
+        return future.result(timeout=300)
+    future.add_done_callback(_log_flush_error)
+    return future
+
+async def _flush_and_reindex(store, client, engine):
+    counts = await flush_ops(store, client)
+    if engine is not None and counts['restored']:
+        # Embedding is CPU-bound; keep it off the Gmail loop
+        await asyncio.get_running_loop().run_in_executor(None, lambda: engine.compute_and_save_embeddings(
+            store.get_many(counts['restored']), store.representatives()))
+    return counts
+
+def _log_flush_error(future):
+    if not future.cancelled() and future.exception() is not None:
+        metrics.record_error('flush_pending_ops', future.exception())
+        print(f"Flushing pending Gmail changes failed: {future.exception()}")
+
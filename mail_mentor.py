@@ -0,0 +1,286 @@
+import argparse
+import os
+import signal
+import threading
+import time
+
+import metrics
+from accounts import get_account, list_accounts, use_account
+from attachment_ingest import ingest_attachments
+from clustering import TopicClusterer
+from dedup import find_duplicates
+from gmail_sync import sync_mailbox
+from mail_backend import download_attachment, flush_pending_ops, get_email_store, get_gmail_service
+from semantic_search import SemanticSearchEngine
+
+# Headless sync worker, decoupled from Streamlit:
+#   python -m mail_mentor sync                  # one sync + embed, then exit
+#   python -m mail_mentor worker --interval 300 # long-lived, scheduled syncs
+#   python -m mail_mentor enqueue attachments   # hand a job to the worker
+#   python -m mail_mentor status
+# Jobs are queued in each account's email store; --account (repeatable,
+# or "all") picks the mailboxes, and one worker process serves them all
+# with a single shared embedding model. The worker publishes its heartbeat
+# and progress in each store's 'worker' meta key for the UI. Idle workers
+# also flush the write-behind log of bulk actions once changes are due.
+
+# A worker whose heartbeat is older than this is treated as gone
+WORKER_TIMEOUT = 60
+
+
+class ShutdownRequested(Exception):
+    pass
+
+
+def create_semantic_engine(account=None):
+    # Indexes live in the account's directory; the model is shared
+    account = get_account(account)
+    return SemanticSearchEngine(
+        index_path=account.path('email_embeddings'),
+        cache_path=account.path('embedding_cache'),
+        chunk_index_path=account.path('email_chunks'),
+        attachment_index_path=account.path('attachment_chunks'),
+        batch_size=int(os.getenv("EMBED_BATCH_SIZE", 64)),
+        chunking=os.getenv("EMBED_CHUNKING", "0") == "1",
+        quantization=os.getenv("EMBED_QUANTIZATION", "float32"),
+        binary_prefilter=int(os.getenv("EMBED_BINARY_PREFILTER", 0)),
+    )
+
+
+def create_topic_clusterer(account=None):
+    return TopicClusterer(get_account(account).path('email_topics'))
+
+
+def worker_status(store):
+    # The running worker's last report, or None if no worker is alive
+    status = store.get_meta('worker')
+    if not status or time.time() - status.get('heartbeat', 0) > WORKER_TIMEOUT:
+        return None
+    return status
+
+
+class Worker:
+    """
+    Runs jobs from the store's queue one at a time. SIGINT/SIGTERM stop
+    the worker at the next progress report: what was fetched so far is
+    already checkpointed (fetch_emails writes every 100 emails and the
+    history id only moves once a sync completes) and the job goes back to
+    the queue, so the next run picks it up where this one stopped.
+    """
+
+    def __init__(self, account=None, store=None, engine=None, service=None, stopping=None):
+        self.account = get_account(account).name
+        self.store = store or get_email_store(self.account)
+        self.engine = engine or create_semantic_engine(self.account)
+        self.topics = create_topic_clusterer(self.account)
+        self.service = service
+        # Shared by the workers of one process so a signal stops them all
+        self.stopping = stopping or threading.Event()
+        self.status = {'pid': os.getpid(), 'account': self.account, 'heartbeat': time.time(),
+                       'job': None, 'kind': None, 'stage': 'idle', 'done': 0, 'total': 0}
+        self.handlers = {
+            'sync': self.run_sync,
+            'embed': self.run_embed,
+            'attachments': self.run_attachments,
+            'flush': self.run_flush,
+            'cluster': self.run_cluster,
+        }
+
+    def install_signal_handlers(self):
+        def stop(signum, frame):
+            print(f"Received signal {signum}, stopping after the current step")
+            self.stopping.set()
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+    def gmail(self):
+        if self.service is None:
+            self.service = get_gmail_service(get_account(self.account).token_path)
+        return self.service
+
+    def report(self, stage, done=0, total=0):
+        if self.stopping.is_set():
+            raise ShutdownRequested()
+        self.status.update(heartbeat=time.time(), stage=stage, done=done, total=total)
+        self.store.set_meta('worker', self.status)
+
+    # --- Jobs ---
+
+    def run_sync(self):
+        self.report('sync')
+        removed_ids = sync_mailbox(
+            self.gmail(),
+            on_progress=lambda done, total: self.report('fetch', done, total),
+        )
+        self.engine.remove_from_index(removed_ids)
+        self.run_embed()
+
+    def run_embed(self):
+        self.report('embed')
+        find_duplicates(self.store)
+        self.engine.embed_missing(self.store)
+        self.run_cluster()
+
+    def run_cluster(self):
+        self.report('cluster')
+        self.topics.update(self.engine.index, self.store)
+
+    def run_attachments(self):
+        self.report('attachments')
+        service = self.gmail()
+        ingest_attachments(
+            self.store, self.engine,
+            lambda msg_id, att_id: download_attachment(service, msg_id, att_id),
+            workers=int(os.getenv("ATTACHMENT_WORKERS", 0)) or None,
+            on_progress=lambda done, total: self.report('attachments', done, total),
+        )
+
+    def run_flush(self):
+        self.report('flush')
+        counts = flush_pending_ops(wait=True, account=self.account, engine=self.engine)
+        if counts:
+            print(f"[{self.account}] Gmail changes: {counts['done']} applied, "
+                  f"{counts['retried']} to retry, {counts['rolled_back']} rolled back "
+                  f"({len(counts['restored'])} back in the search index)")
+
+    def run_job(self, job):
+        self.status.update(job=job['id'], kind=job['kind'])
+        print(f"[{self.account}] job {job['id']}: {job['kind']} (attempt {job['attempts'] + 1})")
+        # app.py helpers used by the job resolve this account's shard
+        use_account(self.account)
+        try:
+            handler = self.handlers.get(job['kind'])
+            if handler is None:
+                raise ValueError(f"Unknown job kind {job['kind']!r}")
+            with metrics.span('job', kind=job['kind']):
+                handler()
+        except ShutdownRequested:
+            self.store.finish_job(job['id'], 'queued')
+            print(f"Job {job['id']} interrupted, requeued")
+        except Exception as e:
+            self.store.finish_job(job['id'], 'failed', error=str(e))
+            metrics.record_error(f"job.{job['kind']}", e)
+            print(f"Job {job['id']} failed: {e}")
+        else:
+            self.store.finish_job(job['id'], 'done')
+            print(f"Job {job['id']} done")
+        finally:
+            self.status.update(job=None, kind=None)
+
+    def step(self):
+        # Run the next queued job, if any; returns whether one ran
+        job = self.store.claim_job()
+        if job is None:
+            return False
+        self.run_job(job)
+        return True
+
+
+def run_workers(workers, interval=0, poll=5.0, once=False):
+    """
+    Process the job queues of all workers' accounts until stopped, one job
+    at a time and round-robin across accounts. interval > 0 queues a sync
+    for every account each interval seconds; once=True returns when all
+    queues are empty.
+    """
+    for worker in workers:
+        requeued = worker.store.requeue_running_jobs()
+        if requeued:
+            print(f"[{worker.account}] requeued {requeued} interrupted jobs")
+    stopping = workers[0].stopping
+    finished = threading.Event()
+
+    def heartbeat():
+        # Keeps every account's worker visible to the UI, also while a long
+        # job of another account runs
+        while not finished.wait(WORKER_TIMEOUT / 4):
+            for worker in workers:
+                worker.status['heartbeat'] = time.time()
+                worker.store.set_meta('worker', worker.status)
+
+    beat = threading.Thread(target=heartbeat, daemon=True)
+    beat.start()
+    next_sync = time.time()
+    try:
+        while not stopping.is_set():
+            if interval and time.time() >= next_sync:
+                for worker in workers:
+                    worker.store.enqueue_job('sync')
+                next_sync = time.time() + interval
+            ran = False
+            for worker in workers:
+                if stopping.is_set():
+                    break
+                ran = worker.step() or ran
+            if ran:
+                continue
+            if once:
+                break
+            for worker in workers:
+                worker.status.update(stage='idle', done=0, total=0)
+                if worker.store.due_ops(time.time(), limit=1):
+                    worker.store.enqueue_job('flush')
+            stopping.wait(poll)
+    finally:
+        finished.set()
+        beat.join()
+        for worker in workers:
+            worker.status.update(heartbeat=0, stage='stopped')
+            worker.store.set_meta('worker', worker.status)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='mail_mentor', description="Mail Mentor headless sync worker")
+    parser.add_argument('--account', action='append', default=None,
+                        help="account to serve (repeatable, 'all' for every account; default: MAIL_ACCOUNT)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    sync = commands.add_parser('sync', help="run one sync (fetch + embed) and exit")
+    sync.add_argument('--attachments', action='store_true', help="also index attachment text")
+    worker = commands.add_parser('worker', help="process the job queue until stopped")
+    worker.add_argument('--interval', type=float, default=float(os.getenv("SYNC_INTERVAL", 300)),
+                        help="seconds between scheduled syncs, 0 = only queued jobs")
+    worker.add_argument('--poll', type=float, default=5.0, help="seconds between queue checks")
+    worker.add_argument('--metrics-port', type=int, default=int(os.getenv("METRICS_PORT", 0)),
+                        help="serve Prometheus metrics on this port (enables METRICS)")
+    enqueue = commands.add_parser('enqueue', help="queue a job for a running worker")
+    enqueue.add_argument('kind', choices=['sync', 'embed', 'attachments', 'flush', 'cluster'])
+    commands.add_parser('status', help="show the worker and recent jobs")
+    args = parser.parse_args()
+
+    accounts = args.account or [get_account().name]
+    if 'all' in accounts:
+        accounts = list_accounts()
+    if args.command == 'enqueue':
+        for account in accounts:
+            print(f"[{account}] queued job {get_email_store(account).enqueue_job(args.kind)}")
+        return
+    if args.command == 'status':
+        for account in accounts:
+            store = get_email_store(account)
+            status = worker_status(store)
+            print(f"[{account}] worker: {status if status else 'not running'}")
+            for job in store.jobs():
+                print(f"{job['id']:>5} {job['kind']:<12} {job['status']:<8} {job['created_at']} "
+                      f"{job['error'] or ''}")
+        return
+
+    stopping = threading.Event()
+    workers = [Worker(account, stopping=stopping) for account in accounts]
+    workers[0].install_signal_handlers()
+    if args.command == 'sync':
+        for worker in workers:
+            worker.store.enqueue_job('sync')
+            if args.attachments:
+                worker.store.enqueue_job('attachments')
+        run_workers(workers, once=True)
+    else:
+        if args.metrics_port:
+            if not metrics.enabled():
+                metrics.enable(os.getenv("METRICS_JSONL"))
+            metrics.serve(args.metrics_port)
+            print(f"Serving metrics on http://127.0.0.1:{args.metrics_port}/metrics")
+        run_workers(workers, interval=args.interval, poll=args.poll)
+
+
+if __name__ == '__main__':
+    main()
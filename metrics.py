@@ -0,0 +1,273 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Timing spans and counters for the Gmail, embedding, cache and search
+# paths. Off unless METRICS=1 or METRICS_JSONL is set; while off, span()
+# hands out one shared no-op context manager and count() returns at once,
+# so instrumented code pays a function call and nothing else.
+#   with metrics.span('gmail.request', method='GET'): ...
+#   metrics.count('gmail.retry', reason='429')
+# Totals are exported in the Prometheus text format (prometheus_text, or
+# serve() for a scrape endpoint) and every span, counter and error can be
+# appended as one JSON line to METRICS_JSONL. The UI shows the recent spans
+# in a debug panel.
+
+# Span and error records kept for the debug panel
+RECENT_SPANS = 500
+RECENT_ERRORS = 50
+# Upper bounds (seconds) of the exported latency histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PREFIX = 'mail_mentor_'
+
+_lock = threading.Lock()
+_enabled = False
+_sink = None
+_counters = {}
+_histograms = {}
+_recent = deque(maxlen=RECENT_SPANS)
+_errors = deque(maxlen=RECENT_ERRORS)
+
+
+def enabled():
+    return _enabled
+
+
+def enable(jsonl_path=None):
+    # Start recording; jsonl_path also appends every record to that file
+    global _enabled, _sink
+    with _lock:
+        if jsonl_path and _sink is None:
+            _sink = open(jsonl_path, 'a', encoding='utf-8', buffering=1)
+        _enabled = True
+
+
+def disable():
+    global _enabled, _sink
+    with _lock:
+        _enabled = False
+        if _sink is not None:
+            _sink.close()
+            _sink = None
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _recent.clear()
+        _errors.clear()
+
+
+def _write(record):
+    # Caller holds _lock
+    if _sink is not None:
+        try:
+            _sink.write(json.dumps(record, default=str) + '\n')
+        except (OSError, ValueError) as e:
+            print(f"Error writing metrics: {e}")
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.labels['error'] = exc_type.__name__
+        record = {'type': 'span', 'name': self.name, 'labels': self.labels,
+                  'ms': seconds * 1000, 'time': time.time()}
+        with _lock:
+            histogram = _histograms.get(_key(self.name, self.labels))
+            if histogram is None:
+                histogram = _histograms[_key(self.name, self.labels)] = {
+                    'buckets': [0] * len(BUCKETS), 'count': 0, 'sum': 0.0, 'max': 0.0}
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+            histogram['max'] = max(histogram['max'], seconds)
+            _recent.append(record)
+            _write(record)
+        return False
+
+
+def span(name, **labels):
+    """
+    Context manager timing its block as one span of name; labels should
+    take few distinct values (method, kind), never message ids. A block
+    left by an exception is recorded with error=<exception class>.
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, labels)
+
+
+def timed(name, **labels):
+    # Decorator form of span
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Span(name, dict(labels)):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, value=1, **labels):
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+        if _sink is not None:
+            _write({'type': 'count', 'name': name, 'labels': labels, 'value': value, 'time': time.time()})
+
+
+def record_error(source, error):
+    # Count an error of source and keep it for the debug panel
+    if not _enabled:
+        return
+    record = {'type': 'error', 'source': source, 'error': f"{type(error).__name__}: {error}", 'time': time.time()}
+    key = _key('errors', {'source': source})
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + 1
+        _errors.append(record)
+        _write(record)
+
+
+def recent_spans(limit=RECENT_SPANS):
+    # Newest first
+    with _lock:
+        return list(reversed(_recent))[:limit]
+
+
+def recent_errors():
+    with _lock:
+        return list(reversed(_errors))
+
+
+def summary():
+    """
+    Per span name and labels: count, mean and max ms and the p50/p99 of
+    the spans still in the recent window; plus every counter.
+    """
+    with _lock:
+        histograms = {key: dict(value) for key, value in _histograms.items()}
+        counters = dict(_counters)
+        recent = list(_recent)
+    samples = {}
+    for record in recent:
+        samples.setdefault(_key(record['name'], record['labels']), []).append(record['ms'])
+    spans = []
+    for (name, labels), histogram in sorted(histograms.items()):
+        window = sorted(samples.get((name, labels), []))
+        spans.append({
+            'name': name,
+            'labels': dict(labels),
+            'count': histogram['count'],
+            'mean_ms': histogram['sum'] / histogram['count'] * 1000,
+            'max_ms': histogram['max'] * 1000,
+            'p50_ms': window[len(window) // 2] if window else None,
+            'p99_ms': window[min(len(window) - 1, int(len(window) * 0.99))] if window else None,
+        })
+    counts = [{'name': name, 'labels': dict(labels), 'value': value}
+              for (name, labels), value in sorted(counters.items())]
+    return {'spans': spans, 'counters': counts}
+
+
+def _metric_name(name):
+    return PREFIX + re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def _label_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+def prometheus_text():
+    """Counters and span histograms in the Prometheus text exposition format."""
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((key, dict(value, buckets=list(value['buckets']))) for key, value in _histograms.items())
+    lines = []
+    typed = set()
+    for (name, labels), value in counters:
+        metric = _metric_name(name) + '_total'
+        if metric not in typed:
+            typed.add(metric)
+            lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric}{_label_text(labels)} {value}")
+    for (name, labels), histogram in histograms:
+        metric = _metric_name(name) + '_seconds'
+        if metric not in typed:
+            typed.add(metric)
+            lines.append(f"# TYPE {metric} histogram")
+        # Buckets were filled per bound, so they are already cumulative
+        for bound, observed in zip(BUCKETS, histogram['buckets']):
+            lines.append(f"{metric}_bucket{_label_text(labels, [('le', bound)])} {observed}")
+        lines.append(f"{metric}_bucket{_label_text(labels, [('le', '+Inf')])} {histogram['count']}")
+        lines.append(f"{metric}_sum{_label_text(labels)} {histogram['sum']:.6f}")
+        lines.append(f"{metric}_count{_label_text(labels)} {histogram['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host='127.0.0.1'):
+    # Scrape endpoint http://host:port/metrics on a daemon thread
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name='metrics').start()
+    return server
+
+
+if os.getenv("METRICS", "0") == "1" or os.getenv("METRICS_JSONL"):
+    enable(os.getenv("METRICS_JSONL"))
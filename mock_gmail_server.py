@@ -0,0 +1,138 @@
+import argparse
+import asyncio
+import random
+
+from aiohttp import web
+
+from fake_gmail import make_message
+
+# Local HTTP stand-in for the Gmail REST endpoints AsyncGmailClient calls,
+# with configurable latency and 429 injection, for benchmarks:
+#   python -m mock_gmail_server --port 8089 --count 1000 --latency 0.05
+# then point AsyncGmailClient(base_url='http://127.0.0.1:8089/gmail/v1/users/me').
+
+BASE_PATH = '/gmail/v1/users/me'
+
+
+class MockGmail:
+    def __init__(self, count=1000, latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.labels = {}
+        self.indexes = {}
+        for index in range(count):
+            msg = make_message(index, seed)
+            self.labels[msg['id']] = set(msg['labelIds'])
+            self.indexes[msg['id']] = index
+        self.sent = []
+        self.drafts = []
+        self.requests = 0
+        self.throttled = 0
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self.throttled += 1
+            return web.json_response({'error': {'code': 429, 'message': 'Rate Limit Exceeded'}},
+                                     status=429, headers={'Retry-After': '0'})
+        return await handler(request)
+
+    def _modify(self, msg_id, body):
+        labels = self.labels.get(msg_id)
+        if labels is None:
+            raise web.HTTPNotFound()
+        labels.update(body.get('addLabelIds') or [])
+        labels.difference_update(body.get('removeLabelIds') or [])
+        return labels
+
+    async def profile(self, request):
+        return web.json_response({'emailAddress': 'me@example.com', 'messagesTotal': len(self.labels),
+                                  'historyId': '1'})
+
+    async def send(self, request):
+        self.sent.append((await request.json())['raw'])
+        return web.json_response({'id': f"sent-{len(self.sent)}", 'labelIds': ['SENT']})
+
+    async def create_draft(self, request):
+        self.drafts.append(await request.json())
+        return web.json_response({'id': f"draft-{len(self.drafts)}"})
+
+    async def modify(self, request):
+        msg_id = request.match_info['id']
+        labels = self._modify(msg_id, await request.json())
+        return web.json_response({'id': msg_id, 'labelIds': sorted(labels)})
+
+    async def get_message(self, request):
+        msg_id = request.match_info['id']
+        if msg_id not in self.labels:
+            raise web.HTTPNotFound()
+        msg = make_message(self.indexes[msg_id], self.seed)
+        return web.json_response(dict(msg, labelIds=sorted(self.labels[msg_id])))
+
+    async def trash(self, request):
+        msg_id = request.match_info['id']
+        labels = self._modify(msg_id, {'addLabelIds': ['TRASH'], 'removeLabelIds': ['INBOX']})
+        return web.json_response({'id': msg_id, 'labelIds': sorted(labels)})
+
+    async def delete(self, request):
+        if self.labels.pop(request.match_info['id'], None) is None:
+            raise web.HTTPNotFound()
+        return web.Response(status=204)
+
+    async def batch_modify(self, request):
+        body = await request.json()
+        for msg_id in body['ids']:
+            if msg_id in self.labels:
+                self._modify(msg_id, body)
+        return web.Response(status=204)
+
+    async def batch_delete(self, request):
+        for msg_id in (await request.json())['ids']:
+            self.labels.pop(msg_id, None)
+        return web.Response(status=204)
+
+    def app(self):
+        app = web.Application(middlewares=[self.middleware])
+        app.add_routes([
+            web.get(BASE_PATH + '/profile', self.profile),
+            web.post(BASE_PATH + '/messages/send', self.send),
+            web.post(BASE_PATH + '/drafts', self.create_draft),
+            web.post(BASE_PATH + '/messages/batchModify', self.batch_modify),
+            web.post(BASE_PATH + '/messages/batchDelete', self.batch_delete),
+            web.post(BASE_PATH + '/messages/{id}/modify', self.modify),
+            web.post(BASE_PATH + '/messages/{id}/trash', self.trash),
+            web.get(BASE_PATH + '/messages/{id}', self.get_message),
+            web.delete(BASE_PATH + '/messages/{id}', self.delete),
+        ])
+        return app
+
+
+async def start_mock_server(mock, host='127.0.0.1', port=0):
+    # Serve mock on the running loop; returns (runner, base_url)
+    runner = web.AppRunner(mock.app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}{BASE_PATH}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a mock Gmail REST API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds per request")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction answered with 429")
+    args = parser.parse_args()
+    mock = MockGmail(count=args.count, latency=args.latency, error_rate=args.error_rate)
+    web.run_app(mock.app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
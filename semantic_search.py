@@ -1,12 +1,140 @@
-from sentence_transformers import SentenceTransformer
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 
+import metrics
+from dedup import collapse_results
+from vector_index import VectorIndex
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+# Output size of MODEL_NAME, known up front so the indexes can load
+# without importing torch
+EMBEDDING_DIM = 384
+
+# Reciprocal rank fusion constant; 60 is the usual choice from the RRF paper
+RRF_K = 60
+
+# Streamlit reruns the search on every widget interaction while the search
+# box is filled, so query vectors and store-wide results are cached (LRU)
+QUERY_CACHE_SIZE = 256
+RESULT_CACHE_SIZE = 64
+
+def normalize_query(query):
+    # MODEL_NAME is uncased, so case and spacing do not change the vector
+    return ' '.join(query.lower().split())
+
+def chunk_words(text, size=120, overlap=30, max_chunks=8):
+    # Overlapping word windows; ~120 words stays under the model's
+    # 256-token limit once the From/Subject header is added
+    words = text.split()
+    if not words:
+        return ['']
+    step = max(1, size - overlap)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(' '.join(words[start:start + size]))
+        if start + size >= len(words) or len(chunks) == max_chunks:
+            break
+    return chunks
+
+# One SentenceTransformer per process, shared by the engines of all
+# accounts (see accounts.py)
+_shared_model = None
+_shared_model_lock = threading.Lock()
+
+def load_model():
+    # sentence_transformers pulls in torch, so both the import and the
+    # model load wait until something actually needs embeddings
+    global _shared_model
+    if _shared_model is None:
+        with _shared_model_lock:
+            if _shared_model is None:
+                from sentence_transformers import SentenceTransformer
+                _shared_model = SentenceTransformer(MODEL_NAME)
+    return _shared_model
+
+# Threads for cross-account searches; encoding, SQLite and numpy release
+# the GIL, so shards are searched in parallel
+_search_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='shard-search')
+
+def search_accounts(query, shards, top_k=10, min_score=0.5):
+    """
+    Run smart_search on every account shard in parallel and merge the
+    per-account rankings with reciprocal rank fusion. shards maps account
+    name -> (engine, store); results carry their account in 'account'.
+    """
+    futures = {
+        name: _search_pool.submit(engine.smart_search, query, None, top_k=top_k,
+                                  min_score=min_score, store=store)
+        for name, (engine, store) in shards.items()
+    }
+    fused = []
+    for name, future in futures.items():
+        try:
+            results = future.result()
+        except Exception as e:
+            print(f"Error searching account {name}: {e}")
+            continue
+        for rank, email in enumerate(results):
+            fused.append((1.0 / (RRF_K + rank + 1), dict(email, account=name)))
+    fused.sort(key=lambda item: item[0], reverse=True)
+    return [email for _, email in fused[:top_k]]
+
 class SemanticSearchEngine:
-    def __init__(self):
-        # Load the all-MiniLM-L6-v2 model
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+    def __init__(self, index_path='email_embeddings', cache_path='embedding_cache', batch_size=64,
+                 chunking=False, chunk_size=120, chunk_overlap=30, max_chunks=8,
+                 chunk_index_path='email_chunks', attachment_index_path='attachment_chunks',
+                 dim=EMBEDDING_DIM, quantization='float32', binary_prefilter=0):
+        # The all-MiniLM-L6-v2 model is loaded on first use and shared by
+        # all engines (see load_model); set _model to use another one
+        self._model = None
+        # Persistent, pre-normalized embedding matrix (see vector_index.py);
+        # quantization and binary_prefilter apply to every index below
+        vector_options = dict(dim=dim, quantization=quantization, binary_prefilter=binary_prefilter)
+        self.index = VectorIndex(index_path, **vector_options)
+        # Vectors keyed by a hash of the normalized email text, so duplicate
+        # or re-fetched mail is never encoded twice
+        self.text_cache = VectorIndex(cache_path, **vector_options)
+        self.batch_size = batch_size
+        self.last_embedding_stats = {}
+        # Chunking mode: long bodies are embedded as overlapping windows
+        # (at most max_chunks per email, ids "<email id>#<n>") and search
+        # scores each email by its best chunk
+        self.chunking = chunking
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.max_chunks = max_chunks
+        self.chunks = VectorIndex(chunk_index_path, **vector_options)
+        # Chunks of extracted attachment text (see attachment_ingest.py),
+        # ids "<email id>|<attachment id>|<page>|<n>"
+        self.attachments = VectorIndex(attachment_index_path, **vector_options)
+        # Indexes changed since they were last written, see save
+        self._unsaved = set()
+        # Normalized query -> vector, and (kind, query, params) -> results
+        # tagged with the index and store versions they were computed at
+        self._query_vectors = OrderedDict()
+        self._results = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # Timings of the calling thread's searches, see search_stats
+        self._stats = threading.local()
 
-    def create_email_vector(self, email):
+    @property
+    def model(self):
+        return self._model if self._model is not None else load_model()
+
+    @property
+    def model_ready(self):
+        return self._model is not None or _shared_model is not None
+
+    def warm_up(self):
+        # Load the model on a background thread while the UI renders
+        threading.Thread(target=lambda: self.model, daemon=True).start()
+
+    def email_text(self, email, body=None):
         # Create a text representation of the email
         # You can customize this to include more fields if needed
         if not isinstance(email, dict):
@@ -16,46 +144,414 @@ class SemanticSearchEngine:
         for field in ['sender', 'subject', 'body']:
             if field not in email:
                 raise ValueError(f"Email is missing required field: {field}")
-        text = (
+        return (
             f"From: {email.get('sender', '')}\n"
             f"Subject: {email.get('subject', '')}\n"
-            f"Body: {email.get('body', '')}"
+            f"Body: {email.get('body', '') if body is None else body}"
         )
-        return self.model.encode(text)
 
-    def compute_and_save_embeddings(self, emails):
-        # Only embed emails that don't have an embedding yet
+    def chunk_body(self, email):
+        return chunk_words(email.get('body', ''), self.chunk_size, self.chunk_overlap, self.max_chunks)
+
+    @staticmethod
+    def chunk_id(msg_id, n):
+        return f"{msg_id}#{n}"
+
+    @staticmethod
+    def attachment_chunk_id(msg_id, attachment_id, page, n):
+        return f"{msg_id}|{attachment_id}|{page}|{n}"
+
+    def attachment_chunks(self, pages):
+        # [(page, n, text)] for the non-empty chunks of each page
+        return [(page, n, chunk)
+                for page, text in enumerate(pages)
+                for n, chunk in enumerate(chunk_words(text or '', self.chunk_size, self.chunk_overlap,
+                                                      self.max_chunks))
+                if chunk]
+
+    def save(self):
+        # Write every index changed since the last save. Each save rewrites
+        # the whole file, so bulk callers pass save=False per batch and
+        # call this once (or every so often) instead.
+        unsaved, self._unsaved = self._unsaved, set()
+        for index in unsaved:
+            index.save()
+
+    def index_attachments(self, attachments, save=True):
+        """
+        Embed the extracted text of a batch of attachments, given as
+        (email id, attachment id, filename, page texts) tuples, and save
+        the indexes unless save is False. Returns the number of chunks
+        embedded.
+        """
+        ids, texts = [], []
+        for msg_id, attachment_id, filename, pages in attachments:
+            for page, n, text in self.attachment_chunks(pages):
+                ids.append(self.attachment_chunk_id(msg_id, attachment_id, page, n))
+                texts.append(f"Attachment: {filename}\n{text}")
+        if ids:
+            vectors, _ = self.encode_texts(texts)
+            self.attachments.add(ids, vectors)
+            self._unsaved.add(self.attachments)
+        if save:
+            self.save()
+        return len(ids)
+
+    def create_email_vector(self, email):
+        return self.model.encode(self.email_text(email))
+
+    @staticmethod
+    def text_hash(text):
+        # The model is uncased, so case and whitespace differences do not
+        # change the embedding and should not defeat the cache
+        return hashlib.sha1(' '.join(text.lower().split()).encode()).hexdigest()
+
+    def encode_texts(self, texts):
+        """
+        Embed texts in model batches, reusing cached vectors for texts seen
+        before and encoding each distinct text only once.
+        """
+        hashes = [self.text_hash(text) for text in texts]
+        pending = {}
+        for text_hash, text in zip(hashes, texts):
+            if text_hash not in self.text_cache and text_hash not in pending:
+                pending[text_hash] = text
+        metrics.count('cache.lookup', len(texts) - len(pending), cache='embedding', result='hit')
+        metrics.count('cache.lookup', len(pending), cache='embedding', result='miss')
+        if pending:
+            with metrics.span('embed.encode', kind='batch'):
+                vectors = self.model.encode(list(pending.values()), batch_size=self.batch_size)
+            metrics.count('embed.texts', len(pending))
+            with metrics.span('cache.write', cache='embedding'):
+                self.text_cache.add(list(pending), vectors)
+            self._unsaved.add(self.text_cache)
+        with metrics.span('cache.read', cache='embedding'):
+            return self.text_cache.vectors(hashes), len(pending)
+
+    def embed_chunks(self, emails):
+        # Embed every chunk of emails into the chunk index; the email-level
+        # vector is the mean of its chunk vectors
+        chunk_ids, chunk_texts, owners = [], [], []
+        for n, email in enumerate(emails):
+            for i, body in enumerate(self.chunk_body(email)):
+                chunk_ids.append(self.chunk_id(email['id'], i))
+                chunk_texts.append(self.email_text(email, body=body))
+                owners.append(n)
+        vectors, encoded = self.encode_texts(chunk_texts)
+        self.chunks.add(chunk_ids, vectors)
+        self._unsaved.add(self.chunks)
+        email_vectors = np.zeros((len(emails), vectors.shape[1]), dtype=np.float32)
+        np.add.at(email_vectors, owners, vectors)
+        return email_vectors, len(chunk_texts), encoded
+
+    @metrics.timed('embed')
+    def compute_and_save_embeddings(self, emails, duplicate_of=None, save=True):
+        # Only embed emails missing from the embedding store (trashed mail
+        # stays out of it). Vectors left on emails by older JSON caches are
+        # moved into the store instead of being recomputed. duplicate_of
+        # maps near-duplicates to their group's first email (see dedup.py);
+        # they are skipped, and dropped from the index, while that email
+        # is embedded. With save=False the indexes are left for save().
+        start = time.perf_counter()
+        new_ids, new_vectors = [], []
+        pending = []
+        duplicate_of = duplicate_of or {}
+        live = {email['id'] for email in emails if 'TRASH' not in email.get('labels', [])} if duplicate_of else set()
+        duplicates = []
         for email in emails:
-            if 'embedding' not in email:
-                email['embedding'] = self.create_email_vector(email).tolist()
+            legacy_vector = email.pop('embedding', None)
+            if 'TRASH' in email.get('labels', []):
+                continue
+            representative = duplicate_of.get(email['id'])
+            if representative is not None and (representative in live or representative in self.index):
+                duplicates.append(email['id'])
+                continue
+            needs_chunks = self.chunking and self.chunk_id(email['id'], 0) not in self.chunks
+            if email['id'] in self.index and not needs_chunks:
+                continue
+            if legacy_vector is None or needs_chunks:
+                pending.append(email)
+            else:
+                new_ids.append(email['id'])
+                new_vectors.append(legacy_vector)
+        if new_ids:
+            self.index.add(new_ids, new_vectors)
+        texts = encoded = 0
+        if pending:
+            if self.chunking:
+                vectors, texts, encoded = self.embed_chunks(pending)
+            else:
+                texts = len(pending)
+                vectors, encoded = self.encode_texts([self.email_text(email) for email in pending])
+            self.index.add([email['id'] for email in pending], vectors)
+        dropped = self.index.remove(duplicates)
+        if self.chunks.remove([self.chunk_id(msg_id, n) for msg_id in duplicates for n in range(self.max_chunks)]):
+            self._unsaved.add(self.chunks)
+        if new_ids or pending or dropped:
+            self._unsaved.add(self.index)
+            elapsed = time.perf_counter() - start
+            count = len(new_ids) + len(pending)
+            self.last_embedding_stats = {
+                'emails': count,
+                'texts': texts,
+                'encoded': encoded,
+                'reused': texts - encoded,
+                'duplicates_skipped': len(duplicates),
+                'seconds': elapsed,
+                'emails_per_second': count / elapsed if elapsed else 0.0,
+            }
+            print(f"Embedded {count} emails ({encoded} of {texts} texts encoded, "
+                  f"{len(duplicates)} near-duplicates skipped) "
+                  f"in {elapsed:.2f}s, {self.last_embedding_stats['emails_per_second']:.1f} emails/s")
+        if save:
+            self.save()
         return emails
 
-    def search(self, query, emails, top_k=10, min_score=0.5):
-        # Compute query embedding
-        query_vec = self.model.encode(query)
-        # Prepare email embeddings
-        email_embeddings = np.array([np.array(email['embedding']) for email in emails if 'embedding' in email])
-        if len(email_embeddings) == 0:
+    def embed_missing(self, store):
+        """
+        compute_and_save_embeddings for just the stored mail that needs it:
+        ids missing from the index (or from the chunk index), and indexed
+        near-duplicates to drop. Only those rows are read, so an up to
+        date index costs one scan of the store's ids. Returns the count.
+        """
+        duplicate_of = store.representatives()
+
+        def needs_work(msg_id):
+            representative = duplicate_of.get(msg_id)
+            if msg_id in self.index:
+                return representative is not None or (
+                    self.chunking and self.chunk_id(msg_id, 0) not in self.chunks)
+            return representative is None or representative not in self.index
+
+        msg_ids = [msg_id for msg_id in store.ids(excluded_labels=('TRASH',)) if needs_work(msg_id)]
+        if msg_ids:
+            self.compute_and_save_embeddings(store.get_many(msg_ids), duplicate_of)
+        return len(msg_ids)
+
+    def reload(self):
+        # Reload indexes another process has saved since they were loaded
+        for index in (self.index, self.text_cache, self.chunks, self.attachments):
+            index.reload_if_changed()
+
+    def remove_from_index(self, msg_ids):
+        # Call when emails are deleted or trashed so they drop out of search
+        msg_ids = list(msg_ids)
+        if self.index.remove(msg_ids):
+            self.index.save()
+        chunk_ids = [self.chunk_id(msg_id, n) for msg_id in msg_ids for n in range(self.max_chunks)]
+        if self.chunks.remove(chunk_ids):
+            self.chunks.save()
+        removed = set(msg_ids)
+        attachment_ids = [i for i in self.attachments.ids if i.split('|', 1)[0] in removed]
+        if self.attachments.remove(attachment_ids):
+            self.attachments.save()
+
+    # --- Query and result caches ---
+
+    def _thread_stats(self):
+        stats = getattr(self._stats, 'current', None)
+        if stats is None:
+            stats = self._stats.current = {'encode_ms': 0.0, 'score_ms': 0.0,
+                                           'query_cache_hits': 0, 'result_cache_hits': 0}
+        return stats
+
+    def search_stats(self):
+        """
+        Encode and scoring time (ms) and cache hits of the calling thread's
+        searches since the previous call; scoring covers everything but
+        encoding (vector scans, BM25, loading the hits).
+        """
+        stats = self._thread_stats()
+        self._stats.current = None
+        return stats
+
+    def encode_query(self, query):
+        key = normalize_query(query)
+        stats = self._thread_stats()
+        with self._cache_lock:
+            vector = self._query_vectors.get(key)
+            if vector is not None:
+                self._query_vectors.move_to_end(key)
+                stats['query_cache_hits'] += 1
+                metrics.count('cache.lookup', cache='query', result='hit')
+                return vector
+        metrics.count('cache.lookup', cache='query', result='miss')
+        start = time.perf_counter()
+        with metrics.span('embed.encode', kind='query'):
+            vector = np.asarray(self.model.encode(key), dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) + 1e-10)
+        stats['encode_ms'] += (time.perf_counter() - start) * 1000
+        with self._cache_lock:
+            self._query_vectors[key] = vector
+            while len(self._query_vectors) > QUERY_CACHE_SIZE:
+                self._query_vectors.popitem(last=False)
+        return vector
+
+    def _data_version(self, store):
+        return (self.index.version, self.chunks.version, self.attachments.version, store.content_version())
+
+    def _cached_results(self, key, store, compute):
+        # compute() unless the same search ran since the indexes and the
+        # store last changed; callers get copies they may modify
+        stats = self._thread_stats()
+        start = time.perf_counter()
+        encode_before = stats['encode_ms']
+        version = self._data_version(store)
+        with self._cache_lock:
+            entry = self._results.get(key)
+            if entry is not None and entry[0] == version:
+                self._results.move_to_end(key)
+                stats['result_cache_hits'] += 1
+                results = entry[1]
+            else:
+                entry = None
+        metrics.count('cache.lookup', cache='results', result='miss' if entry is None else 'hit')
+        if entry is None:
+            results = compute()
+            with self._cache_lock:
+                self._results[key] = (version, [dict(email) for email in results])
+                while len(self._results) > RESULT_CACHE_SIZE:
+                    self._results.popitem(last=False)
+        elapsed = (time.perf_counter() - start) * 1000
+        stats['score_ms'] += elapsed - (stats['encode_ms'] - encode_before)
+        return [dict(email) for email in results]
+
+    @staticmethod
+    def _lookup(msg_ids, by_id, store):
+        # Emails for msg_ids, in order, from the caller's list or the store
+        if by_id is None:
+            return store.get_many(msg_ids)
+        return [by_id[msg_id] for msg_id in msg_ids if msg_id in by_id]
+
+    @metrics.timed('search', kind='semantic')
+    def search(self, query, emails=None, top_k=10, min_score=0.5, store=None):
+        # emails=None searches the whole index and loads the hits from store
+        query_vec = self.encode_query(query)
+        by_id = candidates = None
+        if emails is not None:
+            by_id = {email['id']: email for email in emails}
+            # Restrict scoring to the given emails unless they cover every
+            # indexed id; a list as long as the index can still miss some
+            if len(by_id) < len(self.index) or not all(msg_id in by_id for msg_id in self.index.ids):
+                candidates = by_id
+        if self.chunking and len(self.chunks):
+            return self.search_chunks(query_vec, by_id, candidates, top_k, min_score, store)
+        hits = self.index.search(query_vec, top_k=top_k, min_score=min_score, ids=candidates)
+        return self._lookup([msg_id for msg_id, _ in hits], by_id, store)
+
+    def search_chunks(self, query_vec, by_id, candidates, top_k, min_score, store=None):
+        """
+        Max-sim retrieval: rank emails by their best-scoring chunk. The first
+        top_k distinct emails always lie within the best top_k * max_chunks
+        chunks, so one chunk search is exact. Results are copies of the
+        emails with the winning chunk in 'matched_passage'.
+        """
+        if candidates is not None:
+            candidates = [self.chunk_id(msg_id, n) for msg_id in candidates for n in range(self.max_chunks)]
+        hits = self.chunks.search(query_vec, top_k=top_k * self.max_chunks, min_score=min_score, ids=candidates)
+        best = {}
+        for chunk_id, _ in hits:
+            msg_id, _, n = chunk_id.rpartition('#')
+            if msg_id in best or (by_id is not None and msg_id not in by_id):
+                continue
+            best[msg_id] = int(n)
+            if len(best) == top_k:
+                break
+        results = []
+        for email in self._lookup(list(best), by_id, store):
+            passages = self.chunk_body(email)
+            n = best[email['id']]
+            results.append(dict(email, matched_passage=passages[n] if n < len(passages) else ''))
+        return results
+
+    @metrics.timed('search', kind='attachments')
+    def search_attachments(self, query, store, top_k=10, min_score=0.5):
+        """
+        Search extracted attachment text. Returns copies of the owning
+        emails, best first, each with 'matched_attachment' set to the
+        filename, page (1-based) and passage of its best chunk.
+        """
+        if not len(self.attachments):
             return []
-        # Compute cosine similarities
-        scores = np.dot(email_embeddings, query_vec) / (
-            np.linalg.norm(email_embeddings, axis=1) * np.linalg.norm(query_vec) + 1e-10
+        return self._cached_results(
+            ('attachments', normalize_query(query), top_k, min_score), store,
+            lambda: self._search_attachments(query, store, top_k, min_score)
         )
-        # Get indices of emails above the threshold
-        valid_indices = np.where(scores >= min_score)[0]
-        if len(valid_indices) == 0:
-            return []
-        # Sort valid indices by score
-        sorted_indices = valid_indices[np.argsort(scores[valid_indices])[::-1]]
-        emails_with_embeddings = [email for email in emails if 'embedding' in email]
-        # Return top_k emails above threshold
-        return [emails_with_embeddings[i] for i in sorted_indices[:top_k]]
 
-    def smart_search(self, query, emails, top_k=10, min_score=0.5):
+    def _search_attachments(self, query, store, top_k, min_score):
+        query_vec = self.encode_query(query)
+        hits = self.attachments.search(query_vec, top_k=top_k * self.max_chunks, min_score=min_score)
+        best = {}
+        for chunk_id, score in hits:
+            msg_id, attachment_id, page, n = chunk_id.rsplit('|', 3)
+            if msg_id not in best:
+                best[msg_id] = (attachment_id, int(page), int(n), score)
+                if len(best) == top_k:
+                    break
+        results = []
+        for email in store.get_many(list(best)):
+            attachment_id, page, n, score = best[email['id']]
+            filename = next((att['filename'] for att in email['attachments']
+                             if att['attachment_id'] == attachment_id), '')
+            pages = store.attachment_pages(email['id'], attachment_id)
+            chunks = chunk_words(pages[page], self.chunk_size, self.chunk_overlap,
+                                 self.max_chunks) if page < len(pages) else []
+            results.append(dict(email, matched_attachment={
+                'attachment_id': attachment_id,
+                'filename': filename,
+                'page': page + 1,
+                'passage': chunks[n] if n < len(chunks) else '',
+                'score': score,
+            }))
+        return results
+
+    @metrics.timed('search', kind='hybrid')
+    def hybrid_search(self, query, emails, store, top_k=10, min_score=0.5, depth=50):
+        """
+        Fuse semantic and BM25 (store.search_text) rankings over emails with
+        reciprocal rank fusion, so exact tokens such as invoice numbers and
+        names are found even when the embeddings miss them. emails=None
+        searches the whole store.
+        """
+        depth = max(depth, top_k * 5)
+        by_id = None if emails is None else {email['id']: email for email in emails}
+        semantic = self.search(query, emails, top_k=depth, min_score=min_score, store=store)
+        lexical = [msg_id for msg_id, _ in store.search_text(query, limit=depth)
+                   if by_id is None or msg_id in by_id]
+        fused = {}
+        for ranking in ([email['id'] for email in semantic], lexical):
+            for rank, msg_id in enumerate(ranking):
+                fused[msg_id] = fused.get(msg_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+        top_ids = sorted(fused, key=fused.get, reverse=True)[:top_k]
+        # Prefer the semantic result copies, which may carry matched_passage
+        results = {email['id']: email for email in semantic}
+        missing = [msg_id for msg_id in top_ids if msg_id not in results]
+        results.update((email['id'], email) for email in self._lookup(missing, by_id, store))
+        return [results[msg_id] for msg_id in top_ids if msg_id in results]
+
+    @metrics.timed('search', kind='smart')
+    def smart_search(self, query, emails, top_k=10, min_score=0.5, store=None):
         """
         Perform a smart search that first filters emails by sender/domain
-        and then applies semantic search on the filtered set.
+        and then applies semantic search on the filtered set. With an
+        EmailStore, sender filters are full-text index lookups, the search
+        is hybrid BM25 + semantic and near-duplicates and messages of one
+        thread collapse into their best-ranked result; emails may then be
+        None to search the whole store, and the results are cached until
+        the store or the indexes change.
         """
+        if store is None:
+            return self._smart_search(query, emails, top_k, min_score, store)
+
+        def search():
+            # Over-fetch so collapsing still leaves top_k results
+            results = self._smart_search(query, emails, top_k * 2, min_score, store)
+            return collapse_results(results, store)[:top_k]
+        if emails is None:
+            return self._cached_results(('smart', normalize_query(query), top_k, min_score), store, search)
+        return search()
+
+    def _smart_search(self, query, emails, top_k, min_score, store):
         query_lower = query.lower()
         sender_keywords = []
 
@@ -66,26 +562,30 @@ class SemanticSearchEngine:
                 sender_keywords.append(parts[1].strip())
         if "@" in query_lower:
             sender_keywords.append(query_lower.split("@")[-1].split()[0])
+        latest = "last" in query_lower or "latest" in query_lower
 
         filtered_emails = emails
-        if sender_keywords:
+        if sender_keywords and store is not None:
+            filtered_emails = store.get_many(store.sender_ids(sender_keywords, latest=latest))
+        elif sender_keywords:
             filtered_emails = [
                 email for email in emails
                 if any(kw in email.get('sender', '').lower() for kw in sender_keywords)
             ]
             # If user asks for "last" or "latest", sort by date and return the latest
-            if "last" in query_lower or "latest" in query_lower:
+            if latest:
                 filtered_emails.sort(key=lambda e: e.get('date', ''), reverse=True)
                 filtered_emails = filtered_emails[:1]
 
-        if not filtered_emails:
+        if filtered_emails is not None and not filtered_emails:
             return []
 
         # If sender filter applied, optionally apply semantic search to filtered set
         # Or just return filtered_emails if "last"/"latest" was in query
-        if sender_keywords and ("last" in query_lower or "latest" in query_lower):
+        if sender_keywords and latest:
             return filtered_emails
 
-        # Otherwise, use semantic search
+        # Otherwise, use hybrid or semantic search
+        if store is not None:
+            return self.hybrid_search(query, filtered_emails, store, top_k=top_k, min_score=min_score)
         return self.search(query, filtered_emails, top_k=top_k, min_score=min_score)
-
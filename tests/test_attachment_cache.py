@@ -0,0 +1,22 @@
+from attachment_cache import AttachmentCache
+
+
+def test_same_content_under_two_ids_keeps_both(tmp_path):
+    cache = AttachmentCache(str(tmp_path))
+    data = b'%PDF-1.4 the same invoice sent twice'
+    cache.put('m1', 'a1', data)
+    cache.put('m2', 'a2', data)
+    assert cache.get('m1', 'a1') == data
+    assert cache.get('m2', 'a2') == data
+    # Stored once
+    assert cache.size() == len(data)
+    cache.close()
+
+
+def test_lru_eviction_drops_the_mappings_of_the_evicted_blob(tmp_path):
+    cache = AttachmentCache(str(tmp_path), max_bytes=100)
+    cache.put('m1', 'a1', b'x' * 60)
+    cache.put('m2', 'a2', b'y' * 60)
+    assert cache.get('m1', 'a1') is None
+    assert cache.get('m2', 'a2') == b'y' * 60
+    cache.close()
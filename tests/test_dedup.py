@@ -0,0 +1,56 @@
+import random
+
+from dedup import THRESHOLD, find_duplicates, minhash, shingles
+from email_store import EmailStore
+from fake_gmail import WORDS
+
+
+def jaccard(a, b):
+    a, b = shingles(a), shingles(b)
+    return len(a & b) / len(a | b)
+
+
+def estimate(a, b):
+    return float((minhash(a) == minhash(b)).mean())
+
+
+def random_text(rng, words=200):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def test_unrelated_texts_score_near_their_jaccard():
+    rng = random.Random(1)
+    for _ in range(50):
+        a, b = random_text(rng) + ' the his many', random_text(rng) + ' the his many'
+        assert abs(estimate(a, b) - jaccard(a, b)) < 0.2
+        assert estimate(a, b) < THRESHOLD
+
+
+def test_one_shared_trigram_is_not_a_duplicate():
+    a = "quarterly budget review meeting moved to thursday the his many"
+    b = "the his many photos from our hiking trip last weekend are online"
+    assert jaccard(a, b) < 0.1
+    assert estimate(a, b) < 0.3
+
+
+def test_near_copies_score_high():
+    a = "Your order 1234 has shipped and will arrive on Monday. Track your delivery in your account."
+    b = "Your order 98765 has shipped and will arrive on Monday. Track your delivery in your account."
+    assert estimate(a, b) == 1.0
+    c = a + " Thanks for shopping with us."
+    assert abs(estimate(a, c) - jaccard(a, c)) < 0.15
+
+
+def test_find_duplicates_groups_only_near_copies(tmp_path):
+    rng = random.Random(2)
+    store = EmailStore(str(tmp_path / 'store.db'))
+    emails = [{'id': f"u{n}", 'body': random_text(rng) + ' the his many', 'labels': ['INBOX']} for n in range(100)]
+    emails += [{'id': f"d{n}", 'labels': ['INBOX'],
+                'body': f"Your order {n} has shipped and will arrive soon. Track your delivery in your account."}
+               for n in range(20)]
+    store.upsert_many(emails)
+    stats = find_duplicates(store)
+    representatives = store.representatives()
+    assert stats['duplicates'] == 19
+    assert not any(msg_id.startswith('u') for msg_id in representatives)
+    assert len(set(representatives.values())) == 1
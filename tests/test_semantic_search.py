@@ -0,0 +1,27 @@
+from benchmarks.bench_suite import StubModel
+from semantic_search import SemanticSearchEngine
+
+
+def make_engine(tmp_path):
+    model = StubModel()
+    engine = SemanticSearchEngine(
+        index_path=str(tmp_path / 'embeddings'), cache_path=str(tmp_path / 'cache'),
+        chunk_index_path=str(tmp_path / 'chunks'), attachment_index_path=str(tmp_path / 'attachment_chunks'),
+        dim=model.get_sentence_embedding_dimension(),
+    )
+    engine._model = model
+    return engine
+
+
+def email(msg_id, subject):
+    return {'id': msg_id, 'subject': subject, 'sender': 'a@example.com', 'body': subject, 'labels': ['INBOX']}
+
+
+def test_list_as_long_as_the_index_is_still_a_restriction(tmp_path):
+    engine = make_engine(tmp_path)
+    engine.compute_and_save_embeddings([email('a', 'garden tomatoes'), email('b', 'invoice payment overdue')])
+    # Same size as the index, but 'b' is not in it: the best hit overall
+    # ('b') must not crowd out the best hit among the given emails
+    emails = [email('a', 'garden tomatoes'), email('c', 'unindexed')]
+    results = engine.search('invoice payment overdue', emails, top_k=1, min_score=-1)
+    assert [result['id'] for result in results] == ['a']
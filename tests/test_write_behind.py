@@ -0,0 +1,125 @@
+import asyncio
+
+from email_store import EmailStore
+from gmail_async import GmailAPIError
+from write_behind import MAX_RETRY_DELAY, RETRY_DELAY, flush_ops
+
+
+def make_store(tmp_path, count=3):
+    store = EmailStore(str(tmp_path / 'store.db'))
+    store.upsert_many([{'id': f"m{n}", 'subject': f"subject {n}", 'body': f"body {n}",
+                        'date': 'Mon, 6 Jan 2025 10:00:00 +0000', 'labels': ['INBOX', 'UNREAD']}
+                       for n in range(count)])
+    return store
+
+
+def next_attempt(store, msg_id):
+    return store.conn.execute('SELECT next_attempt FROM pending_ops WHERE message_id = ?', (msg_id,)).fetchone()[0]
+
+
+class FailingClient:
+    # Every batchModify fails with the given status
+    def __init__(self, status):
+        self.status = status
+        self.calls = 0
+
+    async def batch_modify(self, msg_ids, add, remove):
+        self.calls += 1
+        raise GmailAPIError(self.status, 'failed')
+
+
+def test_queued_change_is_local_until_completed(tmp_path):
+    store = make_store(tmp_path)
+    assert store.queue_ops(['m0'], 'labels', remove_labels=['UNREAD']) == ['m0']
+    assert store.get('m0')['labels'] == ['INBOX']
+    ops = store.due_ops(now=0)
+    assert [(op['message_id'], op['op']) for op in ops] == [('m0', 'labels')]
+    # The snapshot is Gmail's state, the labels the local one
+    assert sorted(ops[0]['snapshot']['labels']) == ['INBOX', 'UNREAD']
+    assert ops[0]['labels'] == ['INBOX']
+    store.complete_ops(ops)
+    assert store.due_ops(now=0) == []
+    assert store.get('m0')['labels'] == ['INBOX']
+
+
+def test_change_queued_during_a_flush_survives_its_completion(tmp_path):
+    store = make_store(tmp_path)
+    store.queue_ops(['m0'], 'labels', remove_labels=['UNREAD'])
+    ops = store.due_ops(now=0)
+    store.queue_ops(['m0'], 'trash', add_labels=['TRASH'], remove_labels=['INBOX'])
+    store.complete_ops(ops)
+    assert [op['op'] for op in store.due_ops(now=0)] == ['trash']
+
+
+def test_retry_waits_for_next_attempt(tmp_path):
+    store = make_store(tmp_path)
+    store.queue_ops(['m0'], 'labels', remove_labels=['UNREAD'])
+    store.retry_ops(store.due_ops(now=0), 'Gmail API error 503', next_attempt=100)
+    assert store.due_ops(now=99) == []
+    [op] = store.due_ops(now=100)
+    assert op['attempts'] == 1
+
+
+def test_flush_backs_off_transient_errors(tmp_path):
+    store = make_store(tmp_path)
+    store.queue_ops(['m0'], 'labels', remove_labels=['UNREAD'])
+    client = FailingClient(503)
+    delays = []
+    now = 0
+    for attempt in range(3):
+        result = asyncio.run(flush_ops(store, client, now=now))
+        assert result['retried'] == 1
+        delays.append(next_attempt(store, 'm0') - now)
+        assert store.due_ops(now=now) == []
+        now = next_attempt(store, 'm0')
+    # Jittered within [delay / 2, delay], doubling per attempt
+    for attempt, delay in enumerate(delays):
+        full = min(MAX_RETRY_DELAY, RETRY_DELAY * 2 ** attempt)
+        assert full / 2 <= delay <= full
+    assert client.calls == 3
+    # The local change stands while it is retried
+    assert store.get('m0')['labels'] == ['INBOX']
+
+
+def test_rollback_restores_labels(tmp_path):
+    store = make_store(tmp_path)
+    store.queue_ops(['m0'], 'trash', add_labels=['TRASH'], remove_labels=['INBOX'])
+    assert store.rollback_ops(store.due_ops(now=0)) == ['m0']
+    assert sorted(store.get('m0')['labels']) == ['INBOX', 'UNREAD']
+    assert store.pending_op_count() == 0
+
+
+def test_rollback_restores_a_deleted_message(tmp_path):
+    store = make_store(tmp_path)
+    store.queue_ops(['m1'], 'delete')
+    assert store.get('m1') is None
+    ops = store.due_ops(now=0)
+    assert ops[0]['labels'] is None
+    refetched = {'id': 'm1', 'subject': 'subject 1', 'body': 'body 1',
+                 'date': 'Mon, 6 Jan 2025 10:00:00 +0000', 'labels': ['INBOX', 'UNREAD']}
+    assert store.rollback_ops(ops, {'m1': refetched}) == ['m1']
+    email = store.get('m1')
+    assert email['body'] == 'body 1'
+    assert sorted(email['labels']) == ['INBOX', 'UNREAD']
+
+
+def test_rollback_without_refetch_keeps_the_snapshot(tmp_path):
+    store = make_store(tmp_path)
+    store.queue_ops(['m1'], 'delete')
+    store.rollback_ops(store.due_ops(now=0))
+    email = store.get('m1')
+    # Snapshots keep no body
+    assert email['subject'] == 'subject 1' and email['body'] == ''
+    assert sorted(email['labels']) == ['INBOX', 'UNREAD']
+
+
+def test_pending_delete_stays_out_of_resync(tmp_path):
+    store = make_store(tmp_path)
+    store.queue_ops(['m2'], 'delete')
+    # gmail_sync skips stored ids and pending ops; a delete Gmail has not
+    # seen yet is still listed there but must not be fetched back
+    remote_ids = ['m0', 'm1', 'm2', 'm3']
+    skip_ids = store.existing(remote_ids) | store.pending_op_ids()
+    assert [msg_id for msg_id in remote_ids if msg_id not in skip_ids] == ['m3']
+    store.complete_ops(store.due_ops(now=0))
+    assert store.pending_op_ids() == set()
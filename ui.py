@@ -1,25 +1,99 @@
 import streamlit as st
 import socket
 from app import (
-    load_emails_from_local_storage,
-    get_new_emails,
-    parse_email,
+    fetch_emails,
+    get_email_store,
+    load_emails_page,
+    email_cursor,
+    load_email,
+    count_stored_emails,
     get_gmail_service,
     save_emails_to_local_storage,
     send_email,
     save_draft,
     download_attachment,
-    modify_labels,
-    delete_email,
-    move_to_trash,
+    get_attachment_cache,
+    preview_pdf,
+    queue_label_change,
+    queue_archive,
+    queue_trash,
+    queue_delete,
+    flush_pending_ops,
+    get_profile_email,
 )
 import os
 import datetime
+import json
+import threading
+import time
 
-from semantic_search import SemanticSearchEngine
-semantic_engine = SemanticSearchEngine()
+import metrics
+from attachment_ingest import ingest_attachments
+from clustering import daily_digest
+from dedup import find_duplicates
+from accounts import Account, get_account, list_accounts, use_account
+from gmail_sync import sync_mailbox
+from mail_mentor import create_semantic_engine, create_topic_clusterer, worker_status
+from semantic_search import search_accounts
+
+_script_start = time.perf_counter()
+# Emails rendered per page of the list view
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", 25))
+
+@st.cache_resource
+def get_semantic_engine(account):
+    # One engine per account and process, shared by all sessions and
+    # reruns; they share one model, which warms up in the background while
+    # the first page renders
+    engine = create_semantic_engine(account)
+    engine.warm_up()
+    return engine
+
+@st.cache_resource
+def get_topic_clusterer(account):
+    return create_topic_clusterer(account)
+
+@st.cache_resource
+def get_startup_state():
+    return {'process_start': time.perf_counter(), 'cold_recorded': False}
+
+@st.cache_resource
+def get_ingest_state(account):
+    # One background attachment ingestion per account and process
+    return {'thread': None, 'done': 0, 'total': 0}
+
+# The session's account; app.py helpers called during this run use its shard
+ACCOUNT = st.session_state.get('account') or os.getenv("MAIL_ACCOUNT") or list_accounts()[0]
+use_account(ACCOUNT)
+semantic_engine = get_semantic_engine(ACCOUNT)
+
+def gmail():
+    # Gmail service of the session's account, connected on first use
+    services = st.session_state.setdefault('services', {})
+    if ACCOUNT not in services:
+        services[ACCOUNT] = get_gmail_service(get_account(ACCOUNT).token_path)
+    return services[ACCOUNT]
 #--------*****-----
 
+def record_first_render():
+    # Time-to-first-render per session: "cold" for the first session of a
+    # process (measured from process start), "warm" for later sessions.
+    # Appended to startup_times.jsonl so changes can be compared over time.
+    if st.session_state.get('first_render_recorded'):
+        return
+    st.session_state.first_render_recorded = True
+    startup = get_startup_state()
+    now = time.perf_counter()
+    if not startup['cold_recorded']:
+        startup['cold_recorded'] = True
+        kind, seconds = 'cold', now - min(startup['process_start'], _script_start)
+    else:
+        kind, seconds = 'warm', now - _script_start
+    with open('startup_times.jsonl', 'a') as f:
+        f.write(json.dumps({'kind': kind, 'seconds': round(seconds, 3),
+                            'at': datetime.datetime.now().isoformat()}) + "\n")
+    st.sidebar.caption(f"First render: {seconds:.2f}s ({kind})")
+
 def check_internet_connection():
     try:
         socket.create_connection(("8.8.8.8", 53), timeout=3)
@@ -28,37 +102,71 @@ def check_internet_connection():
         return False
 
 def refresh_emails(label=None):
-    stored_emails = load_emails_from_local_storage() or []
-    # If label is "SENT", fetch sent emails from Gmail
+    # If label is "SENT", fetch the latest sent emails from Gmail
     if label == "SENT":
-        service = st.session_state.service
+        service = gmail()
         sent_msgs = service.users().messages().list(userId='me', labelIds=['SENT'], maxResults=50).execute().get('messages', [])
-        sent_ids = {email['id'] for email in stored_emails if 'SENT' in email.get('labels', [])}
-        new_sent = [msg for msg in sent_msgs if msg['id'] not in sent_ids]
-        parsed_emails = []
-        for msg in new_sent:
-            email = parse_email(service, msg['id'])
+        stored = get_email_store().existing(msg['id'] for msg in sent_msgs)
+        fetched = fetch_emails([msg['id'] for msg in sent_msgs if msg['id'] not in stored])
+        for email in fetched:
             if 'SENT' not in email.get('labels', []):
                 email['labels'].append('SENT')
-            parsed_emails.append(email)
-        stored_emails.extend(parsed_emails)
-        save_emails_to_local_storage(stored_emails)
-        return stored_emails
+        save_emails_to_local_storage(fetched)
+        return fetched
     else:
-        # Default: fetch inbox and others as before
-        new_messages = get_new_emails(st.session_state.service, stored_emails)
-        if new_messages:
-            parsed_emails = []
-            for msg in new_messages:
-                email = parse_email(st.session_state.service, msg['id'])
-                parsed_emails.append(email)
-            stored_emails.extend(parsed_emails)
-            save_emails_to_local_storage(stored_emails)
-        return stored_emails
+        # Default: apply Gmail history changes since the last sync
+        progress = st.progress(0)
+        removed_ids = sync_mailbox(
+            gmail(),
+            on_progress=lambda done, total: progress.progress(done / total),
+        )
+        semantic_engine.remove_from_index(removed_ids)
+
+def start_attachment_ingest(service):
+    account = ACCOUNT
+    state = get_ingest_state(account)
+    if state['thread'] is not None and state['thread'].is_alive():
+        return
+
+    def on_progress(done, total):
+        state['done'], state['total'] = done, total
+
+    def run():
+        use_account(account)
+        ingest_attachments(
+            get_email_store(), semantic_engine,
+            lambda msg_id, att_id: download_attachment(service, msg_id, att_id),
+            workers=int(os.getenv("ATTACHMENT_WORKERS", 0)) or None,
+            on_progress=on_progress,
+        )
+
+    state['done'] = state['total'] = 0
+    state['thread'] = threading.Thread(target=run, daemon=True)
+    state['thread'].start()
+
+def add_account():
+    # Button callback: runs before the next script run, so it may switch
+    # the account selectbox; connecting then starts the OAuth flow
+    name = st.session_state.get('new_account', '').strip()
+    try:
+        Account(name).create()
+    except ValueError as e:
+        st.session_state.account_error = str(e)
+        return
+    st.session_state.account = name
 
 def render_sidebar():
     with st.sidebar:
         st.title("Mail Mentor")
+        accounts = list_accounts()
+        if ACCOUNT not in accounts:
+            accounts.append(ACCOUNT)
+        st.selectbox("Account", accounts, index=accounts.index(ACCOUNT), key="account")
+        with st.expander("➕ Add account"):
+            st.text_input("Account name", key="new_account")
+            st.button("Add", on_click=add_account)
+            if st.session_state.get('account_error'):
+                st.error(st.session_state.pop('account_error'))
         if st.button("🖊 Compose"):
             st.session_state.current_view = "compose"
         st.markdown("---")
@@ -77,73 +185,300 @@ def render_sidebar():
         if st.button("📝 Drafts"):
             st.session_state.current_view = "drafts"
             st.session_state.filter_label = "DRAFT"
+        if st.button("📰 Daily digest"):
+            st.session_state.current_view = "digest"
         if st.button("🔄 Refresh"):
             st.session_state.refresh = True
+        worker = worker_status(get_email_store())
+        if st.button("📎 Index attachments"):
+            if worker:
+                get_email_store().enqueue_job('attachments')
+            else:
+                start_attachment_ingest(gmail())
+        if worker:
+            progress = f" {worker['done']}/{worker['total']}" if worker['total'] else ""
+            st.caption(f"Sync worker: {worker['stage']}{progress}")
+        ingest = get_ingest_state(ACCOUNT)
+        if ingest['thread'] is not None and ingest['thread'].is_alive():
+            st.caption(f"Indexing attachments: {ingest['done']}/{ingest['total'] or '?'}")
+        stats = get_attachment_cache().get_stats()
+        st.caption(f"Attachment cache: {stats['hits'] + stats['preview_hits']} hits, "
+                   f"{stats['misses'] + stats['preview_misses']} misses, "
+                   f"{stats['bytes'] / 2**20:.1f} of {stats['max_bytes'] / 2**20:.0f} MB")
+        render_write_behind_status(get_email_store())
+        if metrics.enabled():
+            render_metrics_panel()
+
+def render_write_behind_status(store):
+    pending = store.pending_op_count()
+    status = store.get_meta('write_behind') or {}
+    if pending:
+        error = f" (last error: {status['last_error']})" if status.get('last_error') else ""
+        st.caption(f"{pending} changes waiting for Gmail{error}")
+    failures = status.get('failures')
+    if failures:
+        with st.expander(f"⚠️ {len(failures)} changes rejected by Gmail"):
+            st.caption("These emails were restored to their state in Gmail.")
+            for failure in reversed(failures[-10:]):
+                st.caption(f"{failure['op']} {failure['id']}: {failure['error']}")
+
+def format_labels(labels):
+    return ', '.join(f"{key}={value}" for key, value in labels.items())
+
+def render_metrics_panel():
+    # Debug panel (METRICS=1): span timings of this process, slowest first,
+    # then counters, errors and the latest spans
+    with st.expander("🩺 Metrics"):
+        summary = metrics.summary()
+        spans = sorted(summary['spans'], key=lambda s: s['mean_ms'] * s['count'], reverse=True)
+        st.dataframe([{
+            'span': span['name'],
+            'labels': format_labels(span['labels']),
+            'count': span['count'],
+            'mean ms': round(span['mean_ms'], 2),
+            'p50 ms': None if span['p50_ms'] is None else round(span['p50_ms'], 2),
+            'p99 ms': None if span['p99_ms'] is None else round(span['p99_ms'], 2),
+            'max ms': round(span['max_ms'], 2),
+        } for span in spans], use_container_width=True)
+        if summary['counters']:
+            st.dataframe([{'counter': counter['name'], 'labels': format_labels(counter['labels']),
+                           'value': counter['value']} for counter in summary['counters']],
+                         use_container_width=True)
+        for error in metrics.recent_errors()[:10]:
+            st.caption(f"⚠️ {time.strftime('%H:%M:%S', time.localtime(error['time']))} "
+                       f"{error['source']}: {error['error']}")
+        st.caption("Latest spans")
+        st.dataframe([{
+            'time': time.strftime('%H:%M:%S', time.localtime(record['time'])),
+            'span': record['name'],
+            'labels': format_labels(record['labels']),
+            'ms': round(record['ms'], 2),
+        } for record in metrics.recent_spans(50)], use_container_width=True)
+        st.download_button("Prometheus export", metrics.prometheus_text(), file_name="metrics.prom")
+        if st.button("Reset metrics"):
+            metrics.reset()
+
+def render_email_detail(email):
+    # Full message (body, attachments, actions) for the one opened email
+    st.markdown(f"**From:** {email.get('sender', 'Unknown')}")
+    st.markdown(f"**To:** {email.get('to', '')}")
+    st.markdown(f"**Date:** {email.get('date', '')}")
+    st.markdown(f"**Labels:** {', '.join(email.get('labels', []))}")
+    if email.get('matched_passage'):
+        st.info(f"Best match: …{email['matched_passage']}…")
+    if email.get('matched_attachment'):
+        match = email['matched_attachment']
+        st.info(f"📎 {match['filename']}, page {match['page']}: …{match['passage']}…")
+    st.write(email.get('body', ''))
+    # Attachments
+    for i, att in enumerate(email.get('attachments', [])):
+        if st.button(
+            f"Download {att['filename']}",
+            key=f"att_{email['id']}_{i}"
+        ):
+            data = download_attachment(gmail(), email['id'], att['attachment_id'])
+            st.download_button("Download", data, file_name=att['filename'], key=f"dl_{email['id']}_{i}")
+        if att.get('mimeType') == 'application/pdf' and st.button(
+            f"Preview {att['filename']}",
+            key=f"pre_{email['id']}_{i}"
+        ):
+            data = download_attachment(gmail(), email['id'], att['attachment_id'])
+            if data:
+                preview_pdf(data, att['filename'])
+    # Actions change the store at once; Gmail is updated by the write-behind flush
+    cols = st.columns(5)
+    if cols[0].button("Delete", key=f"del_{email['id']}"):
+        apply_action('delete', [email['id']])
+        st.rerun()
+    if cols[1].button("Move to Trash", key=f"trash_{email['id']}"):
+        apply_action('trash', [email['id']])
+        st.rerun()
+    if cols[2].button("Mark Important", key=f"imp_{email['id']}"):
+        if 'IMPORTANT' not in email['labels']:
+            apply_action('important', [email['id']])
+            st.rerun()
+    if cols[3].button("Archive", key=f"arc_{email['id']}"):
+        if 'ARCHIVE' not in email['labels']:
+            apply_action('archive', [email['id']])
+            st.rerun()
+    if cols[4].button("Reply", key=f"rep_{email['id']}"):
+        st.session_state.current_view = "compose"
+        st.session_state.reply_to = email
+
+def apply_action(action, msg_ids):
+    # One store transaction for all of msg_ids, however many are selected
+    # Also runs as a button callback, outside use_account(ACCOUNT)
+    if action == 'delete':
+        changed = queue_delete(msg_ids, account=ACCOUNT, engine=semantic_engine)
+    elif action == 'trash':
+        changed = queue_trash(msg_ids, account=ACCOUNT, engine=semantic_engine)
+    elif action == 'important':
+        changed = queue_label_change(msg_ids, add_labels=['IMPORTANT'], account=ACCOUNT)
+    else:
+        changed = queue_archive(msg_ids, account=ACCOUNT)
+    if action in ('delete', 'trash'):
+        semantic_engine.remove_from_index(changed)
+    if st.session_state.get('open_email') in changed:
+        st.session_state.open_email = None
+    return changed
 
-def render_email_list(emails):
+def selected_ids():
+    return [key[4:] for key, value in st.session_state.items() if key.startswith('sel_') and value]
+
+def set_selection(msg_ids, value):
+    # Checkbox callback target; widget state may only change before a rerun
+    for msg_id in msg_ids:
+        st.session_state[f"sel_{msg_id}"] = value
+
+def bulk_action(action):
+    # Button callback: the rerun Streamlit does after it shows the result
+    msg_ids = selected_ids()
+    changed = apply_action(action, msg_ids)
+    set_selection(msg_ids, False)
+    st.session_state.bulk_result = f"{action.capitalize()}: {len(changed)} emails"
+
+def render_bulk_bar(page_ids):
+    selected = selected_ids()
+    cols = st.columns([2, 1, 1, 1, 1, 1, 1])
+    cols[0].caption(f"{len(selected)} selected")
+    cols[1].button("Select page", key="bulk_select", on_click=set_selection, args=(page_ids, True))
+    cols[2].button("Clear", key="bulk_clear", on_click=set_selection, args=(selected, False),
+                   disabled=not selected)
+    for col, (action, label) in zip(cols[3:], [('archive', "🗃️ Archive"), ('important', "⭐ Important"),
+                                               ('trash', "🗑️ Trash"), ('delete', "❌ Delete")]):
+        col.button(label, key=f"bulk_{action}", on_click=bulk_action, args=(action,), disabled=not selected)
+    if st.session_state.get('bulk_result'):
+        st.toast(st.session_state.pop('bulk_result'))
+
+def open_email(msg_id, account=None):
+    # Button callback; a cross-account result switches to its account so
+    # the actions work on the right mailbox
+    st.session_state.open_email = msg_id
+    if account:
+        st.session_state.account = account
+
+def render_pager(total):
+    pages = max(1, -(-total // PAGE_SIZE))
+    st.session_state.page = min(st.session_state.page, pages - 1)
+    cols = st.columns([1, 2, 1])
+    if cols[0].button("◀ Newer", key="page_prev", disabled=st.session_state.page == 0):
+        st.session_state.page -= 1
+        st.rerun()
+    cols[1].markdown(f"Page {st.session_state.page + 1} of {pages}")
+    if cols[2].button("Older ▶", key="page_next", disabled=st.session_state.page >= pages - 1):
+        st.session_state.page += 1
+        st.rerun()
+
+def render_email_list():
+    """
+    Render one page of the current label (or of the search results).
+    Only PAGE_SIZE rows are built per rerun, they come from the store's
+    label index without bodies, and the body, attachments and actions are
+    loaded for the single opened email only, so rerun cost does not grow
+    with the mailbox.
+    """
+    render_start = time.perf_counter()
     search_query = st.text_input("🔍 Smart Semantic Search...", key="text_search")
-    if search_query:
-        filtered_emails = semantic_engine.smart_search(search_query, emails, top_k=20, min_score=0.5)
-        if not filtered_emails:
+    accounts = list_accounts()
+    all_accounts = len(accounts) > 1 and st.checkbox("Search all accounts", key="search_all")
+    label = st.session_state.get("filter_label")
+    # Back to the first page whenever the account, label or query changes
+    if st.session_state.get('list_key') != (ACCOUNT, label, search_query, all_accounts):
+        st.session_state.list_key = (ACCOUNT, label, search_query, all_accounts)
+        st.session_state.page = 0
+        st.session_state.page_cursors = {}
+        st.session_state.open_email = None
+
+    search_ms = 0.0
+    stats = None
+    if search_query and all_accounts:
+        search_start = time.perf_counter()
+        with st.spinner("Loading search model..." if not semantic_engine.model_ready else "Searching..."):
+            results = search_accounts(search_query, {
+                name: (get_semantic_engine(name), get_email_store(name)) for name in accounts
+            }, top_k=20, min_score=0.5)
+        search_ms = (time.perf_counter() - search_start) * 1000
+        if not results:
+            st.info("No emails found matching your query.")
+            return
+        st.write(f"🔍 Found {len(results)} matching emails in {len(accounts)} accounts")
+        total = len(results)
+        start = st.session_state.page * PAGE_SIZE
+        page_emails = results[start:start + PAGE_SIZE]
+    elif search_query:
+        search_start = time.perf_counter()
+        with st.spinner("Loading search model..." if not semantic_engine.model_ready else "Searching..."):
+            results = semantic_engine.smart_search(
+                search_query, None, top_k=20, min_score=0.5, store=get_email_store()
+            )
+            # Mail whose attachments match is listed after the message hits
+            by_id = {email['id']: email for email in results}
+            for hit in semantic_engine.search_attachments(
+                search_query, get_email_store(), top_k=10, min_score=0.5
+            ):
+                if hit['id'] in by_id:
+                    by_id[hit['id']]['matched_attachment'] = hit['matched_attachment']
+                else:
+                    results.append(hit)
+        search_ms = (time.perf_counter() - search_start) * 1000
+        stats = semantic_engine.search_stats()
+        if not results:
             st.info("No emails found matching your query.")
             return
-        st.write(f"🔍 Found {len(filtered_emails)} matching emails")
+        st.write(f"🔍 Found {len(results)} matching emails")
+        total = len(results)
+        start = st.session_state.page * PAGE_SIZE
+        page_emails = results[start:start + PAGE_SIZE]
     else:
-        label = st.session_state.get("filter_label")
-        if label:
-            filtered_emails = [
-                email for email in emails
-                if label.lower() in [l.lower() for l in email.get('labels', [])]
-            ]
-        else:
-            filtered_emails = emails
-
-    if not filtered_emails:
+        total = count_stored_emails(label)
+        # Each page remembers where the next one starts, so paging seeks
+        # in the index; OFFSET is only the fallback for an unvisited page
+        cursors = st.session_state.page_cursors
+        page_emails = load_emails_page(
+            label, offset=st.session_state.page * PAGE_SIZE, limit=PAGE_SIZE, with_body=False,
+            after=cursors.get(st.session_state.page)
+        )
+        if page_emails:
+            cursors[st.session_state.page + 1] = email_cursor(page_emails[-1]['id'])
+
+    if not page_emails:
         st.info("No emails to display.")
-    else:
-        for idx, email in enumerate(filtered_emails):
-            with st.expander(f"{email.get('subject', '(No Subject)')} - {email.get('sender', 'Unknown')}"):
-                st.markdown(f"**From:** {email.get('sender', 'Unknown')}")
-                st.markdown(f"**To:** {email.get('to', '')}")
-                st.markdown(f"**Date:** {email.get('date', '')}")
-                st.markdown(f"**Labels:** {', '.join(email.get('labels', []))}")
-                st.write(email.get('body', ''))
-                # Attachments
-                for i, att in enumerate(email.get('attachments', [])):
-                    if st.button(
-                        f"Download {att['filename']}",
-                        key=f"att_{email['id']}_{idx}_{i}"
-                    ):
-                        data = download_attachment(st.session_state.service, email['id'], att['attachment_id'])
-                        st.download_button("Download", data, file_name=att['filename'], key=f"dl_{email['id']}_{idx}_{i}")
-                # Actions
-                cols = st.columns(5)
-                if cols[0].button("Delete", key=f"del_{email['id']}"):
-                    # Delete from Gmail and local cache
-                    delete_email(st.session_state.service, email['id'])
-                    emails.remove(email)
-                    save_emails_to_local_storage(emails)
-                    st.rerun()
-                if cols[1].button("Move to Trash", key=f"trash_{email['id']}"):
-                    move_to_trash(st.session_state.service, email['id'])
-                    email['labels'].append('TRASH')
-                    save_emails_to_local_storage(emails)
-                    st.rerun()
-                if cols[2].button("Mark Important", key=f"imp_{email['id']}"):
-                    if 'IMPORTANT' not in email['labels']:
-                        modify_labels(st.session_state.service, email['id'], add_labels=['IMPORTANT'])
-                        email['labels'].append('IMPORTANT')
-                        save_emails_to_local_storage(emails)
-                        st.rerun()
-                if cols[3].button("Archive", key=f"arc_{email['id']}"):
-                    if 'ARCHIVE' not in email['labels']:
-                        modify_labels(st.session_state.service, email['id'], add_labels=['ARCHIVE'])
-                        email['labels'].append('ARCHIVE')
-                        save_emails_to_local_storage(emails)
-                        st.rerun()
-                if cols[4].button("Reply", key=f"rep_{email['id']}"):
-                    st.session_state.current_view = "compose"
-                    st.session_state.reply_to = email
+        return
+    # Multi-select works on the active account; cross-account results are
+    # opened (switching account) first
+    selectable = not (search_query and all_accounts)
+    if selectable:
+        render_bulk_bar([email['id'] for email in page_emails])
+    for email in page_emails:
+        opened = st.session_state.get('open_email') == email['id']
+        account = f"[{email['account']}] " if email.get('account') else ""
+        similar = f" (+{email['collapsed']} similar)" if email.get('collapsed') else ""
+        row = st.container()
+        if selectable:
+            check, row = st.columns([1, 30])
+            check.checkbox("Select", key=f"sel_{email['id']}", label_visibility="collapsed")
+        with row.expander(f"{account}{email.get('subject', '(No Subject)')} - {email.get('sender', 'Unknown')}{similar}",
+                         expanded=opened):
+            if opened:
+                # Search results already carry the body; list rows do not
+                full = email if search_query else load_email(email['id'])
+                render_email_detail(full or email)
+            else:
+                st.caption(email.get('snippet') or '')
+                if email.get('matched_attachment'):
+                    match = email['matched_attachment']
+                    st.caption(f"📎 Matched in {match['filename']}, page {match['page']}")
+                st.button("Open", key=f"open_{email['id']}", on_click=open_email,
+                          args=(email['id'], email.get('account')))
+    render_pager(total)
+    render_ms = (time.perf_counter() - render_start) * 1000 - search_ms
+    timing = f"Rendered {len(page_emails)} of {total} emails in {render_ms:.0f} ms"
+    if stats:
+        cached = " (cached)" if stats['result_cache_hits'] else ""
+        timing += f" · search: encode {stats['encode_ms']:.0f} ms, scoring {stats['score_ms']:.0f} ms{cached}"
+    elif search_query:
+        timing += f" · search {search_ms:.0f} ms"
+    st.caption(timing)
 
 def render_compose():
     st.header("Compose Email")
@@ -153,13 +488,13 @@ def render_compose():
     attachment = st.file_uploader("Attachment", type=None)
     if st.button("Send"):
         # Pass attachment file object if present
-        send_email(st.session_state.service, to, subject, body, attachment=attachment if attachment else None)
+        send_email(to, subject, body, attachment=attachment if attachment else None)
         st.success("Email sent!")
         # Add the sent email to local cache immediately
         sent_email = {
             'id': f"local-{datetime.datetime.now().timestamp()}",
             'subject': subject,
-            'sender': st.session_state.service.users().getProfile(userId='me').execute()['emailAddress'],
+            'sender': get_profile_email(),
             'to': to,
             'date': str(datetime.datetime.now()),
             'snippet': body[:100],
@@ -167,17 +502,46 @@ def render_compose():
             'attachments': [],
             'labels': ['SENT']
         }
-        emails = load_emails_from_local_storage() or []
-        emails.append(sent_email)
-        save_emails_to_local_storage(emails)
+        save_emails_to_local_storage([sent_email])
+        st.session_state.embeddings_checked = False
         st.session_state.current_view = "sent"
         st.session_state.filter_label = "SENT"
         st.rerun()
     if st.button("Save as Draft"):
-        save_draft(st.session_state.service, to, subject, body)
+        save_draft(to, subject, body)
         st.success("Draft saved!")
         st.session_state.current_view = "drafts"
 
+def update_topics():
+    # Button callback: the account is passed explicitly, see apply_action
+    with st.spinner("Clustering emails..."):
+        get_topic_clusterer(ACCOUNT).update(semantic_engine.index, get_email_store(ACCOUNT))
+
+def render_digest():
+    st.header("Daily digest")
+    day = st.date_input("Day", value=datetime.date.today(), key="digest_day")
+    store = get_email_store()
+    if worker_status(store):
+        st.button("Update topics", on_click=store.enqueue_job, args=('cluster',))
+    else:
+        st.button("Update topics", on_click=update_topics)
+    stats = store.get_meta('topic_stats')
+    if stats:
+        st.caption(f"Last update: {stats['emails']} emails in {stats['seconds']:.2f}s "
+                   f"(fit {stats['fit_seconds']:.2f}s, assign {stats['assign_seconds']:.2f}s)")
+    digest = daily_digest(store, day)
+    if not digest:
+        st.info("No mail on this day.")
+        return
+    st.write(f"{sum(group['count'] for group in digest)} emails in {len(digest)} topics")
+    for group in digest:
+        with st.expander(f"{group['label']} ({group['count']})", expanded=True):
+            for message in group['messages']:
+                st.markdown(f"**{message['subject'] or '(No Subject)'}** - {message['sender']}")
+                st.caption(message['snippet'] or '')
+            if group['count'] > len(group['messages']):
+                st.caption(f"and {group['count'] - len(group['messages'])} more")
+
 def render_ui():
     st.set_page_config(page_title="Mail Mentor", layout="wide")
     if 'current_view' not in st.session_state:
@@ -190,31 +554,56 @@ def render_ui():
     render_sidebar()
 
     # Gmail service
-    if 'service' not in st.session_state:
+    if ACCOUNT not in st.session_state.get('services', {}):
         with st.spinner("Connecting to Gmail..."):
-            st.session_state.service = get_gmail_service()
+            gmail()
+
+    # With a mail_mentor worker running, the UI only queues work and reads
+    # the store; it picks up the worker's saved indexes on each rerun
+    store = get_email_store()
+    worker = worker_status(store)
+    semantic_engine.reload()
+    # Retries of bulk-action changes; an idle worker flushes them otherwise
+    if not worker and store.pending_op_count():
+        flush_pending_ops()
 
-    # Load or refresh emails
+    # Refresh emails on request only (Sent mail also arrives through the
+    # history delta); the list itself pages straight from the store.
+    # Embeddings are only brought up to date once per session and after
+    # mail was fetched, and only for mail missing from the index.
     label = st.session_state.get('filter_label')
-    if st.session_state.refresh or not os.path.exists('email_cache.json'):
+    emails_changed = not st.session_state.get('embeddings_checked')
+    stored_count = count_stored_emails()
+    if worker:
+        if st.session_state.refresh or stored_count == 0:
+            store.enqueue_job('sync')
+            st.session_state.refresh = False
+            st.toast("Sync queued for the background worker")
+    elif st.session_state.refresh or stored_count == 0:
         with st.spinner("Fetching emails from Gmail..."):
-            emails = refresh_emails(label=label)
+            refresh_emails(label=label)
             st.session_state.refresh = False
-    else:
-        emails = load_emails_from_local_storage() or []
-
-    # Always refresh sent emails when viewing "Sent"
-    if st.session_state.current_view == "sent":
-        emails = refresh_emails(label="SENT")
-
-    emails = semantic_engine.compute_and_save_embeddings(emails)
-    save_emails_to_local_storage(emails)
+            emails_changed = True
 
     # Main view
     if st.session_state.current_view == "compose":
         render_compose()
+    elif st.session_state.current_view == "digest":
+        render_digest()
     else:
-        render_email_list(emails)
+        render_email_list()
+    record_first_render()
+
+    # Embed after the page has rendered so the list never waits on the model
+    if emails_changed and worker:
+        store.enqueue_job('embed')
+        st.session_state.embeddings_checked = True
+    elif emails_changed:
+        with st.spinner("Updating search index..."):
+            find_duplicates(store)
+            semantic_engine.embed_missing(store)
+        update_topics()
+        st.session_state.embeddings_checked = True
 
 if __name__ == "__main__":
     render_ui()
\ No newline at end of file
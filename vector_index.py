@@ -0,0 +1,379 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+import metrics
+from ann_index import IVFIndex
+
+# Above this many vectors unrestricted searches go through the IVF index
+# (see ann_index.py); below it the exact scan is fast enough
+ANN_THRESHOLD = 100_000
+
+# In-memory vector representations. float16 halves and int8 (with one
+# float32 scale per vector) quarters the memory of float32; on disk the
+# vectors are float16 whatever the in-memory choice. int8 scores as fast
+# as float32; numpy converts float16 without SIMD, so float16 scoring is
+# about 5x slower than float32 and only worth it for memory.
+QUANTIZATIONS = {'float32': np.float32, 'float16': np.float16, 'int8': np.int8}
+# Rows decoded at a time when loading and saving
+SCORE_BLOCK = 16384
+# Quantized rows converted per matrix-vector product when scoring; the
+# float32 copy stays in L2 cache, which keeps int8 at float32 speed
+CAST_BLOCK = 512
+# binary_prefilter=1 (or True): candidates per requested result of the
+# binary first pass. Sign bits rank neighbours coarsely; in bench_quant
+# (100k clustered vectors) x300 keeps recall@10 at 0.75, x2000 at 0.97.
+BINARY_OVERSAMPLING = 2000
+
+
+def sign_bits(vectors, words):
+    # One bit per dimension (> 0), packed into words uint64s per vector
+    packed = np.packbits(np.asarray(vectors) > 0, axis=1)
+    padded = np.zeros((len(packed), words * 8), dtype=np.uint8)
+    padded[:, :packed.shape[1]] = packed
+    return padded.view(np.uint64)
+
+
+class VectorIndex:
+    """
+    Persistent cosine-similarity index over email embeddings.
+
+    Vectors are kept L2-normalized in one contiguous matrix (float32 unless
+    quantized, see below) with an id -> row map, so a query is a single
+    matrix-vector product plus a top-k argpartition. On disk the vectors
+    live next to the email cache as a float16 <path>.npy, keyed by the
+    message ids in <path>.json. Only the ids are read at startup; the
+    vectors are memory-mapped and paged in the first time a search or
+    update needs them.
+
+    Once the index holds ann_threshold vectors an IVF index is trained in a
+    background thread and persisted as <path>.ivf.npz; until it is ready,
+    and for small filtered searches, the exact scan is used.
+
+    quantization picks the in-memory representation (see QUANTIZATIONS).
+    binary_prefilter > 0 adds a first pass over one sign bit per dimension:
+    the top_k * binary_prefilter rows closest in Hamming distance are
+    re-scored with the stored vectors and the best top_k returned;
+    1 means BINARY_OVERSAMPLING.
+    """
+
+    def __init__(self, path='email_embeddings', dim=384, ann_threshold=ANN_THRESHOLD, nprobe=32,
+                 quantization='float32', binary_prefilter=0):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization {quantization!r}, expected one of {list(QUANTIZATIONS)}")
+        self.path = path
+        self.dim = dim
+        self.quantization = quantization
+        self.binary_prefilter = BINARY_OVERSAMPLING if binary_prefilter == 1 else int(binary_prefilter)
+        self.ids = []
+        self.id_to_row = {}
+        self._matrix = None
+        # Per-row scales (int8 only) and packed sign bits (binary_prefilter only)
+        self._scales = None
+        self._bits = None
+        # Bumped on every change so background work can tell it went stale
+        self.version = 0
+        self.ann = None
+        self.ann_threshold = ann_threshold
+        self.nprobe = nprobe
+        self._ann_building = False
+        self._lock = threading.Lock()
+        # mtime of the ids file this instance last loaded or wrote
+        self._mtime = None
+        self.load()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, msg_id):
+        return msg_id in self.id_to_row
+
+    @property
+    def matrix(self):
+        # Normalized float32 vectors; a decoded copy unless stored as float32
+        self._page_in()
+        return self._decode(slice(0, len(self.ids)))
+
+    def memory_bytes(self):
+        self._page_in()
+        return sum(array[:len(self.ids)].nbytes for array in (self._matrix, self._scales, self._bits)
+                   if array is not None)
+
+    def _allocate(self, capacity):
+        matrix = np.zeros((capacity, self.dim), dtype=QUANTIZATIONS[self.quantization])
+        scales = np.ones(capacity, dtype=np.float32) if self.quantization == 'int8' else None
+        bits = np.zeros((capacity, -(-self.dim // 64)), dtype=np.uint64) if self.binary_prefilter else None
+        return matrix, scales, bits
+
+    def _store(self, rows, vectors):
+        # Write normalized float32 vectors into rows (index array or slice)
+        if self._scales is not None:
+            scales = np.maximum(np.abs(vectors).max(axis=1), 1e-10) / 127
+            self._matrix[rows] = np.rint(vectors / scales[:, None])
+            self._scales[rows] = scales
+        else:
+            self._matrix[rows] = vectors
+        if self._bits is not None:
+            self._bits[rows] = sign_bits(vectors, self._bits.shape[1])
+
+    def _decode(self, rows):
+        vectors = self._matrix[rows]
+        if self.quantization == 'float32':
+            return vectors
+        vectors = vectors.astype(np.float32)
+        if self._scales is not None:
+            vectors *= self._scales[rows][:, None]
+        return vectors
+
+    def _move_row(self, src, dst):
+        for array in (self._matrix, self._scales, self._bits):
+            if array is not None:
+                array[dst] = array[src]
+
+    def _scores(self, query_vec, rows=None):
+        # Cosine scores of rows (all rows if None) against a normalized query
+        if self.quantization == 'float32':
+            return (self.matrix if rows is None else self._matrix[rows]) @ query_vec
+        size = len(self.ids) if rows is None else len(rows)
+        scores = np.empty(size, dtype=np.float32)
+        buffer = np.empty((min(CAST_BLOCK, size), self.dim), dtype=np.float32)
+        for start in range(0, size, CAST_BLOCK):
+            block = slice(start, min(start + CAST_BLOCK, size)) if rows is None else rows[start:start + CAST_BLOCK]
+            decoded = buffer[:size - start] if size - start < CAST_BLOCK else buffer
+            decoded[:] = self._matrix[block]
+            block_scores = decoded @ query_vec
+            if self._scales is not None:
+                block_scores *= self._scales[block]
+            scores[start:start + CAST_BLOCK] = block_scores
+        return scores
+
+    def _binary_candidates(self, query_vec, rows, count):
+        # The count rows (of rows, or of the whole index) whose sign bits
+        # are closest to the query's
+        bits = self._bits[:len(self.ids)] if rows is None else self._bits[rows]
+        distances = np.bitwise_count(bits ^ sign_bits(query_vec[None], bits.shape[1])).sum(axis=1)
+        top = np.argpartition(distances, count - 1)[:count]
+        return top if rows is None else rows[top]
+
+    def _page_in(self):
+        if self._matrix is not None:
+            return
+        self._matrix, self._scales, self._bits = self._allocate(len(self.ids))
+        if not self.ids:
+            return
+        try:
+            stored = np.load(self.path + '.npy', mmap_mode='r')
+        except (OSError, ValueError) as e:
+            print(f"Error loading embeddings {self.path}: {e}")
+            stored = None
+        if stored is None or stored.shape != (len(self.ids), self.dim):
+            print(f"Embedding store {self.path} does not match its ids, rebuilding")
+            self.ids = []
+            self.id_to_row = {}
+            return
+        for start in range(0, len(self.ids), SCORE_BLOCK):
+            block = slice(start, start + SCORE_BLOCK)
+            self._store(block, np.asarray(stored[block], dtype=np.float32))
+        ann = IVFIndex.load(self.path + '.ivf', nprobe=self.nprobe)
+        if ann is not None and len(ann.assign) == len(self.ids):
+            self.ann = ann
+
+    def _reserve(self, size):
+        self._page_in()
+        if size <= len(self._matrix):
+            return
+        # Grow geometrically so incremental adds stay amortized O(1)
+        capacity = max(size, 2 * len(self._matrix), 1024)
+        grown = self._allocate(capacity)
+        for new, old in zip(grown, (self._matrix, self._scales, self._bits)):
+            if old is not None:
+                new[:len(self.ids)] = old[:len(self.ids)]
+        self._matrix, self._scales, self._bits = grown
+
+    def vectors(self, ids):
+        # Normalized float32 vectors for ids, in order; all ids must be present
+        self._page_in()
+        return self._decode([self.id_to_row[msg_id] for msg_id in ids])
+
+    def add(self, ids, vectors):
+        if not ids:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), self.dim)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-10)
+        with self._lock:
+            self._reserve(len(self.ids) + len(ids))
+            rows = []
+            for msg_id in ids:
+                row = self.id_to_row.get(msg_id)
+                if row is None:
+                    row = len(self.ids)
+                    self.ids.append(msg_id)
+                    self.id_to_row[msg_id] = row
+                rows.append(row)
+            self._store(np.asarray(rows), vectors)
+            if self.ann is not None:
+                self.ann.set_rows(rows, vectors)
+            self.version += 1
+        self._maybe_rebuild_ann()
+
+    def remove(self, ids):
+        removed = 0
+        with self._lock:
+            for msg_id in ids:
+                if msg_id not in self.id_to_row:
+                    continue
+                self._page_in()
+                row = self.id_to_row.pop(msg_id, None)
+                if row is None:
+                    continue
+                # Move the last row into the hole to keep the matrix contiguous
+                last = len(self.ids) - 1
+                if row != last:
+                    last_id = self.ids[last]
+                    self._move_row(last, row)
+                    self.ids[row] = last_id
+                    self.id_to_row[last_id] = row
+                    if self.ann is not None:
+                        self.ann.move(last, row)
+                self.ids.pop()
+                removed += 1
+            if removed:
+                if self.ann is not None:
+                    self.ann.truncate(len(self.ids))
+                self.version += 1
+        return removed
+
+    def _maybe_rebuild_ann(self):
+        # Train the first IVF index at ann_threshold vectors and retrain
+        # once the index has doubled since the last training
+        if len(self.ids) < self.ann_threshold or self._ann_building:
+            return
+        if self.ann is None or len(self.ids) > 2 * self.ann.trained_size:
+            self.rebuild_ann(background=True)
+
+    def rebuild_ann(self, background=False):
+        self._ann_building = True
+        if background:
+            threading.Thread(target=self._build_ann, daemon=True).start()
+        else:
+            self._build_ann()
+
+    def _build_ann(self):
+        try:
+            version = self.version
+            ann = IVFIndex.build(self.matrix, nprobe=self.nprobe)
+            with self._lock:
+                # Rows changed while training; the next add/search retries
+                if version == self.version:
+                    self.ann = ann
+        except Exception as e:
+            print(f"Error building ANN index {self.path}: {e}")
+        finally:
+            self._ann_building = False
+
+    def search(self, query_vec, top_k=10, min_score=0.5, ids=None, exact=False):
+        """
+        Return [(id, score), ...] for the top_k rows scoring >= min_score.
+        If ids is given, only those ids are considered. exact=True skips
+        the ANN index and the binary first pass.
+        """
+        if not self.ids or top_k <= 0:
+            return []
+        query_vec = np.asarray(query_vec, dtype=np.float32)
+        query_vec = query_vec / (np.linalg.norm(query_vec) + 1e-10)
+        self._page_in()
+        self._maybe_rebuild_ann()
+
+        allowed = None
+        if ids is not None:
+            allowed = np.fromiter(
+                (self.id_to_row[i] for i in ids if i in self.id_to_row), dtype=np.int64
+            )
+        ann = self.ann
+        if not exact and ann is not None and (allowed is None or len(allowed) >= self.ann_threshold):
+            rows = ann.candidate_rows(query_vec)
+            if allowed is not None:
+                mask = np.zeros(len(self.ids), dtype=bool)
+                mask[allowed] = True
+                rows = rows[mask[rows]]
+        elif allowed is not None:
+            rows = allowed
+        else:
+            rows = None
+        prefilter = top_k * self.binary_prefilter
+        if not exact and self._bits is not None and prefilter < (len(self.ids) if rows is None else len(rows)):
+            rows = self._binary_candidates(query_vec, rows, prefilter)
+        if rows is None:
+            scores = self._scores(query_vec)
+        elif rows is allowed and self.quantization == 'float32':
+            # One contiguous scan beats gathering the allowed rows
+            scores = self._scores(query_vec)[rows]
+        else:
+            scores = self._scores(query_vec, rows)
+        if len(scores) == 0:
+            return []
+
+        if top_k < len(scores):
+            top = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        top = top[scores[top] >= min_score]
+        if rows is not None:
+            return [(self.ids[rows[i]], float(scores[i])) for i in top]
+        return [(self.ids[i], float(scores[i])) for i in top]
+
+    def save(self):
+        # float16 halves the file size; precision loss is far below what
+        # cosine ranking can notice. Written block by block so quantized
+        # indexes are never decoded whole.
+        with metrics.span('index.save', index=os.path.basename(self.path)):
+            self._page_in()
+            stored = np.lib.format.open_memmap(self.path + '.tmp.npy', mode='w+', dtype=np.float16,
+                                               shape=(len(self.ids), self.dim))
+            for start in range(0, len(self.ids), SCORE_BLOCK):
+                block = slice(start, min(start + SCORE_BLOCK, len(self.ids)))
+                stored[block] = self._decode(block)
+            stored.flush()
+            del stored
+            with open(self.path + '.tmp.json', 'w') as f:
+                json.dump(self.ids, f)
+            os.replace(self.path + '.tmp.npy', self.path + '.npy')
+            os.replace(self.path + '.tmp.json', self.path + '.json')
+            self._mtime = os.path.getmtime(self.path + '.json')
+            if self.ann is not None:
+                self.ann.save(self.path + '.ivf')
+            elif os.path.exists(self.path + '.ivf.npz'):
+                os.remove(self.path + '.ivf.npz')
+
+    def load(self):
+        # Read the row ids only; vectors are paged in lazily by _page_in
+        if not (os.path.exists(self.path + '.npy') and os.path.exists(self.path + '.json')):
+            return
+        try:
+            with open(self.path + '.json', 'r') as f:
+                ids = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error loading embedding ids {self.path}: {e}")
+            return
+        self._mtime = os.path.getmtime(self.path + '.json')
+        self._matrix = self._scales = self._bits = None
+        self.ann = None
+        self.ids = ids
+        self.id_to_row = {msg_id: row for row, msg_id in enumerate(ids)}
+        self.version += 1
+
+    def reload_if_changed(self):
+        # Pick up a save made by another process, e.g. the mail_mentor
+        # worker; cheap enough to call on every UI rerun
+        try:
+            mtime = os.path.getmtime(self.path + '.json')
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        with self._lock:
+            self.load()
+        return True
@@ -0,0 +1,175 @@
+import asyncio
+import random
+import time
+from collections import defaultdict
+
+from email_parser import parse_message
+from gmail_async import GmailAPIError
+
+# Write-behind flush of the store's pending_ops log (EmailStore.queue_ops).
+# Bulk actions change the local store right away and only log the change;
+# flush_ops then pushes the coalesced log to Gmail: deletes through
+# messages.batchDelete, label changes grouped by identical delta through
+# messages.batchModify, trashes concurrently through messages.trash.
+# Transient failures are retried with jittered backoff; changes Gmail
+# rejects for good are rolled back to the snapshot taken when the first
+# change of a message was queued; snapshots keep no body, so a rolled-back
+# delete re-reads its message from Gmail.
+
+# Labels that exist only in the local store. The app archives by adding
+# ARCHIVE locally; in Gmail archiving is removing INBOX, which the same
+# action does.
+LOCAL_LABELS = {'ARCHIVE'}
+MAX_ATTEMPTS = 6
+RETRY_DELAY = 30
+MAX_RETRY_DELAY = 3600
+# Most recent rolled-back changes kept for the UI in the 'write_behind' meta key
+RECENT_FAILURES = 50
+
+_flush_locks = {}
+
+
+def label_delta(op):
+    # (add, remove) turning Gmail's labels (the snapshot) into the local ones
+    before = set(op['snapshot'].get('labels') or []) - LOCAL_LABELS
+    after = set(op['labels'] or []) - LOCAL_LABELS
+    if op['op'] == 'trash':
+        # messages.trash itself moves the message; other label edits made
+        # before trashing are dropped
+        return (), ()
+    return tuple(sorted(after - before)), tuple(sorted(before - after))
+
+
+def is_permanent(error):
+    return isinstance(error, GmailAPIError) and 400 <= error.status < 500 and error.status != 429
+
+
+def is_gone(error):
+    return isinstance(error, GmailAPIError) and error.status == 404
+
+
+class FlushResult:
+    def __init__(self):
+        self.done = {}
+        self.retry = {}
+        self.failed = {}
+
+    def fail(self, ops, error):
+        for op in ops:
+            if is_permanent(error) or op['attempts'] + 1 >= MAX_ATTEMPTS:
+                self.failed[op['message_id']] = (op, error)
+            else:
+                self.retry[op['message_id']] = (op, error)
+
+
+async def _flush_deletes(client, ops, result):
+    try:
+        await client.batch_delete([op['message_id'] for op in ops])
+    except Exception as e:
+        result.fail(ops, e)
+    else:
+        result.done.update((op['message_id'], op) for op in ops)
+
+
+async def _flush_trashes(client, ops, result):
+    errors = await client.trash_many([op['message_id'] for op in ops])
+    for op in ops:
+        error = errors.get(op['message_id'])
+        if error is None or is_gone(error):
+            result.done[op['message_id']] = op
+        else:
+            result.fail([op], error)
+
+
+async def _flush_labels(client, add, remove, ops, result):
+    try:
+        await client.batch_modify([op['message_id'] for op in ops], list(add), list(remove))
+    except Exception as e:
+        if not is_permanent(e) or len(ops) == 1:
+            result.fail(ops, e)
+            return
+        # One bad id (e.g. a label Gmail does not accept on it) fails the
+        # whole batch; modify one by one to find the offenders
+        outcomes = await asyncio.gather(
+            *(client.modify(op['message_id'], list(add), list(remove)) for op in ops),
+            return_exceptions=True
+        )
+        for op, outcome in zip(ops, outcomes):
+            if isinstance(outcome, Exception):
+                result.fail([op], outcome)
+            else:
+                result.done[op['message_id']] = op
+    else:
+        result.done.update((op['message_id'], op) for op in ops)
+
+
+async def _refetch(client, ops):
+    # Parsed emails of the ops' messages; ones that cannot be read are left out
+    messages = await asyncio.gather(*(client.get_message(op['message_id']) for op in ops),
+                                    return_exceptions=True)
+    return {op['message_id']: parse_message(msg) for op, msg in zip(ops, messages)
+            if not isinstance(msg, Exception)}
+
+
+async def flush_ops(store, client, now=None):
+    """
+    Push the due pending changes of store to Gmail and reconcile the log.
+    Returns {'done', 'retried', 'rolled_back'} counts plus 'restored', the
+    ids of rolled-back deletes and trashes, which the caller should put
+    back in the search index. Flushes of the same store are serialized,
+    so concurrent calls never send a change twice.
+    """
+    lock = _flush_locks.setdefault(store.path, asyncio.Lock())
+    async with lock:
+        now = time.time() if now is None else now
+        ops = store.due_ops(now)
+        if not ops:
+            return {'done': 0, 'retried': 0, 'rolled_back': 0, 'restored': []}
+        result = FlushResult()
+        groups = defaultdict(list)
+        deletes, trashes = [], []
+        for op in ops:
+            if op['op'] == 'delete':
+                deletes.append(op)
+                continue
+            if op['op'] == 'trash':
+                trashes.append(op)
+                continue
+            add, remove = label_delta(op)
+            if add or remove:
+                groups[add, remove].append(op)
+            else:
+                # Changes that cancelled out (or only touched local labels)
+                result.done[op['message_id']] = op
+
+        tasks = [_flush_labels(client, add, remove, group, result) for (add, remove), group in groups.items()]
+        if deletes:
+            tasks.append(_flush_deletes(client, deletes, result))
+        if trashes:
+            tasks.append(_flush_trashes(client, trashes, result))
+        await asyncio.gather(*tasks)
+
+        store.complete_ops(result.done.values())
+        for op, error in result.retry.values():
+            delay = min(MAX_RETRY_DELAY, RETRY_DELAY * 2 ** op['attempts'])
+            store.retry_ops([op], str(error), now + random.uniform(delay / 2, delay))
+        restored = []
+        if result.failed:
+            failed = [op for op, error in result.failed.values()]
+            fetched = await _refetch(client, [op for op in failed if op['op'] == 'delete'])
+            restored = store.rollback_ops(failed, fetched)
+        record_flush(store, result, now)
+        return {'done': len(result.done), 'retried': len(result.retry), 'rolled_back': len(result.failed),
+                'restored': restored}
+
+
+def record_flush(store, result, now):
+    status = store.get_meta('write_behind') or {}
+    failures = status.get('failures', [])
+    failures.extend({'id': msg_id, 'op': op['op'], 'error': str(error), 'at': now}
+                    for msg_id, (op, error) in result.failed.items())
+    store.set_meta('write_behind', {
+        'last_flush': now,
+        'last_error': next((str(error) for op, error in result.retry.values()), None),
+        'failures': failures[-RECENT_FAILURES:],
+    })